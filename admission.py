@@ -0,0 +1,167 @@
+"""
+Admission control for generation runs.
+
+At most GENERATION_MAX_CONCURRENT runs execute at once per worker. Later runs
+wait in a FIFO queue and are told their position in it. New work is shed
+up front (HTTP 429 + Retry-After) when the queue is full or the event loop
+is lagging, so an overloaded server fails fast instead of timing out.
+"""
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Optional
+
+from config import (
+    GENERATION_MAX_CONCURRENT,
+    GENERATION_MAX_QUEUE,
+    GENERATION_MAX_LOOP_LAG_MS,
+    GENERATION_RETRY_AFTER_SECONDS,
+)
+
+
+class Overloaded(Exception):
+    """Raised when new generation work should be rejected."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """A run waiting in the admission queue."""
+
+    def __init__(self):
+        self.admitted = False
+        # Set whenever the queue ahead of this run changes
+        self.changed = asyncio.Event()
+
+
+class AdmissionController:
+    """Concurrency limit plus a fair waiting queue for generation runs.
+
+    Must be used from the event loop thread only.
+    """
+
+    # How often the event loop lag is sampled, in seconds
+    LAG_PROBE_INTERVAL = 0.1
+    # Share of the peak lag kept after each probe
+    LAG_DECAY = 0.9
+
+    def __init__(
+        self,
+        max_concurrent: int = GENERATION_MAX_CONCURRENT,
+        max_queue: int = GENERATION_MAX_QUEUE,
+        max_loop_lag_ms: float = GENERATION_MAX_LOOP_LAG_MS,
+        retry_after: int = GENERATION_RETRY_AFTER_SECONDS,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_loop_lag_ms = max_loop_lag_ms
+        self.retry_after = retry_after
+        self._active = 0
+        self._queue: Deque[_Waiter] = deque()
+        self._loop_lag = 0.0
+        self._monitor: Optional[asyncio.Task] = None
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "loop_lag": 0}
+
+    def check(self):
+        """Raise Overloaded if a new run should be shed right now."""
+        if len(self._queue) >= self.max_queue:
+            self.rejected["queue_full"] += 1
+            raise Overloaded("Too many stories are waiting, please try again soon", self.retry_after)
+        if self._loop_lag * 1000 > self.max_loop_lag_ms:
+            self.rejected["loop_lag"] += 1
+            raise Overloaded("The server is busy, please try again soon", self.retry_after)
+
+    @asynccontextmanager
+    async def slot(self, on_position: Optional[Callable[[int], None]] = None):
+        """Hold one run slot, waiting in FIFO order if all are taken.
+
+        on_position(n) is called whenever the run's place in the queue
+        changes, n = 1 meaning it is next.
+        """
+        await self._acquire(on_position)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, on_position):
+        self._ensure_monitor()
+        if self._active < self.max_concurrent and not self._queue:
+            self._active += 1
+            self.admitted += 1
+            return
+
+        waiter = _Waiter()
+        self._queue.append(waiter)
+        position = None
+        try:
+            while not waiter.admitted:
+                current = self._queue.index(waiter) + 1
+                if current != position:
+                    position = current
+                    if on_position:
+                        on_position(position)
+                waiter.changed.clear()
+                await waiter.changed.wait()
+        except BaseException:
+            # Cancelled while queued (e.g. the client went away)
+            if waiter.admitted:
+                self._release()
+            else:
+                self._queue.remove(waiter)
+                self._notify()
+            raise
+        self.admitted += 1
+
+    def _release(self):
+        if self._queue:
+            # Hand the slot straight to the longest waiting run
+            waiter = self._queue.popleft()
+            waiter.admitted = True
+            waiter.changed.set()
+            self._notify()
+        else:
+            self._active -= 1
+
+    def _notify(self):
+        for waiter in self._queue:
+            waiter.changed.set()
+
+    def _ensure_monitor(self):
+        if self._monitor is None or self._monitor.done():
+            self._monitor = asyncio.get_running_loop().create_task(self._watch_loop_lag())
+
+    async def _watch_loop_lag(self):
+        """Track how late the event loop wakes up a sleeping task.
+
+        Keeps a decaying peak, so one long stall still counts for a moment
+        after the loop has caught up. Only probes while runs are active or
+        queued, so an idle worker is not woken up.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while self._active or self._queue:
+                started = loop.time()
+                await asyncio.sleep(self.LAG_PROBE_INTERVAL)
+                sample = max(0.0, loop.time() - started - self.LAG_PROBE_INTERVAL)
+                self._loop_lag = max(sample, self._loop_lag * self.LAG_DECAY)
+        finally:
+            self._loop_lag = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "queued": len(self._queue),
+            "max_concurrent": self.max_concurrent,
+            "loop_lag_ms": round(self._loop_lag * 1000, 1),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+
+# Global admission controller instance
+admission = AdmissionController()
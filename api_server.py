@@ -1,6 +1,6 @@
 # FastAPI server for React frontend integration.
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
@@ -15,13 +15,16 @@ from kid_auth import (
     authenticate_user,
     create_jwt_token,
     verify_jwt_token,
+    decode_jwt_token,
 )
 import os
 from langgraph_server import server
+from admission import admission, Overloaded
 import uvicorn
 import json
 import asyncio
 import logging
+import uuid
 
 app = FastAPI(title="Story Nest API")
 
@@ -32,7 +35,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Accept-Ranges", "Content-Length", "Content-Range"],
+    expose_headers=["Accept-Ranges", "Content-Length", "Content-Range", "X-Run-ID"],
 )
 
 
@@ -70,6 +73,7 @@ import json
 from datetime import datetime
 import hashlib
 from config import OPENAI_API_KEY
+from embeddings import generate_semantic_embedding, get_embedding_model, generate_hash_embedding
 import lancedb
 import base64
 
@@ -294,8 +298,7 @@ async def serve_image(story_id: str, filename: str):
 
 
 
-# Initialize LanceDB and embedding model
-embedding_model = None
+# Initialize LanceDB
 db = None
 stories_table = None
 
@@ -361,67 +364,6 @@ def init_db():
         raise
 
 
-def get_embedding_model():
-    global embedding_model
-    if embedding_model is None:
-        try:
-            print("🔄 Loading OpenAI embedding model...")
-            from langchain_openai import OpenAIEmbeddings
-
-            if not OPENAI_API_KEY:
-                raise ValueError("OPENAI_API_KEY not found")
-
-            embedding_model = OpenAIEmbeddings(
-                api_key=OPENAI_API_KEY, model="text-embedding-3-small"
-            )
-
-            print("✅ OpenAI embedding model loaded successfully")
-        except Exception as e:
-            print(f"❌ Failed to load OpenAI embedding model: {e}")
-            print("⚠️ Falling back to hash-based embeddings")
-            embedding_model = None
-    return embedding_model
-
-
-def generate_semantic_embedding(text: str):
-    """Generate semantic embedding using OpenAI model."""
-    try:
-        embedding_model = get_embedding_model()
-        if embedding_model:
-            embeddings = embedding_model.embed_query(text)
-            # Truncate to 30 dimensions for consistency with existing DB
-            return (
-                embeddings[:30]
-                if len(embeddings) >= 30
-                else embeddings + [0.0] * (30 - len(embeddings))
-            )
-        else:
-            print("⚠️ Using hash-based embedding (OpenAI model not available)")
-            return generate_hash_embedding(text)
-    except Exception as e:
-        print(f"❌ Error generating semantic embedding: {e}")
-        print("⚠️ Falling back to hash-based embedding")
-        return generate_hash_embedding(text)
-
-
-def generate_hash_embedding(text: str):
-    """Fallback: Generate simple hash-based embedding."""
-    # Create a simple but consistent embedding from text
-    text_hash = hashlib.md5(text.lower().encode()).hexdigest()
-    embedding = []
-
-    # Convert hash to 30 features
-    for i in range(0, len(text_hash), 2):
-        val = int(text_hash[i : i + 2], 16) / 255.0 - 0.5
-        embedding.append(val)
-
-    # Ensure exactly 30 dimensions
-    while len(embedding) < 30:
-        embedding.append(0.0)
-
-    return embedding[:30]
-
-
 # Initialize LanceDB on startup
 init_db()
 
@@ -443,6 +385,7 @@ class StoryRequest(BaseModel):
     age: int = 8
     language: str = "en"  # Language code (en, es, de, fr, hi, ja, ko, ar)
     story_data: dict = {}
+    run_id: Optional[str] = None  # Set together with Last-Event-ID to resume a stream
 
 
 class GenerateStoryResponse(BaseModel):
@@ -456,6 +399,7 @@ class ImageRequest(BaseModel):
     age: int
     language: str
     story_id: Optional[str] = None
+    story_run_id: Optional[str] = None  # Story run whose checkpointed state is reused
 
 
 class ImageResponse(BaseModel):
@@ -507,11 +451,35 @@ class StoriesResponse(BaseModel):
     stories: list = []
 
 
+def format_sse_event(event: dict) -> str:
+    """Format a workflow event as an SSE frame, with its sequence ID if any."""
+    if event.get("id") is not None:
+        return f"id: {event['id']}\ndata: {json.dumps(event)}\n\n"
+    return f"data: {json.dumps(event)}\n\n"
+
+
+def shed_load():
+    """Reject new generation work with 429 while this worker is overloaded."""
+    try:
+        admission.check()
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)}
+        )
+
+
 @app.post("/api/stream-story-test")
-async def stream_story_test(request: StoryRequest):
+async def stream_story_test(
+    request: StoryRequest, last_event_id: Optional[int] = Header(None)
+):
     """Stream story generation without auth (testing)."""
     print("⚡ stream_story_test endpoint reached (no auth)")
 
+    # A client-supplied run ID is only honoured when resuming
+    run_id = request.run_id if request.run_id and last_event_id is not None else uuid.uuid4().hex
+    if last_event_id is None:
+        shed_load()
+
     async def event_generator():
         try:
             # Set initial state with test user context
@@ -528,11 +496,12 @@ async def stream_story_test(request: StoryRequest):
                 "result": None,
                 "story_json": {},
                 "story": "",
+                "run_id": run_id,
             }
 
-            # Stream workflow events
-            async for event in server.stream_workflow(initial_state):
-                yield f"data: {json.dumps(event)}\n\n"
+            # Stream workflow events, resuming after Last-Event-ID if given
+            async for event in server.stream_workflow(initial_state, last_event_id):
+                yield format_sse_event(event)
 
         except Exception as e:
             error_event = {"type": "error", "data": {"error": str(e)}}
@@ -541,19 +510,26 @@ async def stream_story_test(request: StoryRequest):
     return StreamingResponse(
         event_generator(),
         media_type="text/event-stream",
-        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "X-Run-ID": run_id},
     )
 
 
 @app.post("/api/stream-story")
 async def stream_story(
-    request: StoryRequest, user_data: dict = Depends(verify_jwt_token)
+    request: StoryRequest,
+    user_data: dict = Depends(verify_jwt_token),
+    last_event_id: Optional[int] = Header(None),
 ):
     """Stream story generation with real-time events."""
     print(
         f"⚡ stream_story endpoint reached for user: {user_data.get('username', 'unknown')}"
     )
 
+    # A client-supplied run ID is only honoured when resuming
+    run_id = request.run_id if request.run_id and last_event_id is not None else uuid.uuid4().hex
+    if last_event_id is None:
+        shed_load()
+
     async def event_generator():
         try:
             # Set initial state with user context
@@ -570,11 +546,12 @@ async def stream_story(
                 "result": None,
                 "story_json": {},
                 "story": "",
+                "run_id": run_id,
             }
 
-            # Stream workflow events
-            async for event in server.stream_workflow(initial_state):
-                yield f"data: {json.dumps(event)}\n\n"
+            # Stream workflow events, resuming after Last-Event-ID if given
+            async for event in server.stream_workflow(initial_state, last_event_id):
+                yield format_sse_event(event)
 
         except Exception as e:
             error_event = {"type": "error", "data": {"error": str(e)}}
@@ -583,15 +560,149 @@ async def stream_story(
     return StreamingResponse(
         event_generator(),
         media_type="text/event-stream",
-        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "X-Run-ID": run_id},
     )
 
 
+@app.websocket("/api/ws")
+async def story_socket(websocket: WebSocket, token: str = ""):
+    """Multiplex all of one user's story, image and audio runs over one WebSocket.
+
+    The client authenticates with ``?token=<jwt>`` and sends JSON actions:
+
+    - ``{"action": "stream_story", ...StoryRequest}`` (``run_id`` + ``last_event_id`` to resume)
+    - ``{"action": "generate_images", ...ImageRequest}``
+    - ``{"action": "generate_audio", ...AudioRequest}``
+
+    An optional ``ref`` is echoed back in the ``run_started`` message so the
+    client can match its action to the run. Every other message is a stream
+    event as sent on ``/api/stream-story``, tagged with its ``run_id``.
+    """
+    try:
+        user_data = decode_jwt_token(token)
+    except HTTPException:
+        await websocket.close(code=4401)
+        return
+
+    await websocket.accept()
+    print(f"🔌 WebSocket connected for user: {user_data.get('username', 'unknown')}")
+
+    send_lock = asyncio.Lock()
+    tasks = set()
+
+    async def send(run_id: str, event: dict):
+        async with send_lock:
+            await websocket.send_json({"run_id": run_id, **event})
+
+    async def run_story(message: dict, run_id: str):
+        request = StoryRequest(**message)
+        last_event_id = message.get("last_event_id")
+        initial_state = {
+            "mode": request.mode,
+            "prompt": request.prompt,
+            "age": request.age,
+            "language": request.language,
+            "story_data": request.story_data,
+            "user_id": user_data["user_id"],
+            "username": user_data["username"],
+            "validator_result": None,
+            "response": None,
+            "result": None,
+            "story_json": {},
+            "story": "",
+            "run_id": run_id,
+        }
+        async for event in server.stream_workflow(initial_state, last_event_id):
+            await send(run_id, event)
+
+    async def run_images(message: dict, run_id: str):
+        request = ImageRequest(**message)
+        async for event in server.stream_images(
+            request.prompt, request.age, request.language, user_data["user_id"], run_id, request.story_run_id
+        ):
+            await send(run_id, event)
+
+    async def run_audio(message: dict, run_id: str):
+        await send(run_id, {"type": "log", "data": {"message": "🎵 Creating audio narration..."}})
+        response = await generate_audio(AudioRequest(**message), user_data)
+        await send(run_id, {"type": "audio_ready", "data": response.dict()})
+
+    actions = {
+        "stream_story": run_story,
+        "generate_images": run_images,
+        "generate_audio": run_audio,
+    }
+
+    async def can_resume(run_id: str) -> bool:
+        """Whether this user owns a story run that is still streaming or checkpointed."""
+        from message_bus import message_bus
+
+        if message_bus.has_channel(run_id, user_data["user_id"]):
+            return True
+        snapshot = await asyncio.to_thread(server.client.load_run_state, run_id, user_data["user_id"])
+        return snapshot is not None
+
+    async def run_action(handler, message: dict, run_id: str):
+        try:
+            await handler(message, run_id)
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            try:
+                await send(run_id, {"type": "error", "data": {"error": str(e)}})
+            except Exception:
+                pass
+
+    try:
+        while True:
+            message = await websocket.receive_json()
+            handler = actions.get(message.get("action"))
+            if handler is None:
+                await send(None, {"type": "error", "data": {"error": f"Unknown action: {message.get('action')}"}})
+                continue
+
+            # A client-supplied run ID is only honoured when resuming one of the user's stories
+            if message["action"] == "stream_story" and message.get("run_id") and message.get("last_event_id") is not None:
+                run_id = message["run_id"]
+                if not await can_resume(run_id):
+                    await send(run_id, {
+                        "type": "error",
+                        "data": {
+                            "code": "run_expired",
+                            "error": "This story stream is no longer available. Please start again.",
+                        },
+                    })
+                    continue
+            else:
+                run_id = uuid.uuid4().hex
+                try:
+                    admission.check()
+                except Overloaded as e:
+                    await send(None, {
+                        "type": "error",
+                        "data": {"code": "overloaded", "error": str(e), "retry_after": e.retry_after},
+                    })
+                    continue
+            await send(run_id, {"type": "run_started", "data": {"action": message["action"], "ref": message.get("ref")}})
+
+            task = asyncio.create_task(run_action(handler, message, run_id))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except (WebSocketDisconnect, ValueError):
+        pass
+    finally:
+        # Runs keep going for STREAM_CANCEL_GRACE_SECONDS so a new connection can resume them
+        for task in tasks:
+            task.cancel()
+        print(f"🔌 WebSocket closed for user: {user_data.get('username', 'unknown')}")
+
+
 @app.post("/api/generate-story", response_model=GenerateStoryResponse)
 async def generate_story(
     request: StoryRequest, user_data: dict = Depends(verify_jwt_token)
 ):
     """Generate story (non-streaming fallback)."""
+    shed_load()
     try:
         initial_state = {
             "mode": request.mode,
@@ -627,6 +738,7 @@ async def generate_images(
     request: ImageRequest, user_data: dict = Depends(verify_jwt_token)
 ):
     """Generate story images or return existing ones from database."""
+    shed_load()
     try:
         print(f"\n🚀 Starting image check for user ({user_data['username']})")
         print(f"📜 Prompt length: {len(request.prompt)} characters")
@@ -689,15 +801,15 @@ async def generate_images(
 
         # --- image generation logic goes here ---
 
-        
-        from langgraph_client import LangGraphModerationClient
-
-        # Create client and call generate_story_images method
-        client = LangGraphModerationClient()
 
-        result_state = client.generate_story_images(
-            prompt=request.prompt, age=request.age, language=request.language, user_id=user_data["user_id"]
-        )
+        async with admission.slot():
+            # Reuse the process-wide client and keep the blocking pipeline off the event loop.
+            # Nobody streams this run, so its events are not buffered
+            result_state = await asyncio.to_thread(
+                server.client.generate_story_images,
+                prompt=request.prompt, age=request.age, language=request.language, user_id=user_data["user_id"],
+                run_id=uuid.uuid4().hex, story_run_id=request.story_run_id,
+            )
 
         # Extract frames data and image paths from result
         frames_data = result_state.get("session_frames", {})
@@ -1017,13 +1129,15 @@ async def save_story(
             for image_path in story.imagePaths:
 
                 if image_path:
-                    if "/story-image/" in image_path:
-                        image_filename = image_path.split("story-images/")[-1]
+                    # Story images live in story_outputs/<run_id>/, served under /story-images/
+                    if "/story-images/" in image_path:
+                        image_relpath = os.path.normpath(image_path.split("/story-images/")[-1])
                     else:
-                        image_filename = (
-                        image_path.split("/")[-1] if "/" in image_path else image_path
-                    )
-                    temp_image_path = os.path.join("story_outputs", image_filename)
+                        image_relpath = image_path.split("/")[-1]
+                    if image_relpath.startswith("..") or os.path.isabs(image_relpath):
+                        continue
+                    image_filename = os.path.basename(image_relpath)
+                    temp_image_path = os.path.join("story_outputs", image_relpath)
 
                     if os.path.exists(temp_image_path):
                         with open(temp_image_path, "rb") as f:
@@ -1327,6 +1441,25 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/api/metrics")
+async def metrics():
+    """Runtime counters for monitoring."""
+    from message_bus import message_bus
+    from pre_guard import pre_guard
+    from response_cache import response_cache
+    from semantic_cache import semantic_cache
+    from surprise_pool import surprise_pool
+
+    return {
+        "message_bus": message_bus.stats(),
+        "admission": admission.stats(),
+        "pre_guard": pre_guard.stats(),
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "surprise_pool": surprise_pool.stats(),
+    }
+
+
 @app.post("/api/clear-sessions")
 async def clear_sessions():
     """Clear all server-side sessions and temporary data."""
@@ -1407,4 +1540,12 @@ async def logout():
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8000, log_level="info")
+    from config import API_WORKERS, MESSAGE_BUS_TRANSPORT
+
+    if API_WORKERS > 1:
+        if MESSAGE_BUS_TRANSPORT != "redis":
+            print("⚠️ Multiple workers without the redis message bus transport: resumed streams may miss events")
+        # Workers need an import string so each process builds its own app
+        uvicorn.run("api_server:app", host="127.0.0.1", port=8000, log_level="info", workers=API_WORKERS)
+    else:
+        uvicorn.run(app, host="127.0.0.1", port=8000, log_level="info")
@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -9,8 +10,114 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")  # Default to gpt-4o-mini
 OPENAI_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.8"))
 OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "4000"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))  # Seconds per request
+OPENAI_FAST_MODEL = os.getenv("OPENAI_FAST_MODEL", OPENAI_MODEL)  # Small model for guards and prompt prep
+
+# Per-node LLM routing: model, temperature, max_tokens and timeout for each
+# workflow node, falling back to the OPENAI_* defaults above. Entries in the
+# LLM_ROUTES env var (JSON) are merged in, e.g.
+# LLM_ROUTES='{"generate_story": {"model": "gpt-4o", "temperature": 0.9}}'
+LLM_ROUTES = {
+    # Guard and detection nodes answer short, fixed formats: small, deterministic, quick
+    "validate_prompt": {"model": OPENAI_FAST_MODEL, "temperature": 0.0, "max_tokens": 400, "timeout": 20},
+    "detect_language": {"model": OPENAI_FAST_MODEL, "temperature": 0.0, "max_tokens": 20, "timeout": 10},
+    "moderate_prompt": {"model": OPENAI_FAST_MODEL, "temperature": 0.0, "max_tokens": 500, "timeout": 20},
+    "fused_guard": {"model": OPENAI_FAST_MODEL, "temperature": 0.0, "max_tokens": 800, "timeout": 20},
+    # Prompt preparation
+    "surprise_mode": {"model": OPENAI_FAST_MODEL, "max_tokens": 500, "timeout": 30},
+    "guided_mode": {"model": OPENAI_FAST_MODEL, "max_tokens": 500, "timeout": 30},
+    "improve_short": {"model": OPENAI_FAST_MODEL, "temperature": 0.5, "max_tokens": 500, "timeout": 30},
+    "improve_long": {"model": OPENAI_FAST_MODEL, "temperature": 0.5, "max_tokens": 500, "timeout": 30},
+    # Story writing uses the main model and settings
+    "generate_story": {},
+    "generate_story_image": {},
+}
+for _node, _params in json.loads(os.getenv("LLM_ROUTES", "{}")).items():
+    LLM_ROUTES.setdefault(_node, {}).update(_params)
 
 # Legacy AWS Configuration (kept for backward compatibility)
 ROLE_NAME = "BUSDV_QA_Bedrock_User"
 REGION_NAME = "us-west-2"
 MODEL_ID = "openai.gpt-oss-20b-1:0"
+
+# Message bus configuration
+MESSAGE_BUS_MAX_EVENTS = int(os.getenv("MESSAGE_BUS_MAX_EVENTS", "5000"))  # Per-run replay buffer size
+MESSAGE_BUS_REPLAY_TTL_SECONDS = float(os.getenv("MESSAGE_BUS_REPLAY_TTL_SECONDS", "120"))  # Replay window after a run ends
+MESSAGE_BUS_TRANSPORT = os.getenv("MESSAGE_BUS_TRANSPORT", "local")  # 'local' or 'redis' (needed for --workers > 1)
+MESSAGE_BUS_REDIS_URL = os.getenv("MESSAGE_BUS_REDIS_URL", "redis://localhost:6379/0")  # Also accepts unix:// socket URLs
+
+# Story chunk coalescing on the SSE stream (interval 0 disables it)
+STREAM_COALESCE_INTERVAL_MS = int(os.getenv("STREAM_COALESCE_INTERVAL_MS", "50"))
+STREAM_COALESCE_MAX_BYTES = int(os.getenv("STREAM_COALESCE_MAX_BYTES", "256"))
+
+# A run nobody is reading is cancelled after this many seconds (time to resume)
+STREAM_CANCEL_GRACE_SECONDS = float(os.getenv("STREAM_CANCEL_GRACE_SECONDS", "10"))
+
+# Prompt guard: 'separate' (validate + moderate calls) or 'fused' (one combined call)
+GUARD_MODE = os.getenv("GUARD_MODE", "separate")
+
+# Local language detection; below this confidence the LLM is asked instead
+LANGUAGE_DETECTION_MIN_CONFIDENCE = float(os.getenv("LANGUAGE_DETECTION_MIN_CONFIDENCE", "0.6"))
+
+# Start writing surprise stories while their prompt is still being moderated
+SPECULATIVE_SURPRISE = os.getenv("SPECULATIVE_SURPRISE", "false").lower() == "true"
+
+# Pool of pre-moderated surprise ideas per (age group, language), refilled in the background
+SURPRISE_POOL_ENABLED = os.getenv("SURPRISE_POOL_ENABLED", "false").lower() == "true"
+SURPRISE_POOL_LOW_WATERMARK = int(os.getenv("SURPRISE_POOL_LOW_WATERMARK", "3"))  # Refill below this many ideas
+SURPRISE_POOL_HIGH_WATERMARK = int(os.getenv("SURPRISE_POOL_HIGH_WATERMARK", "8"))  # Refill up to this many
+SURPRISE_POOL_STORIES = os.getenv("SURPRISE_POOL_STORIES", "false").lower() == "true"  # Also write the stories
+SURPRISE_POOL_PREWARM_LANGUAGES = [
+    language.strip() for language in os.getenv("SURPRISE_POOL_PREWARM_LANGUAGES", "en").split(",") if language.strip()
+]
+SURPRISE_POOL_SEEN_PER_USER = int(os.getenv("SURPRISE_POOL_SEEN_PER_USER", "200"))  # Ideas remembered per user
+
+# Run checkpoints for resuming runs and reusing their state ("" disables)
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", "./checkpoints.sqlite")
+CHECKPOINT_TTL_HOURS = float(os.getenv("CHECKPOINT_TTL_HOURS", "24"))
+
+# Per-run folders in story_outputs (frame JSON and images) are removed after this long
+STORY_OUTPUTS_TTL_HOURS = float(os.getenv("STORY_OUTPUTS_TTL_HOURS", "24"))
+
+# Exact-match cache for answers of deterministic nodes (story writing is not cached)
+RESPONSE_CACHE_NODES = [
+    node.strip()
+    for node in os.getenv(
+        "RESPONSE_CACHE_NODES",
+        "validate_prompt,detect_language,moderate_prompt,fused_guard,improve_short,improve_long",
+    ).split(",")
+    if node.strip()
+]
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "2000"))  # In-memory LRU size
+RESPONSE_CACHE_DB_PATH = os.getenv("RESPONSE_CACHE_DB_PATH", "./response_cache.sqlite")  # Disk tier ("" disables)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "100000"))  # Disk entries kept
+RESPONSE_CACHE_TTL_HOURS = float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "168"))
+
+# Near-duplicate reuse of guard verdicts by prompt embedding similarity. Reject
+# verdicts need a closer match than accept verdicts before they are reused
+GUARD_SEMANTIC_CACHE_ENABLED = os.getenv("GUARD_SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+GUARD_SEMANTIC_POSITIVE_THRESHOLD = float(os.getenv("GUARD_SEMANTIC_POSITIVE_THRESHOLD", "0.95"))  # Cosine similarity
+GUARD_SEMANTIC_NEGATIVE_THRESHOLD = float(os.getenv("GUARD_SEMANTIC_NEGATIVE_THRESHOLD", "0.98"))
+GUARD_SEMANTIC_DIMENSIONS = int(os.getenv("GUARD_SEMANTIC_DIMENSIONS", "256"))  # Embedding size kept
+GUARD_SEMANTIC_MAX_ENTRIES = int(os.getenv("GUARD_SEMANTIC_MAX_ENTRIES", "10000"))  # Verdicts kept per guard prompt
+
+# Per-run budget; a run that exhausts it ends with a budget_exhausted error
+RUN_MAX_ITERATIONS = int(os.getenv("RUN_MAX_ITERATIONS", "3"))  # Passes through the moderation retry loop
+RUN_MAX_LLM_CALLS = int(os.getenv("RUN_MAX_LLM_CALLS", "25"))
+RUN_MAX_TOKENS = int(os.getenv("RUN_MAX_TOKENS", "50000"))
+
+# Local pre-guard: settles obvious prompts before the LLM guard is called
+PRE_GUARD_ENABLED = os.getenv("PRE_GUARD_ENABLED", "true").lower() == "true"
+PRE_GUARD_ACCEPT_THRESHOLD = float(os.getenv("PRE_GUARD_ACCEPT_THRESHOLD", "0.97"))  # P(safe) to accept locally
+PRE_GUARD_REJECT_THRESHOLD = float(os.getenv("PRE_GUARD_REJECT_THRESHOLD", "0.03"))  # P(safe) to reject locally
+PRE_GUARD_LOG_PATH = os.getenv("PRE_GUARD_LOG_PATH", "")  # Log LLM verdicts for training, e.g. ./guard_data/verdicts.jsonl
+PRE_GUARD_MODEL_PATH = os.getenv("PRE_GUARD_MODEL_PATH", "./guard_data/pre_guard_model.json")
+
+# Admission control for generation runs (limits are per worker process)
+GENERATION_MAX_CONCURRENT = int(os.getenv("GENERATION_MAX_CONCURRENT", "8"))  # Runs executing at once
+GENERATION_MAX_QUEUE = int(os.getenv("GENERATION_MAX_QUEUE", "32"))  # Waiting runs before 429
+GENERATION_MAX_LOOP_LAG_MS = float(os.getenv("GENERATION_MAX_LOOP_LAG_MS", "500"))  # Event loop lag before 429
+GENERATION_RETRY_AFTER_SECONDS = int(os.getenv("GENERATION_RETRY_AFTER_SECONDS", "5"))  # Retry-After on 429
+
+# API server processes (more than one needs MESSAGE_BUS_TRANSPORT=redis)
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
@@ -0,0 +1,79 @@
+"""
+Text embeddings for semantic search over saved stories and guard verdicts.
+"""
+
+import hashlib
+
+from config import OPENAI_API_KEY
+
+embedding_model = None
+
+
+def get_embedding_model():
+    global embedding_model
+    if embedding_model is None:
+        try:
+            print("🔄 Loading OpenAI embedding model...")
+            from langchain_openai import OpenAIEmbeddings
+
+            if not OPENAI_API_KEY:
+                raise ValueError("OPENAI_API_KEY not found")
+
+            embedding_model = OpenAIEmbeddings(
+                api_key=OPENAI_API_KEY, model="text-embedding-3-small"
+            )
+
+            print("✅ OpenAI embedding model loaded successfully")
+        except Exception as e:
+            print(f"❌ Failed to load OpenAI embedding model: {e}")
+            print("⚠️ Falling back to hash-based embeddings")
+            embedding_model = None
+    return embedding_model
+
+
+def generate_semantic_embedding(text: str, dimensions: int = 30, fallback: bool = True):
+    """Generate semantic embedding using OpenAI model.
+
+    The stories table stores 30 dimensions; other callers may ask for more.
+    With ``fallback=False`` None is returned instead of a hash-based
+    embedding when the model is not available.
+    """
+    try:
+        embedding_model = get_embedding_model()
+        if embedding_model:
+            embeddings = embedding_model.embed_query(text)
+            # Truncate to the requested dimensions (30 for consistency with existing DB)
+            return (
+                embeddings[:dimensions]
+                if len(embeddings) >= dimensions
+                else embeddings + [0.0] * (dimensions - len(embeddings))
+            )
+        else:
+            if not fallback:
+                return None
+            print("⚠️ Using hash-based embedding (OpenAI model not available)")
+            return generate_hash_embedding(text)
+    except Exception as e:
+        print(f"❌ Error generating semantic embedding: {e}")
+        if not fallback:
+            return None
+        print("⚠️ Falling back to hash-based embedding")
+        return generate_hash_embedding(text)
+
+
+def generate_hash_embedding(text: str):
+    """Fallback: Generate simple hash-based embedding."""
+    # Create a simple but consistent embedding from text
+    text_hash = hashlib.md5(text.lower().encode()).hexdigest()
+    embedding = []
+
+    # Convert hash to 30 features
+    for i in range(0, len(text_hash), 2):
+        val = int(text_hash[i : i + 2], 16) / 255.0 - 0.5
+        embedding.append(val)
+
+    # Ensure exactly 30 dimensions
+    while len(embedding) < 30:
+        embedding.append(0.0)
+
+    return embedding[:30]
@@ -76,6 +76,13 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
   };
 
   const modeInfo = getModeInfo();
+
+  // Place in the server's queue, until the run starts sending other events
+  const lastEvent = events[events.length - 1];
+  const queuePosition: number | null =
+    isStreaming && (lastEvent?.type === "queued" || lastEvent?.type === "position")
+      ? lastEvent.data.position
+      : null;
   const messagesEndRef = useRef<HTMLDivElement>(null);
 
   useEffect(() => {
@@ -352,6 +359,7 @@ p-3 sm:p-4 flex-shrink-0 rounded-t-2xl"
                         storyData.original_prompt || storyData.story_text
                       }
                       autoSaveOnMount={true}
+                      runId={events.find((e) => e.type === "final")?.data?.run_id}
                     />
                   </div>
                 </div>
@@ -393,6 +401,7 @@ p-3 sm:p-4 flex-shrink-0 rounded-t-2xl"
 
           if (storyChunks.length > 0 && !hasCompleteStory) {
             const streamingText = storyChunks.map((e) => e.data).join("");
+            const streamingTitle = events.find((e) => e.type === "story_title")?.data?.title;
             return (
               <div className="flex items-start gap-2 sm:gap-4">
                 <div
@@ -410,6 +419,11 @@ p-3 sm:p-4 flex-shrink-0 rounded-t-2xl"
             max-w-full sm:max-w-4xl animate-pulse transform hover:translate-x-1 
             sm:hover:translate-x-2 transition-transform"
                   >
+                    {streamingTitle && (
+                      <h3 className="text-lg sm:text-xl font-bold text-purple-700 dark:text-purple-300 mb-3">
+                        📖 {streamingTitle}
+                      </h3>
+                    )}
                     <div className="prose prose-sm max-w-none">
                       <p
                         className="text-gray-800 dark:text-gray-200 leading-relaxed whitespace-pre-wrap 
@@ -445,6 +459,26 @@ p-3 sm:p-4 flex-shrink-0 rounded-t-2xl"
         )}
 
 
+        {queuePosition !== null && (
+          <div className="flex items-start gap-2 sm:gap-4 animate-fade-in">
+            <div
+              className="w-6 h-6 sm:w-8 sm:h-8 bg-gradient-to-r from-purple-500 to-pink-500 rounded-full 
+      flex items-center justify-center text-white text-sm sm:text-lg flex-shrink-0 mt-1 shadow-md"
+            >
+              ⏳
+            </div>
+            <div
+              className="flex-1 bg-gradient-to-br from-purple-100 to-pink-100 dark:from-purple-900/30 
+      dark:to-pink-900/30 rounded-2xl sm:rounded-3xl p-3 sm:p-4 shadow-lg border-2 border-purple-200 
+      dark:border-purple-700 max-w-full sm:max-w-3xl"
+            >
+              <span className="text-xs sm:text-sm text-purple-700 dark:text-purple-300 font-bold">
+                {t("waitingInLine").replace("{position}", String(queuePosition))}
+              </span>
+            </div>
+          </div>
+        )}
+
         {isStreaming && events.length === 0 && !activeAnimation && (
           <div className="flex items-start gap-2 sm:gap-4">
             <div
@@ -13,9 +13,10 @@ interface StoryActionsProps {
   size?: 'small' | 'large';
   originalPrompt?: string;
   autoSaveOnMount?: boolean;
+  runId?: string;
 }
 
-const StoryActions: React.FC<StoryActionsProps> = ({ storyTitle, storyText, size = 'large', originalPrompt, autoSaveOnMount = false }) => {
+const StoryActions: React.FC<StoryActionsProps> = ({ storyTitle, storyText, size = 'large', originalPrompt, autoSaveOnMount = false, runId }) => {
   const { t, currentLanguage } = useLanguage();
   const { age } = useApp();
   const { user } = useAuth();
@@ -166,7 +167,8 @@ const StoryActions: React.FC<StoryActionsProps> = ({ storyTitle, storyText, size
           prompt: originalPrompt || storyText,
           age,
           language: currentLanguage.code,
-          story_id: storyId
+          story_id: storyId,
+          story_run_id: runId
         })
       });
 
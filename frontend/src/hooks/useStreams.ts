@@ -1,7 +1,19 @@
 import { useState, useCallback } from "react";
 
 interface StreamEvent {
-  type: "event" | "error" | "final" | "log" | "story_complete" | "story_chunk" | "animation";
+  id?: number;
+  type:
+    | "event"
+    | "error"
+    | "final"
+    | "log"
+    | "story_title"
+    | "story_complete"
+    | "story_chunk"
+    | "animation"
+    | "queued"
+    | "position"
+    | "resumed";
   data: any;
 }
 
@@ -12,6 +24,10 @@ interface UseStreamReturn {
   clearEvents: () => void;
 }
 
+// How often a dropped stream is resumed before giving up
+const MAX_RESUME_ATTEMPTS = 3;
+const RESUME_DELAY_MS = 1000;
+
 export const useStream = (): UseStreamReturn => {
   const [events, setEvents] = useState<StreamEvent[]>([]);
   const [isStreaming, setIsStreaming] = useState(false);
@@ -20,54 +36,102 @@ export const useStream = (): UseStreamReturn => {
     setIsStreaming(true);
     setEvents([]);
 
-    try {
-      const token = localStorage.getItem("token");
-      const headers: Record<string, string> = {
-        "Content-Type": "application/json",
-      };
+    // Run ID and last sequence ID received, used to resume after a drop
+    let runId: string | null = null;
+    let lastEventId: number | null = null;
+    let finished = false;
 
-      if (token) {
-        headers["Authorization"] = `Bearer ${token}`;
-      }
+    for (let attempt = 0; attempt <= MAX_RESUME_ATTEMPTS && !finished; attempt++) {
+      try {
+        const token = localStorage.getItem("token");
+        const headers: Record<string, string> = {
+          "Content-Type": "application/json",
+        };
+
+        if (token) {
+          headers["Authorization"] = `Bearer ${token}`;
+        }
+
+        const body = { ...request };
+        if (runId && lastEventId !== null) {
+          headers["Last-Event-ID"] = String(lastEventId);
+          body.run_id = runId;
+        }
 
-      const response = await fetch("http://localhost:8000/api/stream-story", {
-        method: "POST",
-        headers,
-        body: JSON.stringify(request),
-      });
+        const response = await fetch("http://localhost:8000/api/stream-story", {
+          method: "POST",
+          headers,
+          body: JSON.stringify(body),
+        });
 
-      if (!response.body) throw new Error("No response body");
+        if (response.status === 429) {
+          // Server is shedding load; not worth resuming
+          const retryAfter = response.headers.get("Retry-After") ?? "a few";
+          setEvents((prev) => [
+            ...prev,
+            {
+              type: "error",
+              data: { code: "overloaded", error: `Lots of stories are being created right now. Please try again in ${retryAfter} seconds.` },
+            },
+          ]);
+          finished = true;
+          break;
+        }
+        if (!response.body) throw new Error("No response body");
+        runId = response.headers.get("X-Run-ID") ?? runId;
 
-      const reader = response.body.getReader();
-      const decoder = new TextDecoder();
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
 
-      while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
 
-        const chunk = decoder.decode(value);
-        const lines = chunk.split("\n");
+          // Keep a trailing partial line until the next read completes it
+          buffer += decoder.decode(value, { stream: true });
+          const lines = buffer.split("\n");
+          buffer = lines.pop() ?? "";
 
-        for (const line of lines) {
-          if (line.startsWith("data: ")) {
-            try {
-              const event = JSON.parse(line.slice(6));
-              console.log("Received event:", event);
-              setEvents((prev) => [...prev, event]);
-            } catch (e) {
-              console.error("Failed to parse event:", e);
+          // Apply all events from one read in a single state update
+          const received: StreamEvent[] = [];
+          for (const line of lines) {
+            if (line.startsWith("data: ")) {
+              try {
+                const event = JSON.parse(line.slice(6));
+                console.log("Received event:", event);
+                if (typeof event.id === "number") {
+                  lastEventId = event.id;
+                }
+                received.push(event);
+              } catch (e) {
+                console.error("Failed to parse event:", e);
+              }
             }
           }
+          // A run continued from its checkpoint replays from the start
+          const resumedAt = received.map((event) => event.type).lastIndexOf("resumed");
+          if (resumedAt >= 0) {
+            setEvents(received.slice(resumedAt));
+          } else if (received.length > 0) {
+            setEvents((prev) => [...prev, ...received]);
+          }
+        }
+        finished = true;
+      } catch (error) {
+        if (!runId || lastEventId === null || attempt === MAX_RESUME_ATTEMPTS) {
+          setEvents((prev) => [
+            ...prev,
+            { type: "error", data: "Stream connection failed" },
+          ]);
+          finished = true;
+        } else {
+          await new Promise((resolve) => setTimeout(resolve, RESUME_DELAY_MS));
         }
       }
-    } catch (error) {
-      setEvents((prev) => [
-        ...prev,
-        { type: "error", data: "Stream connection failed" },
-      ]);
-    } finally {
-      setIsStreaming(false);
     }
+
+    setIsStreaming(false);
   }, []);
 
   const clearEvents = useCallback(() => {
@@ -13,6 +13,7 @@ export const ar: Translations = {
   clickToRead: 'اضغط لقراءة القصة',
   listeningToStory: 'الاستماع للقصة...',
   creatingMagic: 'إيقاف الحكاية...',
+  waitingInLine: 'أنت رقم {position} في الانتظار، ستبدأ حكايتك قريبًا...',
   readyToHelp: 'جاهز للمساعدة',
   hopeYouEnjoyed: 'أتمنى أن تكون قد استمتعت بالحكاية ✨',
   chooseTheme: 'اختر موضوع الحكاية',
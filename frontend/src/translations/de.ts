@@ -13,6 +13,7 @@ export const de: Translations = {
   clickToRead: 'Klicke um die ganze Geschichte zu lesen',
   listeningToStory: 'Geschichte anhören...',
   creatingMagic: 'Erstelle deine magische Geschichte...',
+  waitingInLine: 'Du bist Nummer {position} in der Warteschlange, deine Geschichte beginnt gleich...',
   readyToHelp: 'Bereit zu helfen!',
   hopeYouEnjoyed: 'Ich hoffe, dir hat deine magische Geschichte gefallen!',
   chooseTheme: 'Wähle dein Geschichten-Thema',
@@ -13,6 +13,7 @@ export const en: Translations = {
   clickToRead: 'Click to read full story',
   listeningToStory: 'Listening to Story...',
   creatingMagic: 'Creating your magical story...',
+  waitingInLine: 'You\'re number {position} in line, your story starts soon...',
   readyToHelp: 'Ready to help!',
   hopeYouEnjoyed: 'Hope you enjoyed your magical story!',
   chooseTheme: 'Choose Your Story Theme',
@@ -13,6 +13,7 @@ export const es: Translations = {
   clickToRead: 'Haz clic para leer la historia completa',
   listeningToStory: 'Escuchando Historia...',
   creatingMagic: 'Creando tu historia mágica...',
+  waitingInLine: 'Eres el número {position} en la fila, tu historia empieza pronto...',
   readyToHelp: '¡Listo para ayudar!',
   hopeYouEnjoyed: '¡Espero que hayas disfrutado tu historia mágica!',
   chooseTheme: 'Elige el Tema de tu Historia',
@@ -13,6 +13,7 @@ export const fr: Translations = {
   clickToRead: 'Cliquez pour lire l\'histoire complète',
   listeningToStory: 'Écouter l\'Histoire...',
   creatingMagic: 'Création de votre histoire magique...',
+  waitingInLine: 'Tu es numéro {position} dans la file, ton histoire commence bientôt...',
   readyToHelp: 'Prêt à aider !',
   hopeYouEnjoyed: 'J\'espère que vous avez aimé votre histoire magique !',
   chooseTheme: 'Choisissez le Thème de votre Histoire',
@@ -13,6 +13,7 @@ export const hi: Translations = {
   clickToRead: 'पूरी कहानी पढ़ने के लिए क्लिक करें',
   listeningToStory: 'कहानी सुन रहे हैं...',
   creatingMagic: 'आपकी जादुई कहानी बना रहे हैं...',
+  waitingInLine: 'आप कतार में {position} नंबर पर हैं, आपकी कहानी जल्द शुरू होगी...',
   readyToHelp: 'मदद के लिए तैयार!',
   hopeYouEnjoyed: 'आशा है आपको अपनी जादुई कहानी पसंद आई!',
   chooseTheme: 'अपनी कहानी का विषय चुनें',
@@ -13,6 +13,7 @@ export const ja: Translations = {
   clickToRead: 'クリックして全文を読む',
   listeningToStory: 'ストーリーを聞いています...',
   creatingMagic: 'ストーリーを作成中...',
+  waitingInLine: 'あなたは{position}番目です。もうすぐお話が始まります...',
   readyToHelp: '手伝うのに準備できました!',
   hopeYouEnjoyed: 'あなたはこの魔法のストーリーを楽しんでいただけたでしょうか!',
   chooseTheme: 'ストーリーのテーマを選択',
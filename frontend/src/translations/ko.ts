@@ -13,6 +13,7 @@ export const ko: Translations = {
   clickToRead: '전체 이야기를 읽으려면 클릭하세요',
   listeningToStory: '이야기 듣는 중...',
   creatingMagic: '이야기를 만드는 중...',
+  waitingInLine: '대기 순서 {position}번이에요. 곧 이야기가 시작돼요...',
   readyToHelp: '도울 준비가 되었습니다!',
   hopeYouEnjoyed: '마법의 이야기를 즐기셨기를 바랍니다!',
   chooseTheme: '이야기 주제 선택',
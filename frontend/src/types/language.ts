@@ -30,6 +30,7 @@ export type TranslationKey =
   | 'clickToRead'
   | 'listeningToStory'
   | 'creatingMagic'
+  | 'waitingInLine'
   | 'readyToHelp'
   | 'hopeYouEnjoyed'
   | 'chooseTheme'
@@ -7,7 +7,7 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 import random
 import glob
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
 from openai import OpenAI
 import requests
 import base64
@@ -20,111 +20,92 @@ from config import OPENAI_API_KEY
 class ImageGenerator:
     """Handles both real and mock image generation for story frames."""
 
-    def __init__(self, use_mock: bool = True, user_id: str = "user", timestamp: int = None):
+    def __init__(
+        self,
+        use_mock: bool = True,
+        user_id: str = "user",
+        timestamp: int = None,
+        cancel_check: Optional[Callable[[], bool]] = None,
+        output_subdir: str = "",
+    ):
         import time
         self.use_mock = use_mock
         self.user_id = user_id
         self.timestamp = timestamp or int(time.time())
         self.images_dir = os.path.join(os.path.dirname(__file__), "images")
+        # Images go to story_outputs/<output_subdir>, served under /story-images/
+        self.output_subdir = output_subdir
+        self.output_dir = os.path.join(os.path.dirname(__file__), "story_outputs", output_subdir)
+        # Returns True once the run is cancelled; pending frames are then skipped
+        self.cancel_check = cancel_check or (lambda: False)
+        self._client = None
+
+    def _image_url(self, path: str) -> str:
+        """URL of an image written to the output directory."""
+        filename = os.path.basename(path)
+        if self.output_subdir:
+            filename = f"{self.output_subdir}/{filename}"
+        return f"http://localhost:8000/story-images/{filename}"
 
     def generate_images_for_frames(
         self, frames_data: List[Dict[str, Any]], bible: Dict[str, Any]
     ) -> List[str]:
         """Generate images for all frames and return list of image paths."""
-        if self.use_mock:
-            return self._generate_mock_images(frames_data, bible)
-        else:
-            return self._generate_real_images(frames_data, bible)
+        return self.pool().collect(frames_data, bible)
 
-    def _generate_mock_images(self, frames_data: List[Dict[str, Any]], bible: Dict[str, Any]
-    ) -> List[str]:
-        """Generate frame-specific images from existing images folder with parallel processing."""
-        try:
-            from concurrent.futures import ThreadPoolExecutor, as_completed
-            import shutil
-            import os
+    def pool(self, max_workers: int = 5) -> "ImagePool":
+        """Open a pool that renders frames in the background as they are submitted."""
+        if not self.use_mock and self._client is None:
+            if not OPENAI_API_KEY:
+                raise ValueError("OPENAI_API_KEY not found in config")
+            self._client = OpenAI(api_key=OPENAI_API_KEY)
+        return ImagePool(self, max_workers)
 
-            available_images = glob.glob(os.path.join(self.images_dir, "*.png"))
-            available_images.extend(glob.glob(os.path.join(self.images_dir, "*.jpg")))
+    def generate_frame_image(self, i: int, frame: Dict[str, Any], bible: Dict[str, Any]) -> Optional[str]:
+        """Render the image of one frame and return its URL (None once cancelled)."""
+        if self.use_mock:
+            return self._generate_mock_image(i, frame)
+        return self._generate_real_image(i, frame, bible)
 
-            if not available_images:
-                print("⚠️ No images found in images folder, creating placeholders")
-                return [self._create_placeholder_image(f"Frame {i+1}") for i in range(len(frames_data))]
+    def _generate_mock_image(self, i: int, frame: Dict[str, Any]) -> str:
+        """Generate a frame-specific image from the existing images folder."""
+        import shutil
 
-            def _ensure_output_dir():
-                os.makedirs("story_outputs", exist_ok=True)
+        available_images = glob.glob(os.path.join(self.images_dir, "*.png"))
+        available_images.extend(glob.glob(os.path.join(self.images_dir, "*.jpg")))
 
-            def generate_single_mock_image(i: int, frame: Dict[str, Any]):
-                try:
-                    # Select base image
-                    base_image = self._select_base_image_for_frame(frame, available_images, i)
-
-                    # Create filename
-                    frame_title = (
-                        frame.get("title", "Story")
-                        .replace(":", "")
-                        .replace("/", "")
-                        .replace("\\", "")
-                        .replace("?", "")
-                    )
-
-                    base_filename = os.path.basename(base_image)
-                    file_extension = os.path.splitext(base_filename)[1]
-                    new_filename = f"{self.user_id}_{self.timestamp}_frame_{i+1}_{frame_title}{file_extension}"
-
-                    # Copy to story_outputs
-                    _ensure_output_dir()
-                    new_image_path = os.path.join("story_outputs", new_filename)
-                    shutil.copy2(base_image, new_image_path)
-
-                    # Return URL for compatibility with existing code
-                    filename = os.path.basename(new_image_path)
-                    return (i, f"http://localhost:8000/story-images/{filename}")
+        if not available_images:
+            print("⚠️ No images found in images folder, creating placeholder")
+            return self._create_placeholder_image(f"Frame {i+1}")
 
-                except Exception as e:
-                    print(f"⚠️ Failed to generate mock image for frame {i+1}: {e}")
-                    fallback_image = self._create_placeholder_image(f"Frame {i+1}")
-                    return (i, fallback_image)
-
-            # Submit tasks and gather results
-            results = []
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                future_to_index = {
-                    executor.submit(generate_single_mock_image, i, frame): i
-                    for i, frame in enumerate(frames_data)
-                }
-
-                for future in as_completed(future_to_index, timeout=60):
-                    i = future_to_index[future]
-                    try:
-                        result = future.result(timeout=10)
-                        results.append(result)
-                    except Exception as e:
-                        print(f"⚠️ Timeout/error for mock frame {i+1}: {e}")
-                        results.append((i, self._create_placeholder_image(f"Frame {i+1}")))
-
-            # Ensure every frame has a result
-            completed_indices = {idx for idx, _ in results}
-            for idx in range(len(frames_data)):
-                if idx not in completed_indices:
-                    print(f"⚠️ No result for mock frame {idx+1}, adding placeholder.")
-                    results.append((idx, self._create_placeholder_image(f"Frame {idx+1}")))
-
-            results.sort(key=lambda x: x[0])
-            return [res[1] for res in results]
-
-        except ImportError:
-            print("⚠️ Required libraries not available. Using fallback mock generation.")
-            # Fallback to simple sequential processing
-            selected_images = []
-            for i, frame in enumerate(frames_data):
-                try:
-                    frame_image_path = self._create_frame_image(frame, available_images, i, "Story")
-                    selected_images.append(frame_image_path)
-                except Exception as e:
-                    print(f"⚠️ Fallback failed for frame {i+1}: {e}")
-                    selected_images.append(self._create_placeholder_image(f"Frame {i+1}"))
-            return selected_images
+        try:
+            # Select base image
+            base_image = self._select_base_image_for_frame(frame, available_images, i)
+
+            # Create filename
+            frame_title = (
+                frame.get("title", "Story")
+                .replace(":", "")
+                .replace("/", "")
+                .replace("\\", "")
+                .replace("?", "")
+            )
+
+            base_filename = os.path.basename(base_image)
+            file_extension = os.path.splitext(base_filename)[1]
+            new_filename = f"{self.user_id}_{self.timestamp}_frame_{i+1}_{frame_title}{file_extension}"
+
+            # Copy to story_outputs
+            os.makedirs(self.output_dir, exist_ok=True)
+            new_image_path = os.path.join(self.output_dir, new_filename)
+            shutil.copy2(base_image, new_image_path)
+
+            # Return URL for compatibility with existing code
+            return self._image_url(new_image_path)
+
+        except Exception as e:
+            print(f"⚠️ Failed to generate mock image for frame {i+1}: {e}")
+            return self._create_placeholder_image(f"Frame {i+1}")
 
 
     def _create_frame_image(
@@ -148,15 +129,13 @@ class ImageGenerator:
         new_filename = f"{self.user_id}_{self.timestamp}_frame_{frame_index+1}_{frame_title}{file_extension}"
 
         # Copy to story_outputs directory with new name
-        output_dir = os.path.join(os.path.dirname(__file__), "story_outputs")
-        os.makedirs(output_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
 
-        new_image_path = os.path.join(output_dir, new_filename)
+        new_image_path = os.path.join(self.output_dir, new_filename)
         shutil.copy2(base_image, new_image_path)
 
         # Return API URL
-        filename = os.path.basename(new_image_path)
-        return f"http://localhost:8000/story-images/{filename}"
+        return self._image_url(new_image_path)
 
 
     def _select_base_image_for_frame(
@@ -206,149 +185,100 @@ class ImageGenerator:
     from openai import OpenAI
     from config import OPENAI_API_KEY
 
-    def _generate_real_images(self, frames_data: List[Dict[str, Any]], bible: Dict[str, Any]) -> List[str]:
-        """Generate real images using OpenAI image API with parallel processing.
+    def _generate_real_image(self, i: int, frame: Dict[str, Any], bible: Dict[str, Any]) -> Optional[str]:
+        """Generate a real image for one frame using the OpenAI image API.
 
         Handles both URL and base64 (b64_json) image responses.
         """
-        try:
-            from concurrent.futures import ThreadPoolExecutor, as_completed
-            import base64
-            import time
-            import os
-            import requests
-            from openai import OpenAI
-            from config import OPENAI_API_KEY
-
-            if not OPENAI_API_KEY:
-                raise ValueError("OPENAI_API_KEY not found in config")
-
-            client = OpenAI(api_key=OPENAI_API_KEY)
-
-            def _ensure_output_dir():
-                os.makedirs("story_outputs", exist_ok=True)
-
-            def _save_bytes_to_file(img_bytes: bytes, filename_base: str) -> str:
-                _ensure_output_dir()
-                path = os.path.join("story_outputs", f"{filename_base}.png")
-                with open(path, "wb") as f:
-                    f.write(img_bytes)
-                return path
-
-            def _download_from_url(url: str, filename_base: str) -> str:
-                if not url or not isinstance(url, str):
-                    raise ValueError("Empty or invalid URL")
-                if not (url.startswith("http://") or url.startswith("https://")):
-                    raise ValueError(f"Invalid URL scheme: {url!r}")
-                resp = requests.get(url, timeout=20)
-                resp.raise_for_status()
-                return _save_bytes_to_file(resp.content, filename_base)
-
-            def _extract_from_item(item):
-                """Return tuple (url_or_none, b64_or_none) supporting dict or attr-style item."""
-                url = None
-                b64 = None
-                if item is None:
-                    return (None, None)
-                # dict-like
-                if isinstance(item, dict):
-                    url = item.get("url") or item.get("image_url")
-                    b64 = item.get("b64_json") or item.get("b64")
-                else:
-                    # object-like
-                    url = getattr(item, "url", None) or getattr(item, "image_url", None)
-                    b64 = getattr(item, "b64_json", None) or getattr(item, "b64", None)
-                return (url, b64)
-
-            def generate_single_image(i: int, frame: Dict[str, Any]):
-                prompt = self._create_image_prompt(frame, bible)
-                max_attempts = 3
-                backoff_base = 1.0
+        import time
 
-                for attempt in range(1, max_attempts + 1):
+        def _ensure_output_dir():
+            os.makedirs(self.output_dir, exist_ok=True)
+
+        def _save_bytes_to_file(img_bytes: bytes, filename_base: str) -> str:
+            _ensure_output_dir()
+            path = os.path.join(self.output_dir, f"{filename_base}.png")
+            with open(path, "wb") as f:
+                f.write(img_bytes)
+            return path
+
+        def _download_from_url(url: str, filename_base: str) -> str:
+            if not url or not isinstance(url, str):
+                raise ValueError("Empty or invalid URL")
+            if not (url.startswith("http://") or url.startswith("https://")):
+                raise ValueError(f"Invalid URL scheme: {url!r}")
+            resp = requests.get(url, timeout=20)
+            resp.raise_for_status()
+            return _save_bytes_to_file(resp.content, filename_base)
+
+        def _extract_from_item(item):
+            """Return tuple (url_or_none, b64_or_none) supporting dict or attr-style item."""
+            url = None
+            b64 = None
+            if item is None:
+                return (None, None)
+            # dict-like
+            if isinstance(item, dict):
+                url = item.get("url") or item.get("image_url")
+                b64 = item.get("b64_json") or item.get("b64")
+            else:
+                # object-like
+                url = getattr(item, "url", None) or getattr(item, "image_url", None)
+                b64 = getattr(item, "b64_json", None) or getattr(item, "b64", None)
+            return (url, b64)
+
+        prompt = self._create_image_prompt(frame, bible)
+        max_attempts = 3
+        backoff_base = 1.0
+
+        for attempt in range(1, max_attempts + 1):
+            if self.cancel_check():
+                return None
+            try:
+                response = self._client.images.generate(
+                    model="gpt-image-1",
+                    prompt=prompt,
+                    size="1024x1024",
+                    n=1,
+                )
+
+                # Validate response
+                if not response or not getattr(response, "data", None):
+                    raise RuntimeError("Empty response from image API")
+
+                item = response.data[0]
+                image_url, image_b64 = _extract_from_item(item)
+
+                # Prefer URL if valid
+                if image_url:
                     try:
-                        response = client.images.generate(
-                            model="gpt-image-1",
-                            prompt=prompt,
-                            size="1024x1024",
-                            n=1,
-                        )
-
-                        # Validate response
-                        if not response or not getattr(response, "data", None):
-                            raise RuntimeError("Empty response from image API")
-
-                        item = response.data[0]
-                        image_url, image_b64 = _extract_from_item(item)
-
-                        # Prefer URL if valid
-                        if image_url:
-                            try:
-                                image_path = _download_from_url(image_url, f"{self.user_id}_{self.timestamp}_generated_frame_{i+1}")
-                                filename = os.path.basename(image_path)
-                                return (i, f"http://localhost:8000/story-images/{filename}")
-                            except Exception as e:
-                                # Log and fall through to try b64 or retry
-                                print(f"Attempt {attempt}: failed to download URL for frame {i+1}: {e}")
-
-                        # If base64 available, decode and save
-                        if image_b64:
-                            try:
-                                img_bytes = base64.b64decode(image_b64)
-                                image_path = _save_bytes_to_file(img_bytes, f"{self.user_id}_{self.timestamp}_generated_frame_{i+1}")
-                                filename = os.path.basename(image_path)
-                                return (i, f"http://localhost:8000/story-images/{filename}")
-                            except Exception as e:
-                                print(f"Attempt {attempt}: failed to decode b64 for frame {i+1}: {e}")
-
-                        # No usable url or b64 -> raise to trigger retry/fallback
-                        raise RuntimeError("No usable image data (no url and no b64_json) in response")
-
+                        image_path = _download_from_url(image_url, f"{self.user_id}_{self.timestamp}_generated_frame_{i+1}")
+                        return self._image_url(image_path)
                     except Exception as e:
-                        if attempt == max_attempts:
-                            print(f"⚠️ Failed to generate image for frame {i+1} after {attempt} attempts: {e}")
-                            fallback_image = self._create_placeholder_image(f"Frame {i+1}")
-                            return (i, fallback_image)
-                        else:
-                            wait = backoff_base * (2 ** (attempt - 1))
-                            print(f"Attempt {attempt} failed for frame {i+1}: {e}. Retrying in {wait:.1f}s...")
-                            time.sleep(wait)
-                            continue
-
-            # Submit tasks and gather results
-            results = []
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                future_to_index = {
-                    executor.submit(generate_single_image, i, frame): i
-                    for i, frame in enumerate(frames_data)
-                }
+                        # Log and fall through to try b64 or retry
+                        print(f"Attempt {attempt}: failed to download URL for frame {i+1}: {e}")
 
-                try:
-                    for future in as_completed(future_to_index, timeout=180):
-                        i = future_to_index[future]
-                        try:
-                            result = future.result(timeout=30)
-                            results.append(result)
-                        except Exception as e:
-                            print(f"❌ Timeout/error for frame {i+1}: {e}")
-                            results.append((i, self._create_placeholder_image(f"Frame {i+1}")))
-                except Exception as e:
-                    # as_completed timed out or errored; ensure we create placeholders for missing frames
-                    print(f"⚠️ as_completed loop error/timeout: {e}")
-
-            # Ensure every frame has a result (placeholder if missing)
-            completed_indices = {idx for idx, _ in results}
-            for idx in range(len(frames_data)):
-                if idx not in completed_indices:
-                    print(f"⚠️ No result for frame {idx+1}, adding placeholder.")
-                    results.append((idx, self._create_placeholder_image(f"Frame {idx+1}")))
+                # If base64 available, decode and save
+                if image_b64:
+                    try:
+                        img_bytes = base64.b64decode(image_b64)
+                        image_path = _save_bytes_to_file(img_bytes, f"{self.user_id}_{self.timestamp}_generated_frame_{i+1}")
+                        return self._image_url(image_path)
+                    except Exception as e:
+                        print(f"Attempt {attempt}: failed to decode b64 for frame {i+1}: {e}")
 
-            results.sort(key=lambda x: x[0])
-            return [res[1] for res in results]
+                # No usable url or b64 -> raise to trigger retry/fallback
+                raise RuntimeError("No usable image data (no url and no b64_json) in response")
 
-        except ImportError:
-            print("⚠️ Required libraries not installed. Falling back to mock images.")
-            return self._generate_mock_images(frames_data, bible)
+            except Exception as e:
+                if attempt == max_attempts:
+                    print(f"⚠️ Failed to generate image for frame {i+1} after {attempt} attempts: {e}")
+                    return self._create_placeholder_image(f"Frame {i+1}")
+                else:
+                    wait = backoff_base * (2 ** (attempt - 1))
+                    print(f"Attempt {attempt} failed for frame {i+1}: {e}. Retrying in {wait:.1f}s...")
+                    time.sleep(wait)
+                    continue
 
     def _create_image_prompt(self, frame: Dict[str, Any], bible: Dict[str, Any]) -> str:
         """Create an enhanced, production-quality prompt for children's book image generation."""
@@ -445,10 +375,9 @@ class ImageGenerator:
             response.raise_for_status()
 
             # Save to story_outputs folder
-            output_dir = os.path.join(os.path.dirname(__file__), "story_outputs")
-            os.makedirs(output_dir, exist_ok=True)
+            os.makedirs(self.output_dir, exist_ok=True)
 
-            image_path = os.path.join(output_dir, f"{filename}.png")
+            image_path = os.path.join(self.output_dir, f"{filename}.png")
 
             with open(image_path, "wb") as f:
                 f.write(response.content)
@@ -486,22 +415,78 @@ class ImageGenerator:
             draw.text((x, y), text, fill=(255, 255, 255), font=font)
 
             # Save placeholder
-            output_dir = os.path.join(os.path.dirname(__file__), "story_outputs")
-            os.makedirs(output_dir, exist_ok=True)
+            os.makedirs(self.output_dir, exist_ok=True)
 
             filename = f"{self.user_id}_{self.timestamp}_placeholder_{text.replace(' ', '_')}.png"
-            placeholder_path = os.path.join(output_dir, filename)
+            placeholder_path = os.path.join(self.output_dir, filename)
             img.save(placeholder_path)
 
             # Return API URL
-            filename = os.path.basename(placeholder_path)
-            return f"http://localhost:8000/story-images/{filename}"
+            return self._image_url(placeholder_path)
 
         except Exception as e:
             print(f"❌ Failed to create placeholder: {e}")
             return ""
 
 
+class ImagePool:
+    """Renders frame images on worker threads as frames are submitted.
+
+    Frames can be submitted while the story JSON is still streaming in, so
+    image rendering overlaps with LLM decoding. ``collect`` waits for all
+    frames and returns their images in frame order.
+    """
+
+    def __init__(self, generator: ImageGenerator, max_workers: int = 5):
+        self.generator = generator
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = {}
+
+    def submit(self, i: int, frame: Dict[str, Any], bible: Dict[str, Any]):
+        """Start rendering frame ``i`` unless it is already queued."""
+        if i not in self._futures:
+            self._futures[i] = self._executor.submit(self.generator.generate_frame_image, i, frame, bible)
+
+    def collect(self, frames_data: List[Dict[str, Any]], bible: Dict[str, Any], timeout: float = 180) -> List[str]:
+        """Wait for the images of all frames, submitting any not queued yet."""
+        for i, frame in enumerate(frames_data):
+            self.submit(i, frame, bible)
+
+        future_to_index = {future: i for i, future in self._futures.items() if i < len(frames_data)}
+        results = {}
+        try:
+            for future in as_completed(future_to_index, timeout=timeout):
+                if self.generator.cancel_check():
+                    break
+                i = future_to_index[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    print(f"❌ Timeout/error for frame {i+1}: {e}")
+                    results[i] = self.generator._create_placeholder_image(f"Frame {i+1}")
+        except Exception as e:
+            # as_completed timed out or errored; placeholders are added for missing frames
+            print(f"⚠️ as_completed loop error/timeout: {e}")
+        finally:
+            self.close()
+
+        if self.generator.cancel_check():
+            from message_bus import RunCancelled
+
+            raise RunCancelled("Image generation was cancelled")
+
+        # Ensure every frame has a result (placeholder if missing)
+        for i in range(len(frames_data)):
+            if not results.get(i):
+                print(f"⚠️ No result for frame {i+1}, adding placeholder.")
+                results[i] = self.generator._create_placeholder_image(f"Frame {i+1}")
+        return [results[i] for i in range(len(frames_data))]
+
+    def close(self):
+        """Drop frames not started yet; running ones stop at their next attempt."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
 def create_session_dictionary(
         frames_data: List[Dict[str, Any]], image_paths: List[str]
     ) -> Dict[str, Dict[str, Any]]:
@@ -0,0 +1,82 @@
+"""
+Incremental JSON parsing for streamed LLM output.
+
+The story-frame JSON arrives token by token. ``JSONStreamParser`` scans each
+chunk once, keeps track of where it is in the document and hands back every
+object or array that has just been closed at a path the caller asked for, so
+work on the first frames can start while the rest is still being decoded.
+"""
+
+import json
+from typing import Any, Callable, List, Tuple
+
+# Path of a value in the document: object keys and array indexes from the root
+Path = Tuple[Any, ...]
+
+
+class JSONStreamParser:
+    """Feed text chunks, get back ``(path, value)`` for completed containers."""
+
+    def __init__(self, wanted: Callable[[Path], bool]):
+        self.wanted = wanted
+        self.text = ""
+        self._pos = 0
+        # One entry per open container: [kind, path, start, key, index, awaiting_key]
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._done = False
+
+    def feed(self, chunk: str) -> List[Tuple[Path, Any]]:
+        """Scan a chunk and return the wanted values it completed."""
+        self.text += chunk
+        text = self.text
+        completed = []
+
+        for i in range(self._pos, len(text)):
+            if self._done:
+                break
+            char = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    top = self._stack[-1]
+                    if top[0] == "{" and top[5]:
+                        top[3] = json.loads(text[self._string_start:i + 1])
+                continue
+
+            if not self._stack:
+                # Skip anything before the root object, such as a code fence
+                if char == "{":
+                    self._stack.append(["{", (), i, None, 0, True])
+                continue
+
+            top = self._stack[-1]
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char in "{[":
+                child = top[1] + ((top[3],) if top[0] == "{" else (top[4],))
+                self._stack.append([char, child, i, None, 0, char == "{"])
+            elif char in "}]":
+                _, path, start = self._stack.pop()[:3]
+                if self.wanted(path):
+                    completed.append((path, json.loads(text[start:i + 1])))
+                if not self._stack:
+                    self._done = True
+            elif char == ":":
+                top[5] = False
+            elif char == ",":
+                if top[0] == "{":
+                    top[5] = True
+                else:
+                    top[4] += 1
+
+        self._pos = len(text)
+        return completed
@@ -110,8 +110,13 @@ def create_jwt_token(user_data):
 
 def verify_jwt_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verify JWT token and return user info"""
+    return decode_jwt_token(credentials.credentials)
+
+
+def decode_jwt_token(token: str):
+    """Decode a raw JWT token (e.g. from a WebSocket query string) and return user info"""
     try:
-        payload = jwt.decode(credentials.credentials, os.getenv("JWT_SECRET_KEY", "story-nest-secret"), algorithms=["HS256"])
+        payload = jwt.decode(token, os.getenv("JWT_SECRET_KEY", "story-nest-secret"), algorithms=["HS256"])
         print(f"🔑 JWT Debug - Token valid for user: {payload.get('username')}")
         return payload
     except jwt.ExpiredSignatureError as e:
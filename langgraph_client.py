@@ -3,23 +3,45 @@ LangGraph workflow for child safety moderation.
 """
 
 import logging
-from typing import TypedDict
+from contextvars import ContextVar
+from typing import Optional, TypedDict
 from pydantic import BaseModel, Field
 from langchain_openai import ChatOpenAI
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
-from config import OPENAI_API_KEY, OPENAI_MODEL, OPENAI_TEMPERATURE, OPENAI_MAX_TOKENS
+from config import (
+    OPENAI_API_KEY,
+    OPENAI_MODEL,
+    OPENAI_TEMPERATURE,
+    OPENAI_MAX_TOKENS,
+    OPENAI_TIMEOUT,
+    LLM_ROUTES,
+    GUARD_MODE,
+    SPECULATIVE_SURPRISE,
+    SURPRISE_POOL_ENABLED,
+    RUN_MAX_ITERATIONS,
+    RUN_MAX_LLM_CALLS,
+    RUN_MAX_TOKENS,
+)
+from checkpoint_store import create_checkpointer
+from surprise_pool import surprise_pool
 from workflow_nodes import (
     ChoiceMenuNode,
     SurpriseModeNode,
     GuidedModeNode,
     FreeformModeNode,
+    PreGuardNode,
     ValidatePromptNode,
     DetectLanguageNode,
     ModeratePromptNode,
+    FusedGuardNode,
+    JoinChecksNode,
     ParseResponseNode,
     ImproveShortNode,
     ImproveLongNode,
     KidStoryGeneratorNode,
+    SpeculativeSurpriseNode,
     GenerateStoryImageNode,
 )
 
@@ -44,6 +66,83 @@ class ValidatorResult(BaseModel):
     improved_prompt: str = Field(description="Improved version of prompt")
 
 
+class RunBudget(BaseModel):
+    """Limits and usage of one workflow run."""
+
+    max_iterations: int = Field(default=RUN_MAX_ITERATIONS, description="Passes through the retry loop")
+    max_llm_calls: int = Field(default=RUN_MAX_LLM_CALLS, description="LLM calls")
+    max_tokens: int = Field(default=RUN_MAX_TOKENS, description="Prompt plus completion tokens")
+    iterations: int = 0
+    llm_calls: int = 0
+    tokens: int = 0
+
+    def start_iteration(self):
+        """Count a pass through the workflow, raising if none is left."""
+        if self.iterations >= self.max_iterations:
+            raise BudgetExhausted(self, "iterations")
+        self.iterations += 1
+
+    def check(self):
+        """Raise BudgetExhausted if no LLM calls or tokens are left."""
+        if self.llm_calls >= self.max_llm_calls:
+            raise BudgetExhausted(self, "llm_calls")
+        if self.tokens >= self.max_tokens:
+            raise BudgetExhausted(self, "tokens")
+
+
+class BudgetExhausted(Exception):
+    """Raised when a run has used up its RunBudget."""
+
+    def __init__(self, budget: RunBudget, limit: str):
+        super().__init__(f"Run budget exhausted: {limit}")
+        self.budget = budget
+        self.limit = limit
+
+    def to_event(self) -> dict:
+        return {
+            "code": "budget_exhausted",
+            "error": "This story idea needed too many attempts. Please try a different idea.",
+            "limit": self.limit,
+            "usage": self.budget.dict(),
+        }
+
+
+# Budget of the run whose node is executing; read by BudgetCallback
+_current_budget: ContextVar[Optional[RunBudget]] = ContextVar("current_budget", default=None)
+
+
+class BudgetCallback(BaseCallbackHandler):
+    """Charge LLM calls and token usage to the current run's budget."""
+
+    # Run in the caller's context so the current budget is visible
+    run_inline = True
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._count_call()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._count_call()
+
+    def on_llm_end(self, response, **kwargs):
+        budget = _current_budget.get()
+        if budget is None:
+            return
+        tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    tokens += usage.get("total_tokens", 0)
+        if not tokens and response.llm_output:
+            tokens = (response.llm_output.get("token_usage") or {}).get("total_tokens", 0)
+        budget.tokens += tokens
+
+    def _count_call(self):
+        budget = _current_budget.get()
+        if budget is not None:
+            budget.llm_calls += 1
+
+
 class ModerationState(TypedDict):
     """State for moderation workflow."""
 
@@ -57,9 +156,15 @@ class ModerationState(TypedDict):
     result: ModerationResult
     story_json: dict
     story_dict: dict
+    story: dict  # Generated story: title and story_text
+    pre_guard: str  # Local pre-guard decision: 'accept', 'reject' or 'defer'
+    budget: RunBudget  # Iteration, LLM call and token budget of the run
     session_frames: dict  # Session dictionary with frame data and images
     image_paths: list  # List of generated image paths
+    pooled: dict  # Ready surprise idea (and story) taken from the surprise pool
+    image_prompt: str  # Prompt the session frames and images were generated from
     user_id: str  # User identifier
+    run_id: str  # Message bus channel for this run
 
 
 class LangGraphModerationClient:
@@ -70,47 +175,90 @@ class LangGraphModerationClient:
         if not OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY environment variable is required")
 
-        self.llm = ChatOpenAI(
-            api_key=OPENAI_API_KEY,
-            model=OPENAI_MODEL,
-            temperature=OPENAI_TEMPERATURE,
-            max_tokens=OPENAI_MAX_TOKENS,
-        )
+        # Chat models by settings, shared by nodes routed to the same ones
+        self._llms = {}
 
         # Initialize workflow nodes
         self.choice_menu = ChoiceMenuNode()
-        self.surprise_mode = SurpriseModeNode(self.llm)
-        self.guided_mode = GuidedModeNode(self.llm)
+        self.surprise_mode = SurpriseModeNode(
+            self._llm("surprise_mode"), surprise_pool if SURPRISE_POOL_ENABLED else None
+        )
+        self.guided_mode = GuidedModeNode(self._llm("guided_mode"))
         self.freeform_mode = FreeformModeNode()
-        self.validate_prompt = ValidatePromptNode(self.llm)
-        self.detect_language = DetectLanguageNode(self.llm)
-        self.moderate_prompt = ModeratePromptNode(self.llm)
+        self.pre_guard = PreGuardNode()
+        self.validate_prompt = ValidatePromptNode(self._llm("validate_prompt"))
+        self.detect_language = DetectLanguageNode(self._llm("detect_language"))
+        self.moderate_prompt = ModeratePromptNode(self._llm("moderate_prompt"))
+        self.fused_guard = FusedGuardNode(self._llm("fused_guard"))
+        self.join_checks = JoinChecksNode()
         self.parse_response = ParseResponseNode()
-        self.improve_short = ImproveShortNode(self.llm)
-        self.improve_long = ImproveLongNode(self.llm)
-        self.generate_story = KidStoryGeneratorNode(self.llm)
-        self.generate_story_image = GenerateStoryImageNode(self.llm)
+        self.improve_short = ImproveShortNode(self._llm("improve_short"))
+        self.improve_long = ImproveLongNode(self._llm("improve_long"))
+        self.generate_story = KidStoryGeneratorNode(self._llm("generate_story"))
+        self.generate_story_image = GenerateStoryImageNode(self._llm("generate_story_image"))
+        self.speculate = SpeculativeSurpriseNode(
+            self.moderate_prompt,
+            self.parse_response,
+            {"improve_short": self.improve_short, "improve_long": self.improve_long},
+            self._check_word_count,
+            self.generate_story,
+        )
 
+        # Saves every completed step under the run ID (None when disabled)
+        self.checkpointer = create_checkpointer((ValidatorResult, ModerationResult, RunBudget))
         self.workflow = self._create_workflow()
 
+        if SURPRISE_POOL_ENABLED:
+            surprise_pool.start(self)
+
+
+    def _llm(self, node: str) -> ChatOpenAI:
+        """Chat model for a node, with its LLM_ROUTES settings over the defaults."""
+        route = LLM_ROUTES.get(node, {})
+        settings = (
+            route.get("model", OPENAI_MODEL),
+            route.get("temperature", OPENAI_TEMPERATURE),
+            route.get("max_tokens", OPENAI_MAX_TOKENS),
+            route.get("timeout", OPENAI_TIMEOUT),
+        )
+        if settings not in self._llms:
+            model, temperature, max_tokens, timeout = settings
+            self._llms[settings] = ChatOpenAI(
+                api_key=OPENAI_API_KEY,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=timeout,
+                # Token usage is reported for streamed responses too
+                stream_usage=True,
+                callbacks=[BudgetCallback()],
+            )
+        return self._llms[settings]
 
     def _create_workflow(self) -> StateGraph:
         """Create the moderation workflow."""
         workflow = StateGraph(ModerationState)
 
-        # Add workflow nodes
-        workflow.add_node("choice_menu", self.choice_menu)
-        workflow.add_node("surprise_mode", self.surprise_mode)
-        workflow.add_node("guided_mode", self.guided_mode)
-        workflow.add_node("freeform_mode", self.freeform_mode)
-        workflow.add_node("validate", self.validate_prompt)
-        workflow.add_node("detect_language", self.detect_language)
-        workflow.add_node("moderate", self.moderate_prompt)
-        workflow.add_node("parse", self.parse_response)
-        workflow.add_node("improve_short", self.improve_short)
-        workflow.add_node("improve_long", self.improve_long)
-        workflow.add_node("generate_story", self.generate_story)
-        workflow.add_node("generate_story_image", self.generate_story_image)
+        # Add workflow nodes (sync for invoke, native async for astream)
+        workflow.add_node("choice_menu", self._node(self.choice_menu))
+        workflow.add_node("surprise_mode", self._node(self.surprise_mode))
+        workflow.add_node("guided_mode", self._node(self.guided_mode))
+        workflow.add_node("freeform_mode", self._node(self.freeform_mode))
+        workflow.add_node("pre_guard", self._node(self.pre_guard))
+        workflow.add_node("validate", self._node(self.validate_prompt, "validator_result"))
+        workflow.add_node("detect_language", self._node(self.detect_language, "language"))
+        workflow.add_node("detect_language_only", self._node(self.detect_language))
+        workflow.add_node("moderate", self._node(self.moderate_prompt))
+        workflow.add_node("moderate_checks", self._node(self.moderate_prompt, "result", "response"))
+        workflow.add_node("guard", self._node(self.fused_guard, "validator_result", "result", "response"))
+        workflow.add_node("join_checks", self._node(self.join_checks))
+        workflow.add_node("parse", self._node(self.parse_response))
+        workflow.add_node("improve_short", self._node(self.improve_short))
+        workflow.add_node("improve_long", self._node(self.improve_long))
+        workflow.add_node("generate_story", self._node(self.generate_story))
+        workflow.add_node("generate_story_image", self._node(self.generate_story_image))
+        if SPECULATIVE_SURPRISE:
+            workflow.add_node("speculate", self._node(self.speculate))
 
         # Set entry point to choice menu for mode routing
         workflow.set_entry_point("choice_menu")
@@ -126,10 +274,39 @@ class LangGraphModerationClient:
             },
         )
 
-        # Connect modes to moderation
-        workflow.add_edge("surprise_mode", "moderate")
-        workflow.add_edge("guided_mode", "validate")
-        workflow.add_edge("freeform_mode", "validate")
+        # Surprise prompts are generated by us, so they only need moderation.
+        # Guided and freeform prompts fan out to validation, language
+        # detection and moderation in parallel; all read the original prompt.
+        # GUARD_MODE=fused does validation and moderation in one guard call.
+        # The local pre-guard goes first and skips the LLM guard entirely
+        # for prompts it is confident about.
+        if SPECULATIVE_SURPRISE:
+            # Moderation, improvement and the story run together (see
+            # SpeculativeSurpriseNode), ending in the usual decision
+            workflow.add_conditional_edges(
+                "speculate",
+                self._check_decision,
+                {"generate": END, "retry": "choice_menu"},
+            )
+        # A surprise idea from the pool is already moderated and improved
+        workflow.add_conditional_edges(
+            "surprise_mode",
+            self._check_surprise_source,
+            {"pooled": "generate_story", "fresh": "speculate" if SPECULATIVE_SURPRISE else "moderate"},
+        )
+        if GUARD_MODE == "fused":
+            check_nodes = ["guard", "detect_language"]
+        else:
+            check_nodes = ["validate", "detect_language", "moderate_checks"]
+        workflow.add_edge("guided_mode", "pre_guard")
+        workflow.add_edge("freeform_mode", "pre_guard")
+        workflow.add_conditional_edges(
+            "pre_guard",
+            lambda state: self._check_pre_guard(state, check_nodes),
+            [*check_nodes, "detect_language_only", END],
+        )
+        workflow.add_edge(check_nodes, "join_checks")
+        workflow.add_edge("detect_language_only", "parse")
 
         # Moderation pipeline
         workflow.add_edge("moderate", "parse")
@@ -158,18 +335,78 @@ class LangGraphModerationClient:
         # End workflow
         workflow.add_edge("generate_story", END)
 
-        # Validation workflow
+        # Validation verdict is applied once all parallel checks are done
         workflow.add_conditional_edges(
-            "validate",
+            "join_checks",
             self._check_validator_verdict,
             {
-                "continue": "detect_language",
+                "continue": "parse",
                 "stop": END,
             },
         )
-        workflow.add_edge("detect_language", "moderate")
 
-        return workflow.compile()
+        return workflow.compile(checkpointer=self.checkpointer)
+
+
+    def _node(self, node, *keys) -> RunnableLambda:
+        """Expose a node's sync ``__call__`` and async ``acall`` to the graph.
+
+        Both first check whether the run was cancelled or has used up its
+        budget, so such a run stops at the next node boundary. LLM usage
+        inside the node is charged to the run's budget. When ``keys`` are
+        given, only those state keys are written back, so the node can run
+        as a parallel branch; the budget is then updated in place.
+        """
+        from message_bus import message_bus
+
+        def updates(result):
+            if not keys:
+                return result
+            return {key: result[key] for key in keys if key in result}
+
+        def enter(state):
+            message_bus.raise_if_cancelled(state.get("run_id"))
+            budget = state.get("budget")
+            if budget is not None:
+                budget.check()
+            return _current_budget.set(budget)
+
+        def call(state):
+            token = enter(state)
+            try:
+                return updates(node(state))
+            finally:
+                _current_budget.reset(token)
+
+        async def acall(state):
+            token = enter(state)
+            try:
+                return updates(await node.acall(state))
+            finally:
+                _current_budget.reset(token)
+
+        return RunnableLambda(call, afunc=acall, name=type(node).__name__)
+
+
+    def run_config(self, run_id: str) -> dict:
+        """Graph config that checkpoints a run under its run ID."""
+        return {"configurable": {"thread_id": run_id}}
+
+
+    def load_run_state(self, run_id: str, owner: str = None):
+        """Return the checkpointed snapshot of a run, or None.
+
+        A snapshot whose ``next`` is not empty belongs to a run that stopped
+        before it finished and can be resumed.
+        """
+        if self.checkpointer is None or not run_id:
+            return None
+        snapshot = self.workflow.get_state(self.run_config(run_id))
+        if not snapshot.values:
+            return None
+        if owner is not None and snapshot.values.get("user_id") != owner:
+            return None
+        return snapshot
 
 
     def _check_mode_choice(self, state: ModerationState) -> str:
@@ -177,6 +414,21 @@ class LangGraphModerationClient:
         return state["mode"]
 
 
+    def _check_surprise_source(self, state: ModerationState) -> str:
+        """Skip moderation and improvement for an idea taken from the surprise pool."""
+        return "pooled" if state.get("pooled") else "fresh"
+
+
+    def _check_pre_guard(self, state: ModerationState, check_nodes: list):
+        """Skip the LLM guard when the local pre-guard already decided."""
+        decision = state.get("pre_guard")
+        if decision == "accept":
+            return "detect_language_only"
+        if decision == "reject":
+            return END
+        return check_nodes
+
+
     def _check_validator_verdict(self, state: ModerationState) -> str:
         """Check validator verdict and determine next step."""
         verdict = state["validator_result"].verdict
@@ -185,7 +437,8 @@ class LangGraphModerationClient:
             from message_bus import message_bus
 
             message_bus.publish_sync(
-                "log", "✅ Prompt validation passed! Proceeding to moderation..."
+                "log", "✅ Prompt validation passed! Proceeding to moderation...",
+                run_id=state.get("run_id"),
             )
             return "continue"
         else:
@@ -217,8 +470,29 @@ class LangGraphModerationClient:
             return "retry"
 
 
-    def generate_story_images(self, prompt: str, age: int, language: str, user_id: str = "api_user") -> dict:
-        """Generate story images using session prompt directly without re-improvement."""
+    def generate_story_images(
+        self, prompt: str, age: int, language: str, user_id: str = "api_user", run_id: str = None,
+        story_run_id: str = None,
+    ) -> dict:
+        """Generate story images using session prompt directly without re-improvement.
+
+        With ``story_run_id`` the checkpointed state of that story run is
+        reused: its age and language, its story when no prompt is given,
+        and images already generated for the same prompt.
+        """
+        story_run = self.load_run_state(story_run_id, user_id)
+        if story_run is not None:
+            values = story_run.values
+            prompt = prompt or (values.get("story") or {}).get("story_text") or values.get("prompt", "")
+            age = values.get("age", age)
+            language = values.get("language", language)
+            if values.get("image_paths") and values.get("image_prompt") == prompt:
+                print(f"♻️ Reusing images of story run {story_run_id}")
+                return {
+                    "session_frames": values.get("session_frames", {}),
+                    "image_paths": values["image_paths"],
+                }
+
         state = ModerationState(
             mode="",
             prompt=prompt,
@@ -232,7 +506,8 @@ class LangGraphModerationClient:
             story={},
             session_frames={},
             image_paths=[],
-            user_id=user_id
+            user_id=user_id,
+            run_id=run_id,
         )
 
         # Use the session prompt directly without re-improvement
@@ -290,5 +565,16 @@ class LangGraphModerationClient:
                 print(f"{frame_key}: {title} -> {image_path}")
             print("=== End Session Frames ===\n")
 
+        if story_run is not None:
+            # Keep the images with the story run for later requests
+            self.workflow.update_state(
+                self.run_config(story_run_id),
+                {
+                    "session_frames": result_state.get("session_frames", {}),
+                    "image_paths": result_state.get("image_paths", []),
+                    "image_prompt": prompt,
+                },
+                as_node="generate_story",
+            )
 
         return result_state
@@ -4,13 +4,21 @@ LangGraph Server for streaming workflow execution.
 
 from langgraph_sdk import get_client
 from langgraph.graph import StateGraph
-from langgraph_client import LangGraphModerationClient
+from langgraph_client import LangGraphModerationClient, BudgetExhausted
+from config import (
+    STREAM_CANCEL_GRACE_SECONDS,
+    STREAM_COALESCE_INTERVAL_MS,
+    STREAM_COALESCE_MAX_BYTES,
+)
+from message_bus import RunCancelled
+from admission import admission
 import asyncio
 import json
 import sys
 import io
 import threading
 import queue
+import uuid
 from contextlib import redirect_stdout
 
 
@@ -20,97 +28,292 @@ class LangGraphServer:
     def __init__(self):
         """Initialize the server."""
         self.client = LangGraphModerationClient()
+        # Workflow tasks running on this worker, by run ID
+        self._runs = {}
 
-    async def stream_workflow(self, initial_state: dict):
-        """Stream workflow execution with real-time events using message bus."""
-        import threading
-        import queue
+    async def stream_workflow(self, initial_state: dict, last_event_id: int = None):
+        """Stream workflow execution with real-time events using message bus.
+
+        Every event carries a sequence ``id``. When ``initial_state`` names a
+        run that is still in its replay window and ``last_event_id`` is given,
+        the stream reattaches to that run and only replays the events after
+        that ID instead of starting the workflow again. A run that loses its
+        last stream is cancelled unless a client reattaches within
+        STREAM_CANCEL_GRACE_SECONDS.
+        """
         from message_bus import message_bus
 
+        run_id = initial_state.get("run_id") or uuid.uuid4().hex
+        initial_state["run_id"] = run_id
+        owner = initial_state.get("user_id")
+
         try:
-            # Use regular queue for thread communication
-            result_queue = queue.Queue()
-
-            def run_workflow():
-                try:
-                    final_state = self.client.workflow.invoke(initial_state)
-                    result_queue.put(("success", final_state))
-                except Exception as e:
-                    result_queue.put(("error", str(e)))
-
-            workflow_thread = threading.Thread(target=run_workflow)
-            workflow_thread.start()
-
-            # Stream messages from message bus in real-time
-            while workflow_thread.is_alive():
-                # Check for sync messages from workflow nodes
-                sync_messages = message_bus.get_sync_messages()
-                for msg in sync_messages:
-                    if msg["type"] == "log":
-                        yield {"type": "log", "data": {"message": msg["message"]}}
-                    elif msg["type"] == "error":
-                        yield {"type": "error", "data": msg["data"]}
-                    elif msg["type"] == "story_complete":
-                        yield {"type": "story_complete", "data": msg["data"]}
-                    elif msg["type"] == "story_chunk":
-                        yield {"type": "story_chunk", "data": msg["data"]}
-                    elif msg["type"] == "animation":
-                        yield {"type": "animation", "data": msg["data"]}
-                await asyncio.sleep(0.1)        
-
-            # Get any remaining messages after workflow completes
-            sync_messages = message_bus.get_sync_messages()
-            for msg in sync_messages:
-                if msg["type"] == "log":
-                    yield {"type": "log", "data": {"message": msg["message"]}}
-                elif msg["type"] == "error":
-                    yield {"type": "error", "data": msg["data"]}
-                elif msg["type"] == "story_complete":
-                    yield {"type": "story_complete", "data": msg["data"]}
-                elif msg["type"] == "animation":
-                    yield {"type": "animation", "data": msg["data"]}
-
-            # Get final result
+            if last_event_id is not None:
+                if not message_bus.has_channel(run_id, owner):
+                    snapshot = await asyncio.to_thread(self.client.load_run_state, run_id, owner)
+                    if snapshot is None or not snapshot.next:
+                        yield {
+                            "type": "error",
+                            "data": {
+                                "code": "run_expired",
+                                "error": "This story stream is no longer available. Please start again.",
+                            },
+                        }
+                        return
+
+                    # The run stopped midway (e.g. a restart): continue it from
+                    # its last checkpoint in a fresh channel. Its events start
+                    # over at seq 1, so tell the client to drop what it has
+                    message_bus.open_channel(run_id, owner)
+                    message_bus.publish_sync("resumed", {"run_id": run_id}, run_id=run_id)
+                    message_bus.publish_sync("log", "♻️ Picking up your story where it stopped...", run_id=run_id)
+                    self._start_run(run_id, self._run_workflow(dict(snapshot.values), resume=True))
+                    last_event_id = 0
+            else:
+                # Each run publishes into its own message bus channel
+                message_bus.open_channel(run_id, owner)
+                self._start_run(run_id, self._run_workflow(initial_state))
+
+            # Stream messages as soon as workflow nodes publish them
+            async for event in self._follow(run_id, last_event_id or 0):
+                yield event
+
+        except Exception as e:
+            yield {"type": "error", "data": str(e)}
+
+    def _start_run(self, run_id: str, coro):
+        """Run a coroutine as the task of a run on this worker."""
+        task = asyncio.create_task(coro)
+        self._runs[run_id] = task
+        task.add_done_callback(lambda _: self._runs.pop(run_id, None))
+
+    def _queue_reporter(self, run_id: str):
+        """Publish a run's admission queue place: ``queued`` once, then ``position`` updates."""
+        from message_bus import message_bus
+
+        reported = False
+
+        def report(position: int):
+            nonlocal reported
+            event_type = "position" if reported else "queued"
+            message_bus.publish_sync(event_type, {"position": position}, run_id=run_id)
+            reported = True
+
+        return report
+
+    async def _run_workflow(self, initial_state: dict, resume: bool = False):
+        """Run the workflow and publish its outcome into the run's channel.
+
+        Runs as its own task on the event loop, independent of any client
+        connection, so the run keeps going while a disconnected client
+        reconnects. It waits for an admission slot before starting. With
+        ``resume`` the run continues from its last checkpoint.
+        """
+        from message_bus import message_bus
+
+        run_id = initial_state["run_id"]
+        try:
+            async with admission.slot(self._queue_reporter(run_id)):
+                result = initial_state
+                async for result in self.client.workflow.astream(
+                    None if resume else initial_state, self.client.run_config(run_id), stream_mode="values"
+                ):
+                    pass
+
+            # Check if validation failed - don't send final success message
+            validator_result = result.get("validator_result")
+            if (
+                validator_result
+                and hasattr(validator_result, "verdict")
+                and validator_result.verdict != "accept"
+            ):
+                return
+
+            # Convert Pydantic models to dict for JSON serialization
+            serializable_result = {}
+            for key, value in result.items():
+                if hasattr(value, "dict"):
+                    serializable_result[key] = value.dict()
+                else:
+                    serializable_result[key] = value
+
+            message_bus.publish_sync("final", serializable_result, run_id=run_id)
+        except BudgetExhausted as e:
+            print(f"💸 Run {run_id} stopped: {e}")
+            message_bus.publish_sync("error", e.to_event(), run_id=run_id)
+        except (asyncio.CancelledError, RunCancelled) as e:
+            print(f"🛑 Run {run_id} cancelled, no client is reading it")
+            message_bus.publish_sync(
+                "error",
+                {"code": "cancelled", "error": "Story generation was stopped."},
+                run_id=run_id,
+            )
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        except Exception as e:
+            message_bus.publish_sync("error", str(e), run_id=run_id)
+        finally:
+            # Wake the streams so they can drain and finish
+            message_bus.finish_channel(run_id)
+
+    async def stream_images(
+        self, prompt: str, age: int, language: str, user_id: str, run_id: str = None, story_run_id: str = None,
+    ):
+        """Stream image generation progress of a story, ending in an ``images_ready`` event."""
+        from message_bus import message_bus
+
+        run_id = run_id or uuid.uuid4().hex
+        if message_bus.has_channel(run_id):
+            # Image runs are never resumed; a taken run ID would mix two runs' events
+            yield {"type": "error", "data": {"error": "This run ID is already in use."}}
+            return
+        message_bus.open_channel(run_id, user_id)
+
+        async def run_images():
             try:
-                status, result = result_queue.get(timeout=1.0)
-                if status == "success":
-                    # Check if validation failed - don't send final success message
-                    validator_result = result.get("validator_result")
+                async with admission.slot(self._queue_reporter(run_id)):
+                    result_state = await asyncio.to_thread(
+                        self.client.generate_story_images,
+                        prompt=prompt, age=age, language=language, user_id=user_id, run_id=run_id,
+                        story_run_id=story_run_id,
+                    )
+                message_bus.publish_sync(
+                    "images_ready",
+                    {
+                        "frames_data": result_state.get("session_frames", {}),
+                        "image_paths": result_state.get("image_paths", []),
+                    },
+                    run_id=run_id,
+                )
+            except (asyncio.CancelledError, RunCancelled) as e:
+                print(f"🛑 Image run {run_id} cancelled, no client is reading it")
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+            except Exception as e:
+                message_bus.publish_sync("error", str(e), run_id=run_id)
+            finally:
+                message_bus.finish_channel(run_id)
+
+        self._start_run(run_id, run_images())
+
+        async for event in self._follow(run_id):
+            yield event
+
+    async def _follow(self, run_id: str, after_seq: int = 0):
+        """Stream a run's events as one of its readers.
+
+        When the last reader leaves before the run has finished, a check is
+        scheduled that cancels the run if nobody has reattached by then.
+        """
+        from message_bus import message_bus
+
+        message_bus.attach_reader(run_id)
+        completed = False
+        try:
+            async for event in self._stream_channel(run_id, after_seq):
+                yield event
+            completed = True
+        finally:
+            if message_bus.detach_reader(run_id) == 0 and not completed:
+                asyncio.get_running_loop().call_later(
+                    STREAM_CANCEL_GRACE_SECONDS, self._cancel_if_abandoned, run_id
+                )
+
+    def _cancel_if_abandoned(self, run_id: str):
+        """Cancel a run that still has no readers after the grace period."""
+        from message_bus import message_bus
+
+        if message_bus.reader_count(run_id) > 0:
+            return
+
+        # Flag it for whichever worker runs it; it stops at the next node
+        message_bus.cancel_run(run_id)
+
+        # On this worker, also interrupt the LLM call in flight
+        task = self._runs.get(run_id)
+        if task is not None and not task.done():
+            task.cancel()
+
+    async def _stream_channel(self, run_id: str, after_seq: int = 0):
+        """Yield UI events of a run, coalescing consecutive story chunks.
+
+        Story chunks are merged until either the flush interval has passed
+        since the first pending chunk or the byte budget is reached. The
+        very first chunk is sent right away to keep time-to-first-token low.
+        A merged chunk carries the sequence ID of the last chunk in it.
+        """
+        from message_bus import message_bus
+
+        loop = asyncio.get_running_loop()
+        interval = STREAM_COALESCE_INTERVAL_MS / 1000.0
+        pending = []
+        pending_bytes = 0
+        pending_seq = None
+        flush_at = None
+        first_chunk_sent = False
+
+        def flush():
+            nonlocal pending, pending_bytes, flush_at
+            event = {"id": pending_seq, "type": "story_chunk", "data": "".join(pending)}
+            pending, pending_bytes, flush_at = [], 0, None
+            return event
+
+        while True:
+            timeout = None if flush_at is None else max(0.0, flush_at - loop.time())
+            try:
+                sync_messages = await asyncio.wait_for(
+                    message_bus.next_messages(run_id, after_seq), timeout
+                )
+            except asyncio.TimeoutError:
+                yield flush()
+                continue
+
+            if not sync_messages:
+                break
+            after_seq = sync_messages[-1]["seq"]
+
+            for msg in sync_messages:
+                if msg["type"] == "story_chunk":
+                    pending.append(msg["data"])
+                    pending_bytes += len(msg["data"].encode("utf-8"))
+                    pending_seq = msg["seq"]
+                    if flush_at is None:
+                        flush_at = loop.time() + interval
                     if (
-                        validator_result
-                        and hasattr(validator_result, "verdict")
-                        and validator_result.verdict != "accept"
+                        not first_chunk_sent
+                        or interval <= 0
+                        or pending_bytes >= STREAM_COALESCE_MAX_BYTES
                     ):
-                        # Validation failed, don't send final success message
-                        pass
-                    else:
-                        # Convert Pydantic models to dict for JSON serialization
-                        serializable_result = {}
-                        for key, value in result.items():
-                            if hasattr(value, "dict"):
-                                serializable_result[key] = value.dict()
-                            else:
-                                serializable_result[key] = value
-
-                        yield {"type": "final", "data": serializable_result}
-                else:
-                    yield {"type": "error", "data": result}
+                        first_chunk_sent = True
+                        yield flush()
+                    continue
 
-            except queue.Empty:
-                yield {"type": "error", "data": "Workflow timeout"}
+                # Keep ordering: pending text goes out before any other event
+                if pending:
+                    yield flush()
+                if msg["type"] == "log":
+                    yield {"id": msg["seq"], "type": "log", "data": {"message": msg["message"]}}
+                elif msg["type"] in (
+                    "error", "story_title", "story_complete", "animation", "final", "images_ready", "queued", "position",
+                    "resumed",
+                ):
+                    yield {"id": msg["seq"], "type": msg["type"], "data": msg["data"]}
 
-        except Exception as e:
-            yield {"type": "error", "data": str(e)}
+        if pending:
+            yield flush()
 
     async def invoke_workflow(self, initial_state: dict):
         """Invoke workflow and return final result with captured logs."""
+        # No channel is opened, so events published by this run are dropped
+        initial_state["run_id"] = initial_state.get("run_id") or uuid.uuid4().hex
         captured_output = io.StringIO()
 
         try:
-            with redirect_stdout(captured_output):
-                final_state = await asyncio.to_thread(
-                    self.client.workflow.invoke, initial_state
-                )
+            async with admission.slot():
+                with redirect_stdout(captured_output):
+                    final_state = await asyncio.to_thread(
+                        self.client.workflow.invoke, initial_state, self.client.run_config(initial_state["run_id"])
+                    )
 
             # Get captured logs
             logs = [
@@ -121,6 +324,13 @@ class LangGraphServer:
 
             return {"type": "final", "data": final_state, "logs": logs}
 
+        except BudgetExhausted as e:
+            logs = [
+                line.strip()
+                for line in captured_output.getvalue().split("\n")
+                if line.strip()
+            ]
+            return {"type": "error", "data": e.to_event(), "logs": logs}
         except Exception as e:
             logs = [
                 line.strip()
@@ -129,6 +339,5 @@ class LangGraphServer:
             ]
             return {"type": "error", "data": {"error": str(e)}, "logs": logs}
 
-
 # Global server instance
 server = LangGraphServer()
@@ -0,0 +1,185 @@
+"""
+Local language identification for story prompts.
+
+Non-Latin languages (hi, ja, ko, ar) are recognised by their Unicode script.
+Latin languages (en, de, fr, es) are scored against compact character
+trigram profiles, function words and language-specific letters. No model
+call is needed; callers fall back to the LLM when confidence is low.
+
+Short Latin prompts ("robot friends", "magic school bus") carry too little
+evidence to tell the languages apart, so below MIN_LATIN_LETTERS nothing is
+detected, and a detected language only counts when it clearly beats the
+language the user asked for.
+"""
+
+import re
+from typing import Dict, Tuple
+
+# (first, last) code point ranges per script
+SCRIPT_RANGES = {
+    "devanagari": [(0x0900, 0x097F)],
+    "kana": [(0x3040, 0x309F), (0x30A0, 0x30FF), (0x31F0, 0x31FF)],
+    "han": [(0x4E00, 0x9FFF), (0x3400, 0x4DBF)],
+    "hangul": [(0xAC00, 0xD7AF), (0x1100, 0x11FF), (0x3130, 0x318F)],
+    "arabic": [(0x0600, 0x06FF), (0x0750, 0x077F), (0x08A0, 0x08FF)],
+}
+
+SCRIPT_LANGUAGES = {
+    "devanagari": "hi",
+    "kana": "ja",
+    "hangul": "ko",
+    "arabic": "ar",
+}
+
+# Most frequent character trigrams, most frequent first (spaces mark word edges)
+TRIGRAM_PROFILES = {
+    "en": [
+        " th", "the", "he ", "ed ", " an", "nd ", "and", "ing", "ng ", " to",
+        "to ", " of", "of ", "er ", " a ", "in ", "is ", "at ", "on ", " in",
+        "es ", "ion", "re ", " he", "as ", "ent", " wa", "was", "hat", " ha",
+        "her", "his", " hi", "it ", "ly ", "or ", " be", "tha", " wh", "ll ",
+    ],
+    "de": [
+        "en ", "er ", "ch ", "der", "ie ", "ein", " de", "die", " di", "sch",
+        "ich", "nd ", "und", " un", "cht", "te ", "in ", "ine", " ei", "gen",
+        "den", "es ", "ber", " ge", "ten", "ung", "che", " da", "das", "ist",
+        " is", " mi", "mit", " zu", "zu ", "ne ", "st ", "ei ", "ht ", "eit",
+    ],
+    "fr": [
+        "es ", " de", "de ", "le ", " le", "ent", "nt ", " la", "la ", "re ",
+        "on ", "ne ", "e d", "les", " co", "er ", "que", "ue ", " qu", "ion",
+        "des", " et", "et ", " pa", "ait", "ur ", " un", "une", "ans", " en",
+        "en ", " po", "ou ", "it ", "tio", "our", " da", "dan", "eur", "s d",
+    ],
+    "es": [
+        "de ", " de", "os ", " la", "la ", "el ", " el", "es ", " qu", "que",
+        "ue ", " co", "en ", "as ", "on ", "ent", " en", "ado", "los", " lo",
+        " es", "nte", "ar ", "do ", " un", "una", "est", "del", "ón ", "ien",
+        "ció", "aci", "ra ", "con", " po", "por", "or ", "cio", "o d", "er ",
+    ],
+}
+
+FUNCTION_WORDS = {
+    "en": {
+        "the", "a", "an", "and", "of", "to", "in", "is", "who", "with", "that",
+        "on", "for", "his", "her", "was", "are", "about", "story", "little",
+    },
+    "de": {
+        "der", "die", "das", "und", "ein", "eine", "ist", "mit", "von", "zu",
+        "auf", "den", "dem", "nicht", "sich", "über", "wer", "geschichte", "kleine", "einen",
+    },
+    "fr": {
+        "le", "la", "les", "un", "une", "et", "des", "du", "est", "qui",
+        "avec", "dans", "pour", "sur", "au", "aux", "il", "elle", "histoire", "petit",
+    },
+    "es": {
+        "el", "los", "las", "un", "una", "y", "del", "es", "que", "con",
+        "por", "para", "su", "al", "historia", "pequeño", "pequeña", "sobre", "quien", "muy",
+        "niño", "niña", "amigo", "amigos",
+    },
+}
+
+# Trigram -> weight (1.0 for the most frequent, falling with rank)
+_TRIGRAM_WEIGHTS = {
+    language: {trigram: 1.0 - rank / len(profile) for rank, trigram in enumerate(profile)}
+    for language, profile in TRIGRAM_PROFILES.items()
+}
+
+# Letters that (nearly) only one of the Latin languages uses
+SIGNATURE_LETTERS = {
+    "de": set("äöüß"),
+    "fr": set("èêëçàâîôûœ"),
+    "es": set("ñ¿¡áíóú"),
+}
+
+# Latin texts with fewer letters than this are not detected at all
+MIN_LATIN_LETTERS = 20
+# Latin texts with fewer letters than this get proportionally lower confidence
+MIN_CONFIDENT_LETTERS = 40
+# Score the winner needs before its margin is fully trusted (a function word is 2.0)
+MIN_CONFIDENT_SCORE = 6.0
+# Same for non-Latin scripts, where each character carries more information
+MIN_CONFIDENT_SCRIPT_LETTERS = 4
+
+_WORD_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+
+def _script_of(char: str):
+    code = ord(char)
+    for script, ranges in SCRIPT_RANGES.items():
+        for first, last in ranges:
+            if first <= code <= last:
+                return script
+    return None
+
+
+def _script_counts(text: str) -> Tuple[Dict[str, int], int]:
+    counts: Dict[str, int] = {}
+    letters = 0
+    for char in text:
+        if not char.isalpha():
+            continue
+        letters += 1
+        script = _script_of(char)
+        if script:
+            counts[script] = counts.get(script, 0) + 1
+    return counts, letters
+
+
+def _latin_scores(text: str) -> Dict[str, float]:
+    words = _WORD_RE.findall(text.lower())
+    padded = " " + " ".join(words) + " "
+    trigrams = [padded[i : i + 3] for i in range(len(padded) - 2)]
+
+    scores = {}
+    for language, weights in _TRIGRAM_WEIGHTS.items():
+        score = sum(weights.get(trigram, 0.0) for trigram in trigrams)
+        score += 2.0 * sum(1 for word in words if word in FUNCTION_WORDS[language])
+        letters = SIGNATURE_LETTERS.get(language)
+        if letters:
+            score += 3.0 * sum(1 for char in padded if char in letters)
+        scores[language] = score
+    return scores
+
+
+def detect_language(text: str, expected: str = "") -> Tuple[str, float]:
+    """Return (language code, confidence 0-1) for a prompt.
+
+    The code is one of en, de, fr, es, hi, ja, ko, ar, or "" when the text
+    has no letters, or too few Latin letters, to go on. For Latin text the
+    confidence is the winner's margin over ``expected`` (the requested
+    language) when given, otherwise over the runner-up.
+    """
+    counts, letters = _script_counts(text or "")
+    if not letters:
+        return "", 0.0
+
+    # Non-Latin scripts decide on their own
+    script_letters = sum(counts.values())
+    if script_letters * 2 > letters:
+        length_factor = min(1.0, script_letters / MIN_CONFIDENT_SCRIPT_LETTERS)
+        if counts.get("kana"):
+            # Kana (possibly mixed with kanji) is Japanese
+            share = (counts["kana"] + counts.get("han", 0)) / letters
+            return "ja", share * length_factor
+        script = max(counts, key=counts.get)
+        if script == "han":
+            # Kanji only could as well be Chinese, which we do not support
+            return "ja", 0.5 * counts["han"] / letters * length_factor
+        return SCRIPT_LANGUAGES[script], counts[script] / letters * length_factor
+
+    if letters < MIN_LATIN_LETTERS:
+        return "", 0.0
+
+    scores = _latin_scores(text)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (best, best_score), (_, second_score) = ranked[0], ranked[1]
+    if best_score <= 0:
+        return "", 0.0
+    if expected in scores and best != expected:
+        second_score = scores[expected]
+    margin = (best_score - second_score) / best_score
+    # A runner-up at zero only means there was little to score, not certainty
+    evidence = min(1.0, best_score / MIN_CONFIDENT_SCORE)
+    length_factor = min(1.0, letters / MIN_CONFIDENT_LETTERS)
+    return best, margin * evidence * length_factor
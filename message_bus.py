@@ -1,15 +1,510 @@
 """
 Message bus for real-time communication between workflow nodes and UI.
+
+Run events are stored by a pluggable transport:
+- LocalTransport keeps them in process memory (single worker).
+- RedisTransport keeps them in Redis streams, so a workflow running in one
+  uvicorn worker can stream to a client connected to another.
 """
 
 import asyncio
-from typing import Dict, List, Callable
+import json
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Callable, Optional, Tuple
+
+from config import (
+    MESSAGE_BUS_MAX_EVENTS,
+    MESSAGE_BUS_REPLAY_TTL_SECONDS,
+    MESSAGE_BUS_TRANSPORT,
+    MESSAGE_BUS_REDIS_URL,
+)
+
+# Channel used by publishers that are not bound to a workflow run
+DEFAULT_CHANNEL = "default"
+
+# Event types that may be evicted from a full buffer, most expendable first.
+# story_chunk, story_complete, error and final events are kept up to the hard limit.
+DROPPABLE_EVENT_TYPES = ("animation", "log")
+
+# Critical events may overflow max_events, but never this multiple of it;
+# past that the oldest event of any type is evicted
+HARD_LIMIT_FACTOR = 2
+
+
+class RunCancelled(Exception):
+    """Raised inside a workflow run once it has been cancelled."""
+
+
+class _Channel:
+    """Sequenced event log for one run plus the consumers waiting on it.
+
+    Holds at most max_events. When full, the oldest animation (then log)
+    event is evicted to make room; if there is none, a new droppable event
+    is discarded while critical events are still appended, up to
+    HARD_LIMIT_FACTOR * max_events, after which the oldest event is evicted
+    even if critical (a reader that far behind loses it). A strict channel
+    has no consumer to protect and evicts its oldest event of any type.
+    """
+
+    def __init__(self, max_events: int, owner: Optional[str] = None, strict: bool = False):
+        self.events: Deque[dict] = deque()
+        self.max_events = max_events
+        self.strict = strict
+        self.next_seq = 1
+        self.owner = owner
+        self.finished_at: Optional[float] = None
+        # Number of buffered events whose type is droppable
+        self.droppable = 0
+        # Events lost to the buffer limit, by type
+        self.dropped: Dict[str, int] = {}
+        # Highest sequence ID handed out by get_sync_messages
+        self.drained_seq = 0
+        # Highest sequence ID delivered to any consumer
+        self.read_seq = 0
+        # Streams currently following this run
+        self.readers = 0
+        self.cancelled = False
+        # (event loop, asyncio.Event) of every consumer awaiting new events
+        self.waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    def add(self, message: dict) -> bool:
+        """Append a message under the drop policy; False if it was dropped."""
+        event_type = message["type"]
+        if len(self.events) >= self.max_events and not self._evict(event_type):
+            self.dropped[event_type] = self.dropped.get(event_type, 0) + 1
+            return False
+
+        message["seq"] = self.next_seq
+        self.next_seq += 1
+        self.events.append(message)
+        if event_type in DROPPABLE_EVENT_TYPES:
+            self.droppable += 1
+        return True
+
+    def _evict(self, incoming_type: str) -> bool:
+        """Free one slot for an incoming event; False if it must be dropped."""
+        if self.droppable:
+            for victim_type in DROPPABLE_EVENT_TYPES:
+                for index, event in enumerate(self.events):
+                    if event["type"] == victim_type:
+                        del self.events[index]
+                        self.droppable -= 1
+                        self.dropped[victim_type] = self.dropped.get(victim_type, 0) + 1
+                        return True
+
+        if not self.strict and incoming_type in DROPPABLE_EVENT_TYPES:
+            return False
+
+        # Critical events are kept above the limit, up to the hard limit
+        if self.strict or len(self.events) >= self.max_events * HARD_LIMIT_FACTOR:
+            victim_type = self.events.popleft()["type"]
+            self.dropped[victim_type] = self.dropped.get(victim_type, 0) + 1
+        return True
+
+    def after(self, seq: int) -> List[dict]:
+        """Return retained events with a sequence ID greater than seq."""
+        if not self.events or self.events[-1]["seq"] <= seq:
+            return []
+        return [event for event in self.events if event["seq"] > seq]
+
+    def stats(self) -> dict:
+        last_seq = self.next_seq - 1
+        return {
+            "buffered": len(self.events),
+            "last_seq": last_seq,
+            # Events not yet delivered to any consumer
+            "lag": last_seq - max(self.read_seq, self.drained_seq),
+            "dropped": dict(self.dropped),
+            "finished": self.finished_at is not None,
+            "readers": self.readers,
+            "cancelled": self.cancelled,
+        }
+
+
+class LocalTransport:
+    """In-process event logs, one per run."""
+
+    def __init__(self, max_events_per_run: int, replay_ttl: float):
+        self.max_events_per_run = max_events_per_run
+        self.replay_ttl = replay_ttl
+        self._channels: Dict[str, _Channel] = {}
+        self._lock = threading.Lock()
+        # Pending timer that reaps finished runs once their replay window ends
+        self._reaper: Optional[threading.Timer] = None
+
+    def open(self, run_id: str, owner: Optional[str] = None):
+        with self._lock:
+            self._reap_expired()
+            if run_id not in self._channels:
+                self._channels[run_id] = _Channel(self.max_events_per_run, owner)
+
+    def exists(self, run_id: str, owner: Optional[str] = None) -> bool:
+        with self._lock:
+            channel = self._channels.get(run_id)
+            return channel is not None and (owner is None or channel.owner == owner)
+
+    def append(self, run_id: str, message: dict, create: bool = False):
+        with self._lock:
+            channel = self._channels.get(run_id)
+            if channel is None:
+                if not create:
+                    # Nobody is listening to this run (closed or never opened)
+                    return
+                # Implicit channels have no consumer, so nothing is kept above the limit
+                channel = _Channel(self.max_events_per_run, strict=True)
+                self._channels[run_id] = channel
+            if not channel.add(message):
+                return
+            waiters, channel.waiters = channel.waiters, []
+
+        self._wake(waiters)
+
+    def finish(self, run_id: str):
+        with self._lock:
+            channel = self._channels.get(run_id)
+            if channel is None:
+                return
+            channel.finished_at = time.monotonic()
+            waiters, channel.waiters = channel.waiters, []
+            self._reap_expired()
+            self._schedule_reaper()
+
+        self._wake(waiters)
+
+    def attach(self, run_id: str, delta: int) -> int:
+        with self._lock:
+            channel = self._channels.get(run_id)
+            if channel is None:
+                return 0
+            channel.readers = max(0, channel.readers + delta)
+            return channel.readers
+
+    def cancel(self, run_id: str):
+        with self._lock:
+            channel = self._channels.get(run_id)
+            if channel is not None and channel.finished_at is None:
+                channel.cancelled = True
+
+    def is_cancelled(self, run_id: str) -> bool:
+        with self._lock:
+            channel = self._channels.get(run_id)
+            return channel is not None and channel.cancelled
+
+    async def read(self, run_id: str, after_seq: int) -> List[dict]:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                channel = self._channels.get(run_id)
+                if channel is None:
+                    return []
+                messages = channel.after(after_seq)
+                if messages:
+                    channel.read_seq = max(channel.read_seq, messages[-1]["seq"])
+                    return messages
+                if channel.finished_at is not None:
+                    return []
+                wakeup = asyncio.Event()
+                channel.waiters.append((loop, wakeup))
+
+            await wakeup.wait()
+
+    def drain(self, run_id: str) -> List[dict]:
+        with self._lock:
+            channel = self._channels.get(run_id)
+            if channel is None:
+                return []
+            messages = channel.after(channel.drained_seq)
+            if messages:
+                channel.drained_seq = messages[-1]["seq"]
+            return messages
+
+    def close(self, run_id: str):
+        with self._lock:
+            channel = self._channels.pop(run_id, None)
+            waiters = channel.waiters if channel else []
+
+        self._wake(waiters)
+
+    def clear(self):
+        with self._lock:
+            waiters = [w for channel in self._channels.values() for w in channel.waiters]
+            self._channels.clear()
+        self._wake(waiters)
+
+    def stats(self) -> dict:
+        with self._lock:
+            runs = {run_id: channel.stats() for run_id, channel in self._channels.items()}
+        dropped = {}
+        for run in runs.values():
+            for event_type, count in run["dropped"].items():
+                dropped[event_type] = dropped.get(event_type, 0) + count
+        return {"transport": "local", "runs": runs, "dropped": dropped}
+
+    def _reap_expired(self):
+        """Drop finished runs whose replay window has passed (lock held)."""
+        now = time.monotonic()
+        expired = [
+            run_id
+            for run_id, channel in self._channels.items()
+            if channel.finished_at is not None
+            and now - channel.finished_at > self.replay_ttl
+        ]
+        for run_id in expired:
+            del self._channels[run_id]
+
+    def _schedule_reaper(self):
+        """Arm the reaper for the next replay window to end (lock held).
+
+        Without it, an idle worker would keep finished runs forever since
+        open() and finish() are the only other places that reap.
+        """
+        if self._reaper is not None:
+            return
+        finished = [c.finished_at for c in self._channels.values() if c.finished_at is not None]
+        if not finished:
+            return
+        delay = max(0.0, min(finished) + self.replay_ttl - time.monotonic()) + 0.1
+        self._reaper = threading.Timer(delay, self._run_reaper)
+        self._reaper.daemon = True
+        self._reaper.start()
+
+    def _run_reaper(self):
+        with self._lock:
+            self._reaper = None
+            self._reap_expired()
+            self._schedule_reaper()
+
+    @staticmethod
+    def _wake(waiters):
+        """Set consumers' wakeup events from any thread."""
+        for loop, wakeup in waiters:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # Consumer's event loop is already closed
+                pass
+
+
+class RedisTransport:
+    """Event logs stored as Redis streams, shared by all workers on a host.
+
+    Works with any server speaking the Redis protocol (Redis, Valkey,
+    KeyDB, ...), over TCP or a unix socket URL.
+    """
+
+    KEY_PREFIX = "storynest:run:"
+    DROPPED_KEY = "storynest:bus:dropped"
+    # Logs of runs that never finish (crashed worker) expire after this
+    RUNNING_TTL_SECONDS = 3600
+    BLOCK_MS = 5000
+
+    # Atomically assign the next sequence ID and append, only for open runs.
+    # A droppable event is discarded (and counted) once the stream is full;
+    # critical events are appended until the hard limit (ARGV[6]), past which
+    # the oldest entry is evicted to make room.
+    _APPEND_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+    local length = redis.call('XLEN', KEYS[2])
+    if ARGV[4] == '1' and length >= tonumber(ARGV[2]) then
+        redis.call('HINCRBY', KEYS[1], 'dropped:' .. ARGV[5], 1)
+        redis.call('HINCRBY', KEYS[3], ARGV[5], 1)
+        return -1
+    end
+    if length >= tonumber(ARGV[6]) then
+        local oldest = redis.call('XRANGE', KEYS[2], '-', '+', 'COUNT', 1)[1]
+        local victim = cjson.decode(oldest[2][2])['type']
+        redis.call('XDEL', KEYS[2], oldest[1])
+        redis.call('HINCRBY', KEYS[1], 'dropped:' .. victim, 1)
+        redis.call('HINCRBY', KEYS[3], victim, 1)
+    end
+    local seq = redis.call('HINCRBY', KEYS[1], 'seq', 1)
+    redis.call('XADD', KEYS[2], '0-' .. seq, 'payload', ARGV[1])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    return seq
+    """
+
+    def __init__(self, url: str, max_events_per_run: int, replay_ttl: float):
+        import redis
+        import redis.asyncio
+
+        self.max_events_per_run = max_events_per_run
+        self.replay_ttl = replay_ttl
+        self._redis = redis.Redis.from_url(url)
+        self._async_url = url
+        self._async_redis = None
+        self._append = self._redis.register_script(self._APPEND_SCRIPT)
+        self._redis.ping()
+
+    def _keys(self, run_id: str):
+        return f"{self.KEY_PREFIX}{run_id}:meta", f"{self.KEY_PREFIX}{run_id}:events"
+
+    def _client(self):
+        """Async client, created lazily inside the consuming event loop."""
+        if self._async_redis is None:
+            import redis.asyncio
+
+            self._async_redis = redis.asyncio.Redis.from_url(self._async_url)
+        return self._async_redis
+
+    def open(self, run_id: str, owner: Optional[str] = None):
+        meta, _ = self._keys(run_id)
+        pipe = self._redis.pipeline()
+        pipe.hsetnx(meta, "owner", owner or "")
+        pipe.hsetnx(meta, "seq", 0)
+        pipe.expire(meta, self.RUNNING_TTL_SECONDS)
+        pipe.execute()
+
+    def exists(self, run_id: str, owner: Optional[str] = None) -> bool:
+        meta, _ = self._keys(run_id)
+        stored_owner = self._redis.hget(meta, "owner")
+        if stored_owner is None:
+            return False
+        return owner is None or stored_owner.decode() == (owner or "")
+
+    def append(self, run_id: str, message: dict, create: bool = False):
+        meta, events = self._keys(run_id)
+        if create:
+            self.open(run_id)
+        payload = json.dumps(message)
+        droppable = "1" if message["type"] in DROPPABLE_EVENT_TYPES else "0"
+        seq = self._append(
+            keys=[meta, events, self.DROPPED_KEY],
+            args=[
+                payload,
+                self.max_events_per_run,
+                self.RUNNING_TTL_SECONDS,
+                droppable,
+                message["type"],
+                self.max_events_per_run * HARD_LIMIT_FACTOR,
+            ],
+        )
+        if seq and int(seq) > 0:
+            message["seq"] = int(seq)
+
+    def finish(self, run_id: str):
+        meta, events = self._keys(run_id)
+        if not self._redis.exists(meta):
+            return
+        self._redis.hset(meta, "finished", 1)
+        # Marker entry wakes blocked readers in every worker
+        self.append(run_id, {"type": "__finished__"})
+        pipe = self._redis.pipeline()
+        pipe.expire(meta, int(self.replay_ttl))
+        pipe.expire(events, int(self.replay_ttl))
+        pipe.execute()
+
+    def attach(self, run_id: str, delta: int) -> int:
+        meta, _ = self._keys(run_id)
+        if not self._redis.exists(meta):
+            return 0
+        return max(0, int(self._redis.hincrby(meta, "readers", delta)))
+
+    def cancel(self, run_id: str):
+        meta, _ = self._keys(run_id)
+        if self._redis.exists(meta) and not self._redis.hget(meta, "finished"):
+            self._redis.hset(meta, "cancelled", 1)
+
+    def is_cancelled(self, run_id: str) -> bool:
+        meta, _ = self._keys(run_id)
+        return bool(self._redis.hget(meta, "cancelled"))
+
+    async def read(self, run_id: str, after_seq: int) -> List[dict]:
+        client = self._client()
+        meta, events = self._keys(run_id)
+        while True:
+            entries = await client.xrange(events, min=f"0-{after_seq + 1}", count=self.max_events_per_run)
+            if not entries:
+                if not await client.exists(meta) or await client.hget(meta, "finished"):
+                    return []
+                response = await client.xread({events: f"0-{after_seq}"}, block=self.BLOCK_MS)
+                if not response:
+                    continue
+                entries = response[0][1]
+
+            messages = self._decode(entries)
+            if messages and messages[-1]["type"] == "__finished__":
+                messages.pop()
+                return messages
+            if messages:
+                return messages
+
+    def drain(self, run_id: str) -> List[dict]:
+        meta, events = self._keys(run_id)
+        drained = int(self._redis.hget(meta, "drained") or 0)
+        messages = [
+            message
+            for message in self._decode(self._redis.xrange(events, min=f"0-{drained + 1}"))
+            if message["type"] != "__finished__"
+        ]
+        if messages:
+            self._redis.hset(meta, "drained", messages[-1]["seq"])
+        return messages
+
+    def close(self, run_id: str):
+        self._redis.delete(*self._keys(run_id))
+
+    def clear(self):
+        for key in self._redis.scan_iter(f"{self.KEY_PREFIX}*"):
+            self._redis.delete(key)
+
+    def stats(self) -> dict:
+        dropped = {
+            event_type.decode(): int(count)
+            for event_type, count in self._redis.hgetall(self.DROPPED_KEY).items()
+        }
+        return {"transport": "redis", "dropped": dropped}
+
+    @staticmethod
+    def _decode(entries) -> List[dict]:
+        messages = []
+        for entry_id, fields in entries:
+            if isinstance(entry_id, bytes):
+                entry_id = entry_id.decode()
+            message = json.loads(fields[b"payload"])
+            message["seq"] = int(entry_id.split("-")[1])
+            messages.append(message)
+        return messages
+
+
+def create_transport(
+    name: str = MESSAGE_BUS_TRANSPORT,
+    max_events_per_run: int = MESSAGE_BUS_MAX_EVENTS,
+    replay_ttl: float = MESSAGE_BUS_REPLAY_TTL_SECONDS,
+):
+    """Build the configured transport, falling back to in-process storage."""
+    if name == "redis":
+        try:
+            transport = RedisTransport(MESSAGE_BUS_REDIS_URL, max_events_per_run, replay_ttl)
+            print(f"✅ Message bus using Redis transport at {MESSAGE_BUS_REDIS_URL}")
+            return transport
+        except ImportError:
+            print("⚠️ redis package not installed, using local message bus transport")
+        except Exception as e:
+            print(f"⚠️ Redis transport unavailable ({e}), using local message bus transport")
+    return LocalTransport(max_events_per_run, replay_ttl)
 
 
 class MessageBus:
-    def __init__(self):
+    def __init__(
+        self,
+        max_events_per_run: int = MESSAGE_BUS_MAX_EVENTS,
+        replay_ttl: float = MESSAGE_BUS_REPLAY_TTL_SECONDS,
+        transport=None,
+    ):
         self.subscribers: Dict[str, List[Callable]] = {}
         self.message_queue = asyncio.Queue()
+        self.max_events_per_run = max_events_per_run
+        self.replay_ttl = replay_ttl
+        # Run event logs, keyed by run ID
+        self.transport = transport or LocalTransport(max_events_per_run, replay_ttl)
+        # Events not bound to a run never leave this process
+        self._local = (
+            self.transport
+            if isinstance(self.transport, LocalTransport)
+            else LocalTransport(max_events_per_run, replay_ttl)
+        )
 
     def subscribe(self, event_type: str, callback: Callable):
         if event_type not in self.subscribers:
@@ -22,31 +517,88 @@ class MessageBus:
     async def get_message(self):
         return await self.message_queue.get()
 
-    def publish_sync(self, event_type: str, data):
+    def publish_sync(self, event_type: str, data, run_id: Optional[str] = None):
         """Synchronous publish for use in workflow nodes"""
-        # Always use fallback list for synchronous access
-        if not hasattr(self, "_sync_messages"):
-            self._sync_messages = []
-
         # Handle both string messages and dict data
         if event_type == "log":
-            self._sync_messages.append({"type": event_type, "message": data})
+            message = {"type": event_type, "message": data}
         else:
-            self._sync_messages.append({"type": event_type, "data": data})
+            message = {"type": event_type, "data": data}
 
-    def get_sync_messages(self):
-        """Get messages stored synchronously"""
-        if hasattr(self, "_sync_messages"):
-            messages = self._sync_messages.copy()
-            self._sync_messages.clear()
-            return messages
-        return []
+        if run_id:
+            self.transport.append(run_id, message)
+        else:
+            self._local.append(DEFAULT_CHANNEL, message, create=True)
+
+    def open_channel(self, run_id: str, owner: Optional[str] = None):
+        """Create the bounded event log that collects events for one run"""
+        self.transport.open(run_id, owner)
+
+    def has_channel(self, run_id: str, owner: Optional[str] = None) -> bool:
+        """Check whether a run's events can still be read (by this owner)"""
+        return self.transport.exists(run_id, owner)
+
+    def finish_channel(self, run_id: str):
+        """Mark a run as done publishing and wake its consumers.
+
+        The log is kept for replay_ttl seconds so disconnected clients can
+        still fetch the events they missed.
+        """
+        self.transport.finish(run_id)
+
+    def attach_reader(self, run_id: str) -> int:
+        """Register a stream following a run; returns the number of readers"""
+        return self.transport.attach(run_id, 1)
+
+    def detach_reader(self, run_id: str) -> int:
+        """Unregister a stream following a run; returns the readers left"""
+        return self.transport.attach(run_id, -1)
+
+    def reader_count(self, run_id: str) -> int:
+        return self.transport.attach(run_id, 0)
+
+    def cancel_run(self, run_id: str):
+        """Ask an unfinished run to stop; it checks this at node boundaries"""
+        self.transport.cancel(run_id)
+
+    def is_cancelled(self, run_id: Optional[str]) -> bool:
+        return bool(run_id) and self.transport.is_cancelled(run_id)
+
+    def raise_if_cancelled(self, run_id: Optional[str]):
+        if self.is_cancelled(run_id):
+            raise RunCancelled(f"Run {run_id} was cancelled")
+
+    async def next_messages(self, run_id: str, after_seq: int = 0) -> List[dict]:
+        """Wait for events of a run with a sequence ID greater than after_seq.
+
+        Returns an empty list once the run has finished and everything
+        published before that has been delivered.
+        """
+        return await self.transport.read(run_id, after_seq)
+
+    def get_sync_messages(self, run_id: Optional[str] = None):
+        """Get messages stored synchronously for one run"""
+        if run_id:
+            return self.transport.drain(run_id)
+        return self._local.drain(DEFAULT_CHANNEL)
+
+    def close_channel(self, run_id: str):
+        """Drop the event log of a run immediately"""
+        self.transport.close(run_id)
+
+    def stats(self) -> dict:
+        """Buffer and overflow counters, to spot runs whose clients fall behind"""
+        stats = self.transport.stats()
+        if self._local is not self.transport:
+            stats["unbound"] = self._local.stats()["runs"].get(DEFAULT_CHANNEL)
+        return stats
 
     def clear_all(self):
         """Clear all messages and reset message bus state"""
         self.subscribers.clear()
-        if hasattr(self, "_sync_messages"):
-            self._sync_messages.clear()
+        self.transport.clear()
+        if self._local is not self.transport:
+            self._local.clear()
         # Clear async queue
         while not self.message_queue.empty():
             try:
@@ -56,4 +608,4 @@ class MessageBus:
 
 
 # Global message bus instance
-message_bus = MessageBus()
+message_bus = MessageBus(transport=create_transport())
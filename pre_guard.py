@@ -0,0 +1,255 @@
+"""
+Local pre-moderation in front of the LLM prompt guard.
+
+Two CPU-only signals decide the obvious cases:
+- A small logistic regression over hashed word and character features,
+  trained from the verdicts the LLM guard has logged.
+- A multilingual lexicon of sensitive terms (violence, scary, adult and
+  drug content).
+
+A prompt is accepted on a very high classifier score and rejected on a very
+low one. Sensitive terms are often harmless in a kids' story ("a friendly
+zombie", "afraid of nightmares"), so a lexicon hit never rejects locally;
+it sends the prompt to the LLM guard. Everything else ambiguous is deferred
+too, and until a model has been trained nothing is decided locally.
+
+Verdict logging is opt-in: set PRE_GUARD_LOG_PATH to collect the LLM
+guard's verdicts, then train with ``python pre_guard.py train``.
+"""
+
+import json
+import math
+import os
+import random
+import re
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    PRE_GUARD_ENABLED,
+    PRE_GUARD_ACCEPT_THRESHOLD,
+    PRE_GUARD_REJECT_THRESHOLD,
+    PRE_GUARD_LOG_PATH,
+    PRE_GUARD_MODEL_PATH,
+)
+
+# Whole words that need the LLM guard's judgement, per language. All languages are
+# checked together, so words that are harmless in another supported language
+# ("die" and "war" in German, "sang" in English) are left out.
+SENSITIVE_WORDS = {
+    "en": {
+        "kill", "kills", "killed", "killing", "murder", "murders", "murdered", "blood", "bloody",
+        "gun", "guns", "knife", "knives", "weapon", "weapons", "bomb", "bombs", "warfare",
+        "dead", "death", "died", "corpse", "zombie", "zombies", "nightmare", "nightmares",
+        "horror", "drugs", "alcohol", "beer", "drunk", "sex", "sexy", "naked", "nude",
+        "suicide", "torture", "kidnap", "kidnapped", "stab", "stabbed",
+    },
+    "de": {
+        "töten", "tötet", "mord", "mörder", "blut", "waffe", "waffen", "pistole", "gewehr",
+        "messer", "krieg", "tod", "leiche", "zombie", "albtraum", "horror", "drogen",
+        "alkohol", "bier", "betrunken", "sex", "nackt", "selbstmord", "folter", "entführt",
+    },
+    "fr": {
+        "tuer", "tué", "meurtre", "meurtrier", "sanglant", "pistolet", "fusil", "couteau", "guerre",
+        "mort", "morte", "cadavre", "zombie", "cauchemar", "horreur", "drogue", "drogues",
+        "alcool", "bière", "ivre", "sexe", "suicide", "torture", "enlèvement", "kidnappé",
+    },
+    "es": {
+        "matar", "mató", "asesinato", "asesino", "sangre", "pistola", "cuchillo", "guerra",
+        "muerto", "muerte", "cadáver", "zombi", "pesadilla", "horror", "droga", "drogas",
+        "alcohol", "cerveza", "borracho", "sexo", "desnudo", "suicidio", "tortura", "secuestro",
+    },
+}
+
+# Substrings for languages written without spaces between words
+SENSITIVE_SUBSTRINGS = {
+    "hi": ["हत्या", "खून", "बंदूक", "चाकू", "युद्ध", "मौत", "शराब", "आत्महत्या"],
+    "ja": ["殺", "死", "血", "銃", "ナイフ", "戦争", "ゾンビ", "悪夢", "自殺"],
+    "ko": ["죽이", "죽음", "살인", "전쟁", "좀비", "악몽", "자살"],
+    "ar": ["قتل", "سلاح", "مسدس", "سكين", "حرب", "موت", "زومبي", "كابوس", "خمر", "مخدرات", "انتحار"],
+}
+
+# Size of the hashed feature space
+FEATURE_BUCKETS = 1 << 18
+# Logged verdicts needed before a model is trained
+MIN_TRAINING_SAMPLES = 200
+
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def lexicon_hits(prompt: str) -> List[str]:
+    """Return the sensitive lexicon terms found in a prompt."""
+    text = (prompt or "").lower()
+    words = set(_WORD_RE.findall(text))
+    hits = {word for terms in SENSITIVE_WORDS.values() for word in terms & words}
+    hits.update(term for terms in SENSITIVE_SUBSTRINGS.values() for term in terms if term in text)
+    return sorted(hits)
+
+
+def features(prompt: str) -> List[int]:
+    """Hashed word unigrams, word bigrams and character trigrams."""
+    text = (prompt or "").lower()
+    words = _WORD_RE.findall(text)
+    tokens = [f"w:{word}" for word in words]
+    tokens += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    joined = " " + " ".join(words) + " "
+    tokens += [f"c:{joined[i:i + 3]}" for i in range(len(joined) - 2)]
+    return [zlib.crc32(token.encode("utf-8")) % FEATURE_BUCKETS for token in tokens]
+
+
+class LinearModel:
+    """Logistic regression over hashed features; predicts P(prompt is safe)."""
+
+    def __init__(self, weights: Optional[Dict[int, float]] = None, bias: float = 0.0, samples: int = 0):
+        self.weights = weights or {}
+        self.bias = bias
+        self.samples = samples
+
+    def predict(self, prompt: str) -> float:
+        score = self.bias + sum(self.weights.get(index, 0.0) for index in features(prompt))
+        return 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, score))))
+
+    @classmethod
+    def train(cls, examples: List[Tuple[str, int]], epochs: int = 10, learning_rate: float = 0.1, l2: float = 1e-4):
+        """Fit on (prompt, 1 if safe else 0) pairs with plain SGD."""
+        model = cls(samples=len(examples))
+        rows = [(features(prompt), label) for prompt, label in examples]
+        rng = random.Random(0)
+        for _ in range(epochs):
+            rng.shuffle(rows)
+            for indices, label in rows:
+                score = model.bias + sum(model.weights.get(index, 0.0) for index in indices)
+                error = 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, score)))) - label
+                model.bias -= learning_rate * error
+                for index in indices:
+                    weight = model.weights.get(index, 0.0)
+                    model.weights[index] = weight - learning_rate * (error + l2 * weight)
+        return model
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"bias": self.bias, "samples": self.samples, "weights": self.weights}, f)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["LinearModel"]:
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        weights = {int(index): weight for index, weight in data["weights"].items()}
+        return cls(weights, data["bias"], data.get("samples", 0))
+
+
+class PreGuard:
+    """Decides accept / reject / defer for a prompt and counts the outcomes."""
+
+    def __init__(
+        self,
+        enabled: bool = PRE_GUARD_ENABLED,
+        accept_threshold: float = PRE_GUARD_ACCEPT_THRESHOLD,
+        reject_threshold: float = PRE_GUARD_REJECT_THRESHOLD,
+        log_path: str = PRE_GUARD_LOG_PATH,
+        model_path: str = PRE_GUARD_MODEL_PATH,
+    ):
+        self.enabled = enabled
+        self.accept_threshold = accept_threshold
+        self.reject_threshold = reject_threshold
+        self.log_path = log_path
+        self.model_path = model_path
+        self._lock = threading.Lock()
+        self.counts = {"accept": 0, "reject": 0, "defer": 0}
+        try:
+            self.model = LinearModel.load(model_path)
+        except Exception as e:
+            print(f"⚠️ Could not load pre-guard model ({e}), only the lexicon is used")
+            self.model = None
+
+    def check(self, prompt: str) -> Tuple[str, str]:
+        """Return (decision, reason) with decision 'accept', 'reject' or 'defer'."""
+        decision, reason = self._decide(prompt)
+        with self._lock:
+            self.counts[decision] += 1
+        return decision, reason
+
+    def _decide(self, prompt: str) -> Tuple[str, str]:
+        if not self.enabled:
+            return "defer", "pre-guard disabled"
+
+        hits = lexicon_hits(prompt)
+        if hits:
+            return "defer", f"sensitive terms ({', '.join(hits[:3])})"
+
+        if self.model is None:
+            return "defer", "no trained model"
+
+        safe = self.model.predict(prompt)
+        if safe >= self.accept_threshold:
+            return "accept", f"Safe, kid-friendly idea (confidence {safe:.2f})"
+        if safe <= self.reject_threshold:
+            return "reject", f"Likely not suitable for children (confidence {1 - safe:.2f})"
+        return "defer", f"ambiguous ({safe:.2f})"
+
+    def record_verdict(self, prompt: str, safe: bool):
+        """Log an LLM guard verdict as a training example."""
+        if not self.log_path:
+            return
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"prompt": prompt, "safe": bool(safe)}, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"⚠️ Could not log guard verdict: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        decided = counts["accept"] + counts["reject"]
+        return {
+            "enabled": self.enabled,
+            "model_samples": self.model.samples if self.model else 0,
+            "decisions": counts,
+            "hit_rate": round(decided / total, 3) if total else 0.0,
+        }
+
+
+def train_from_log(log_path: str = PRE_GUARD_LOG_PATH, model_path: str = PRE_GUARD_MODEL_PATH) -> Optional[LinearModel]:
+    """Train the classifier from logged verdicts and save it."""
+    if not log_path:
+        print("⚠️ PRE_GUARD_LOG_PATH is not set, no verdicts to train on")
+        return None
+
+    examples = []
+    if os.path.exists(log_path):
+        with open(log_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    examples.append((row["prompt"], 1 if row["safe"] else 0))
+                except (ValueError, KeyError):
+                    continue
+
+    if len(examples) < MIN_TRAINING_SAMPLES:
+        print(f"⚠️ Only {len(examples)} logged verdicts, need {MIN_TRAINING_SAMPLES} to train")
+        return None
+
+    model = LinearModel.train(examples)
+    model.save(model_path)
+    print(f"✅ Pre-guard model trained on {len(examples)} verdicts, saved to {model_path}")
+    return model
+
+
+# Global pre-guard instance
+pre_guard = PreGuard()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "train":
+        train_from_log()
+    else:
+        print("Usage: python pre_guard.py train")
@@ -0,0 +1,172 @@
+"""
+Exact-match cache for the answers of deterministic workflow nodes.
+
+Popular prompts ("dragon", "unicorn princess") and retries make the guard,
+language detection and prompt improvement nodes send identical requests
+again and again. Answers are cached under the node, the model and the
+request messages, with the user's prompt normalized (case and whitespace).
+The system prompt carries the language and age, so they are part of the key.
+
+Two tiers: an in-memory LRU per worker and a local SQLite file shared by
+the workers. Disk entries expire after RESPONSE_CACHE_TTL_HOURS and the
+oldest are evicted beyond RESPONSE_CACHE_MAX_ENTRIES. Story-writing nodes
+are not cached unless listed in RESPONSE_CACHE_NODES.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from config import (
+    RESPONSE_CACHE_NODES,
+    RESPONSE_CACHE_MEMORY_ENTRIES,
+    RESPONSE_CACHE_DB_PATH,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_HOURS,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    node TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_created ON responses (created_at);
+"""
+
+
+def normalize_prompt(text: str) -> str:
+    """Lowercase and collapse whitespace so trivially different prompts share an entry."""
+    return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+
+class ResponseCache:
+    """In-memory LRU in front of a SQLite store, with hit and miss counts per node."""
+
+    # Evict expired and surplus disk entries after this many writes
+    EVICT_EVERY = 100
+
+    def __init__(
+        self,
+        nodes=RESPONSE_CACHE_NODES,
+        memory_entries: int = RESPONSE_CACHE_MEMORY_ENTRIES,
+        path: str = RESPONSE_CACHE_DB_PATH,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        ttl_hours: float = RESPONSE_CACHE_TTL_HOURS,
+    ):
+        self.nodes = set(nodes)
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_hours * 3600
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._counts = {}
+        self._writes = 0
+        self._conn = None
+        if path:
+            try:
+                self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.executescript(SCHEMA)
+            except sqlite3.Error as e:
+                print(f"⚠️ Could not open response cache ({e}), caching in memory only")
+                self._conn = None
+
+    def enabled(self, node: str) -> bool:
+        return node in self.nodes
+
+    def key(self, node: str, model: str, messages) -> str:
+        """Cache key of a request: node, model, system messages and normalized human messages."""
+        parts = [node, model or ""]
+        for message in messages:
+            content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+            parts.append(normalize_prompt(content) if message.type == "human" else content)
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, node: str, key: str) -> Optional[Any]:
+        """Return the cached answer, or None on a miss."""
+        now = time.time()
+        value = None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    value = entry[0]
+                else:
+                    del self._memory[key]
+
+            if value is None and self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] + self.ttl_seconds > now:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1] + self.ttl_seconds)
+
+            counts = self._counts.setdefault(node, {"hits": 0, "misses": 0})
+            counts["hits" if value is not None else "misses"] += 1
+        return value
+
+    def put(self, node: str, key: str, value: Any):
+        """Store a JSON-serializable answer in both tiers."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now + self.ttl_seconds)
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                    (key, node, json.dumps(value, ensure_ascii=False), now),
+                )
+                self._writes += 1
+                if self._writes % self.EVICT_EVERY == 0:
+                    self._evict(now)
+            except sqlite3.Error as e:
+                print(f"⚠️ Could not store cached response: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            nodes = {
+                node: {
+                    **counts,
+                    "hit_rate": round(counts["hits"] / (counts["hits"] + counts["misses"]), 3),
+                }
+                for node, counts in self._counts.items()
+            }
+            disk_entries = (
+                self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                if self._conn is not None
+                else 0
+            )
+            return {
+                "nodes": nodes,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+            }
+
+    def _remember(self, key: str, value: Any, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float):
+        """Drop expired disk entries, then the oldest ones beyond the size limit."""
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+
+# Global response cache instance
+response_cache = ResponseCache()
@@ -0,0 +1,270 @@
+"""
+Near-duplicate cache for guard verdicts.
+
+Kid prompts differ only a little ("a cat that flies", "the flying cat"), so
+the exact-match response cache misses most repeats. This cache embeds the
+prompt, finds the most similar prompt the same guard has already judged and
+reuses that verdict when the cosine similarity clears the threshold for its
+polarity. Reject verdicts need the closer match.
+
+The index is a per-guard-prompt matrix of normalized embeddings searched by
+brute force, kept as a ring buffer of GUARD_SEMANTIC_MAX_ENTRIES rows and
+persisted in the response cache's SQLite file. Entries expire
+with RESPONSE_CACHE_TTL_HOURS. Without an embedding model nothing is cached.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Optional
+
+import numpy as np
+
+from config import (
+    GUARD_SEMANTIC_CACHE_ENABLED,
+    GUARD_SEMANTIC_POSITIVE_THRESHOLD,
+    GUARD_SEMANTIC_NEGATIVE_THRESHOLD,
+    GUARD_SEMANTIC_DIMENSIONS,
+    GUARD_SEMANTIC_MAX_ENTRIES,
+    RESPONSE_CACHE_DB_PATH,
+    RESPONSE_CACHE_TTL_HOURS,
+)
+
+# Guard nodes whose verdicts are reused
+GUARD_NODES = ("validate_prompt", "moderate_prompt", "fused_guard")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS guard_verdicts (
+    namespace TEXT NOT NULL,
+    node TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    value TEXT NOT NULL,
+    positive INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS guard_verdicts_namespace ON guard_verdicts (namespace, created_at);
+"""
+
+
+def is_positive(parsed: dict) -> bool:
+    """Whether a validation, moderation or fused verdict lets the prompt through."""
+    return parsed.get("verdict", "accept") == "accept" and parsed.get("decision", "positive") == "positive"
+
+
+class _NoEmbedding(Exception):
+    """No embedding this time; raised so that lru_cache does not keep the miss."""
+
+
+@lru_cache(maxsize=1024)
+def _embed(prompt: str, dimensions: int) -> np.ndarray:
+    from embeddings import generate_semantic_embedding
+    from response_cache import normalize_prompt
+
+    embedding = generate_semantic_embedding(normalize_prompt(prompt), dimensions, fallback=False)
+    if embedding is None:
+        raise _NoEmbedding()
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if not norm:
+        raise _NoEmbedding()
+    return vector / norm
+
+
+def embed_prompt(prompt: str, dimensions: int = GUARD_SEMANTIC_DIMENSIONS) -> Optional[np.ndarray]:
+    """Unit-length prompt embedding, or None when no embedding model is available.
+
+    Successful embeddings are cached because the parallel guard nodes embed
+    the same prompt; a failed request is retried next time.
+    """
+    try:
+        return _embed(prompt, dimensions)
+    except _NoEmbedding:
+        return None
+
+
+class _Index:
+    """Embeddings and verdicts judged under one guard prompt.
+
+    Rows live in preallocated arrays that double in size up to max_entries
+    and then act as a ring buffer, overwriting the oldest verdict.
+    """
+
+    def __init__(self, dimensions: int, max_entries: int):
+        self.max_entries = max_entries
+        self.size = 0
+        # Row written by the next add
+        self._next = 0
+        self._allocate(min(16, max_entries), dimensions)
+
+    def _allocate(self, capacity: int, dimensions: int):
+        vectors = np.zeros((capacity, dimensions), dtype=np.float32)
+        positive = np.zeros(capacity, dtype=bool)
+        created_at = np.zeros(capacity)
+        if self.size:
+            vectors[:self.size] = self.vectors[:self.size]
+            positive[:self.size] = self.positive[:self.size]
+            created_at[:self.size] = self.created_at[:self.size]
+            self.values += [None] * (capacity - len(self.values))
+        else:
+            self.values = [None] * capacity
+        self.vectors, self.positive, self.created_at = vectors, positive, created_at
+
+    def add(self, vector, value, positive, created_at):
+        capacity = len(self.values)
+        if self.size == capacity and capacity < self.max_entries:
+            self._allocate(min(2 * capacity, self.max_entries), self.vectors.shape[1])
+            self._next = self.size
+        row = self._next
+        self.vectors[row] = vector
+        self.values[row] = value
+        self.positive[row] = positive
+        self.created_at[row] = created_at
+        self._next = (row + 1) % len(self.values)
+        self.size = min(self.size + 1, len(self.values))
+
+    def nearest(self, vector, cutoff: float):
+        """Return (value, positive, similarity) of the most similar unexpired verdict."""
+        similarities = self.vectors[:self.size] @ vector
+        similarities[self.created_at[:self.size] < cutoff] = -1.0
+        row = int(np.argmax(similarities))
+        return self.values[row], bool(self.positive[row]), float(similarities[row])
+
+    def oldest(self) -> float:
+        """Creation time of the verdict the next add overwrites once full."""
+        return float(self.created_at[self._next if self.size == self.max_entries else 0])
+
+
+class SemanticCache:
+    """Reuses guard verdicts of near-duplicate prompts, with hit and miss counts per node."""
+
+    def __init__(
+        self,
+        enabled: bool = GUARD_SEMANTIC_CACHE_ENABLED,
+        positive_threshold: float = GUARD_SEMANTIC_POSITIVE_THRESHOLD,
+        negative_threshold: float = GUARD_SEMANTIC_NEGATIVE_THRESHOLD,
+        dimensions: int = GUARD_SEMANTIC_DIMENSIONS,
+        max_entries: int = GUARD_SEMANTIC_MAX_ENTRIES,
+        path: str = RESPONSE_CACHE_DB_PATH,
+        ttl_hours: float = RESPONSE_CACHE_TTL_HOURS,
+    ):
+        self.is_enabled = enabled
+        self.positive_threshold = positive_threshold
+        self.negative_threshold = negative_threshold
+        self.dimensions = dimensions
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_hours * 3600
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._counts = {}
+        self._conn = None
+        if enabled and path:
+            try:
+                self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.executescript(SCHEMA)
+                self._load()
+            except sqlite3.Error as e:
+                print(f"⚠️ Could not open guard verdict store ({e}), keeping verdicts in memory only")
+                self._conn = None
+
+    def enabled(self, node: str) -> bool:
+        return self.is_enabled and node in GUARD_NODES
+
+    def namespace(self, node: str, model: str, messages) -> str:
+        """Verdicts are only comparable under the same guard, model and system prompt."""
+        system = messages[0].content if messages and messages[0].type == "system" else ""
+        return hashlib.sha256("\x1f".join([node, model or "", system]).encode("utf-8")).hexdigest()[:32]
+
+    def lookup(self, node: str, namespace: str, prompt: str) -> Optional[Any]:
+        """Return the verdict of the nearest judged prompt if it is close enough."""
+        vector = embed_prompt(prompt, self.dimensions)
+        if vector is None:
+            return None
+
+        value, similarity = None, None
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is not None and index.size:
+                nearest, positive, similarity = index.nearest(vector, time.time() - self.ttl_seconds)
+                threshold = self.positive_threshold if positive else self.negative_threshold
+                if similarity >= threshold:
+                    value = nearest
+
+            counts = self._counts.setdefault(node, {"hits": 0, "misses": 0})
+            counts["hits" if value is not None else "misses"] += 1
+
+        if value is not None:
+            print(f"🧭 Reusing {node} verdict of a similar prompt (similarity {similarity:.3f})")
+        return value
+
+    def add(self, node: str, namespace: str, prompt: str, value: dict):
+        """Index a fresh verdict (``{"content", "parsed"}``) under its prompt."""
+        vector = embed_prompt(prompt, self.dimensions)
+        if vector is None:
+            return
+
+        positive = is_positive(value["parsed"])
+        now = time.time()
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                index = self._indexes[namespace] = _Index(self.dimensions, self.max_entries)
+            index.add(vector, value, positive, now)
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    "INSERT INTO guard_verdicts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (namespace, node, prompt, vector.tobytes(), json.dumps(value, ensure_ascii=False), int(positive), now),
+                )
+                self._conn.execute(
+                    "DELETE FROM guard_verdicts WHERE namespace = ? AND created_at < ?",
+                    (namespace, now - self.ttl_seconds),
+                )
+                if index.size == self.max_entries:
+                    self._conn.execute(
+                        "DELETE FROM guard_verdicts WHERE namespace = ? AND created_at < ?",
+                        (namespace, index.oldest()),
+                    )
+            except sqlite3.Error as e:
+                print(f"⚠️ Could not store guard verdict: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            nodes = {
+                node: {
+                    **counts,
+                    "hit_rate": round(counts["hits"] / (counts["hits"] + counts["misses"]), 3),
+                }
+                for node, counts in self._counts.items()
+            }
+            return {
+                "enabled": self.is_enabled,
+                "nodes": nodes,
+                "entries": sum(index.size for index in self._indexes.values()),
+            }
+
+    def _load(self):
+        """Rebuild the in-memory indexes from the unexpired stored verdicts."""
+        rows = self._conn.execute(
+            "SELECT namespace, vector, value, positive, created_at FROM guard_verdicts "
+            "WHERE created_at >= ? ORDER BY created_at",
+            (time.time() - self.ttl_seconds,),
+        ).fetchall()
+        grouped = {}
+        for namespace, vector, value, positive, created_at in rows:
+            vector = np.frombuffer(vector, dtype=np.float32)
+            if vector.shape[0] == self.dimensions:
+                grouped.setdefault(namespace, []).append((vector, json.loads(value), bool(positive), created_at))
+
+        for namespace, entries in grouped.items():
+            index = self._indexes[namespace] = _Index(self.dimensions, self.max_entries)
+            for vector, value, positive, created_at in entries[-self.max_entries:]:
+                index.add(vector, value, positive, created_at)
+
+# Global semantic cache instance
+semantic_cache = SemanticCache()
@@ -0,0 +1,203 @@
+"""
+Pre-generated surprise ideas for instant surprise mode.
+
+A surprise story depends only on the age group and language, so a
+background thread prepares ideas ahead of time: it generates the idea,
+moderates it, improves it and, with SURPRISE_POOL_STORIES, writes the whole
+story with its events held back. A surprise request then takes a ready idea
+from the pool of its (age group, language) pair instead of waiting for those
+LLM calls.
+
+A pair is refilled up to the high watermark whenever it drops below the low
+watermark; pairs are added on first demand or prewarmed for
+SURPRISE_POOL_PREWARM_LANGUAGES. A user is never served an idea they already
+got. Pools live in memory, so each worker process keeps its own.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Optional
+
+from config import (
+    SURPRISE_POOL_LOW_WATERMARK,
+    SURPRISE_POOL_HIGH_WATERMARK,
+    SURPRISE_POOL_STORIES,
+    SURPRISE_POOL_PREWARM_LANGUAGES,
+    SURPRISE_POOL_SEEN_PER_USER,
+)
+
+# Age used for each age group when preparing ideas
+AGE_BY_GROUP = {"6-7": 7, "8-9": 9, "10-12": 11}
+
+# Wait after a failed refill before trying again
+REFILL_BACKOFF_SECONDS = 30
+
+
+def idea_key(idea: str) -> str:
+    from response_cache import normalize_prompt
+
+    return normalize_prompt(idea)
+
+
+class SurprisePool:
+    """Ready surprise ideas per (age group, language), refilled in the background."""
+
+    def __init__(
+        self,
+        low_watermark: int = SURPRISE_POOL_LOW_WATERMARK,
+        high_watermark: int = SURPRISE_POOL_HIGH_WATERMARK,
+        with_stories: bool = SURPRISE_POOL_STORIES,
+        prewarm_languages=SURPRISE_POOL_PREWARM_LANGUAGES,
+        seen_per_user: int = SURPRISE_POOL_SEEN_PER_USER,
+    ):
+        self.low_watermark = low_watermark
+        self.high_watermark = max(high_watermark, low_watermark)
+        self.with_stories = with_stories
+        self.prewarm_languages = prewarm_languages
+        self.seen_per_user = seen_per_user
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pools = {}
+        # Idea keys already served, per user (most recent users last)
+        self._seen = OrderedDict()
+        self._client = None
+        self._thread = None
+        self.counts = {"hits": 0, "misses": 0, "prepared": 0, "rejected": 0, "duplicates": 0, "failed": 0}
+
+    def start(self, client):
+        """Start the refiller with the workflow client whose nodes prepare ideas."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._client = client
+            for language in self.prewarm_languages:
+                for age_group in AGE_BY_GROUP:
+                    self._pools.setdefault((age_group, language), deque())
+            self._thread = threading.Thread(target=self._run, name="surprise-pool", daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def take(self, age_group: str, language: str, user_id: Optional[str]) -> Optional[dict]:
+        """Pop a ready idea this user has not had yet, or None."""
+        entry = None
+        with self._lock:
+            pool = self._pools.setdefault((age_group, language), deque())
+            seen = self._seen.get(user_id, {})
+            for candidate in pool:
+                if idea_key(candidate["idea"]) not in seen:
+                    entry = candidate
+                    break
+            if entry is not None:
+                pool.remove(entry)
+            self.counts["hits" if entry is not None else "misses"] += 1
+            refill = len(pool) < self.low_watermark
+        if refill:
+            self._wake.set()
+        if entry is not None:
+            self.remember(user_id, entry["idea"])
+        return entry
+
+    def remember(self, user_id: Optional[str], idea: str):
+        """Record an idea served to a user so the pool never repeats it for them."""
+        if not user_id:
+            return
+        with self._lock:
+            seen = self._seen.pop(user_id, None) or OrderedDict()
+            seen[idea_key(idea)] = True
+            while len(seen) > self.seen_per_user:
+                seen.popitem(last=False)
+            self._seen[user_id] = seen
+            # Forget the least recently served users first
+            while len(self._seen) > 10000:
+                self._seen.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self._thread is not None,
+                "pools": {f"{age_group}/{language}": len(pool) for (age_group, language), pool in self._pools.items()},
+                **self.counts,
+            }
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=60)
+            self._wake.clear()
+            for pair in self._pairs_to_refill():
+                self._refill(*pair)
+
+    def _pairs_to_refill(self):
+        with self._lock:
+            return [pair for pair, pool in self._pools.items() if len(pool) < self.low_watermark]
+
+    def _refill(self, age_group: str, language: str):
+        """Prepare ideas for one pair until it reaches the high watermark.
+
+        Rejected and duplicate ideas count as attempts, so a model that keeps
+        repeating itself cannot keep the refiller busy.
+        """
+        for _ in range(2 * self.high_watermark):
+            with self._lock:
+                pool = self._pools[(age_group, language)]
+                if len(pool) >= self.high_watermark:
+                    return
+            try:
+                entry = self._prepare(age_group, language)
+            except Exception as e:
+                print(f"⚠️ Surprise pool refill failed for {age_group}/{language}: {e}")
+                self.counts["failed"] += 1
+                time.sleep(REFILL_BACKOFF_SECONDS)
+                return
+            if entry is None:
+                continue
+            with self._lock:
+                if any(idea_key(other["idea"]) == idea_key(entry["idea"]) for other in pool):
+                    self.counts["duplicates"] += 1
+                else:
+                    pool.append(entry)
+                    self.counts["prepared"] += 1
+
+    def _prepare(self, age_group: str, language: str) -> Optional[dict]:
+        """Run the surprise pipeline for one idea; None when moderation rejects it."""
+        from workflow_nodes import SpeculationGate, SurpriseModeNode
+
+        client = self._client
+        # No channel is opened for this run ID, so the nodes' events are dropped
+        state = {
+            "mode": "surprise",
+            "age": AGE_BY_GROUP[age_group],
+            "language": language,
+            "story_data": {},
+            "response": "",
+            "user_id": "surprise_pool",
+            "run_id": f"surprise-pool-{uuid.uuid4().hex}",
+        }
+        SurpriseModeNode(client.surprise_mode.llm)(state)
+        idea = state["prompt"]
+
+        client.parse_response(client.moderate_prompt(state))
+        if state["result"].decision != "positive":
+            self.counts["rejected"] += 1
+            return None
+        getattr(client, client._check_word_count(state))(state)
+
+        entry = {
+            "idea": idea,
+            "prompt": state["prompt"],
+            "age_group": age_group,
+            "result": state["result"].model_dump(),
+        }
+        if self.with_stories:
+            # Keep the story's events to replay them into the run that takes it
+            gate = SpeculationGate(None)
+            state["story_gate"] = gate
+            client.generate_story(state)
+            entry["story"] = state["story"]
+            entry["story_events"] = [[event_type, data] for event_type, data in gate.buffer]
+        return entry
+
+
+# Global surprise pool instance
+surprise_pool = SurprisePool()
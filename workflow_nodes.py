@@ -2,13 +2,20 @@
 Workflow node classes for the LangGraph moderation pipeline.
 """
 
+import asyncio
+import contextvars
 import json
 import re
-from langchain_core.messages import HumanMessage, SystemMessage
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
+from pydantic import BaseModel, Field
 from system_prompts import (
     KID_STORY_PROMPT_GUARD,
     get_moderation_prompt,
+    get_fused_guard_prompt,
     get_improve_short_prompt,
     get_improve_long_prompt,
     get_surprise_story_prompt,
@@ -34,24 +41,219 @@ def get_language_display_name(language_code):
     return LANGUAGE_NAMES.get(language_code, language_code.upper())
 
 
+# Output contracts of the guard nodes, enforced with the model's native
+# JSON-schema structured output
+class ValidationResponse(BaseModel):
+    verdict: str = Field(description="accept, revise, or reject")
+    reason: str = Field(description="Justification for verdict")
+    language: str = Field(description="Detected language")
+    quality_score: int = Field(description="Quality score 0-100")
+    improved_prompt: str = Field(description="Improved version of prompt")
+
+
+class ModerationReasoning(BaseModel):
+    theme: str = Field(description="Main theme analysis")
+    values: str = Field(description="Values and messages present")
+    age_appropriateness: str = Field(description="Suitability for children 6-12")
+
+
+class ModerationResponse(BaseModel):
+    decision: str = Field(description="Either 'positive' or 'negative'")
+    detected_language: str = Field(description="Detected language")
+    summary: str = Field(description="One-line summary")
+    reasoning: ModerationReasoning = Field(description="Reasoning breakdown")
+    safe_alternative: str = Field(description="Safe alternative if negative")
+
+
+class GuardResponse(ValidationResponse):
+    decision: str = Field(description="Either 'positive' or 'negative'")
+    summary: str = Field(description="One-line summary")
+    reasoning: ModerationReasoning = Field(description="Reasoning breakdown")
+    safe_alternative: str = Field(description="Safe alternative if negative")
+
+
+# Guard output fields written for one particular prompt
+PROMPT_SPECIFIC_FIELDS = ("improved_prompt", "safe_alternative")
+
+
+def structured_llm(llm, schema):
+    """Bind an LLM to the schema's JSON-schema mode.
+
+    The bound model returns ``{"raw", "parsed", "parsing_error"}``.
+    """
+    return llm.with_structured_output(schema, method="json_schema", include_raw=True)
+
+
+def in_thread(fn, *args) -> Future:
+    """Run ``fn(*args)`` on a one-off daemon thread with the caller's context."""
+    future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(fn, *args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def cached_invoke(node, llm, messages, schema=None, prompt=None):
+    """Invoke an LLM through the response cache.
+
+    Returns the AIMessage, or with a schema the structured output dict.
+    Nodes not enabled in the cache always call the LLM. Guard nodes that
+    pass the user's ``prompt`` also reuse verdicts of similar prompts.
+    """
+    key, output = _cache_lookup(node, llm, messages, schema)
+    if output is None and _semantic_enabled(node, schema, prompt):
+        output = _semantic_lookup(node, llm, messages, schema, prompt)
+    if output is not None:
+        return output
+
+    output = (structured_llm(llm, schema) if schema else llm).invoke(messages)
+    _cache_store(node, key, llm, messages, output, schema, prompt)
+    return output
+
+
+async def cached_ainvoke(node, llm, messages, schema=None, prompt=None):
+    """Async version of ``cached_invoke``.
+
+    The LLM call starts while the prompt is embedded for the semantic
+    lookup and is cancelled on a hit.
+    """
+    key, output = await asyncio.to_thread(_cache_lookup, node, llm, messages, schema)
+    if output is not None:
+        return output
+
+    bound = structured_llm(llm, schema) if schema else llm
+    if _semantic_enabled(node, schema, prompt):
+        call = asyncio.create_task(bound.ainvoke(messages))
+        try:
+            # Embedding the prompt is a blocking call
+            output = await asyncio.to_thread(_semantic_lookup, node, llm, messages, schema, prompt)
+        except BaseException:
+            call.cancel()
+            raise
+        if output is not None:
+            call.cancel()
+            return output
+        output = await call
+    else:
+        output = await bound.ainvoke(messages)
+    await asyncio.to_thread(_cache_store, node, key, llm, messages, output, schema, prompt)
+    return output
+
+
+def _semantic_enabled(node, schema, prompt):
+    from semantic_cache import semantic_cache
+
+    return bool(prompt and schema and semantic_cache.enabled(node))
+
+
+def _cached_output(cached, schema):
+    raw = AIMessage(content=cached["content"])
+    if schema is None:
+        return raw
+    return {"raw": raw, "parsed": schema.model_validate(cached["parsed"]), "parsing_error": None}
+
+
+def _cache_lookup(node, llm, messages, schema):
+    """Return (key, exact cached output); the key is None when the node is not cached."""
+    from response_cache import response_cache
+
+    if not response_cache.enabled(node):
+        return None, None
+    key = response_cache.key(node, getattr(llm, "model_name", ""), messages)
+    cached = response_cache.get(node, key)
+    if cached is None:
+        return key, None
+    print(f"⚡ Cached answer for {node}")
+    return key, _cached_output(cached, schema)
+
+
+def _semantic_lookup(node, llm, messages, schema, prompt):
+    """Return the verdict of a similar prompt as structured output, or None.
+
+    Suggestions written for the other prompt are left out.
+    """
+    from semantic_cache import semantic_cache
+
+    namespace = semantic_cache.namespace(node, getattr(llm, "model_name", ""), messages)
+    cached = semantic_cache.lookup(node, namespace, prompt)
+    if cached is None:
+        return None
+    parsed = {**cached["parsed"]}
+    for field in PROMPT_SPECIFIC_FIELDS:
+        if field in parsed:
+            parsed[field] = ""
+    return _cached_output({"content": json.dumps(parsed, ensure_ascii=False), "parsed": parsed}, schema)
+
+
+def _cache_store(node, key, llm, messages, output, schema, prompt):
+    """Cache a fresh answer; structured answers only when they parsed."""
+    from response_cache import response_cache
+    from semantic_cache import semantic_cache
+
+    if schema is None:
+        if key is not None:
+            response_cache.put(node, key, {"content": output.content})
+        return
+    if output["parsed"] is None:
+        return
+
+    value = {"content": output["raw"].content, "parsed": output["parsed"].model_dump()}
+    if key is not None:
+        response_cache.put(node, key, value)
+    if prompt and semantic_cache.enabled(node):
+        namespace = semantic_cache.namespace(node, getattr(llm, "model_name", ""), messages)
+        semantic_cache.add(node, namespace, prompt, value)
+
+
 class ChoiceMenuNode:
     """Handle story creation menu and user choice."""
 
     def __call__(self, state):
         from message_bus import message_bus
+        from langgraph_client import RunBudget
+
+        # Every retry comes back here, so this bounds the retry loop
+        budget = state.get("budget") or RunBudget()
+        budget.start_iteration()
+        state["budget"] = budget
 
         mode = state.get("mode", "surprise")
-        message_bus.publish_sync("log", f"📖 Mode selected: {mode}")
+        message_bus.publish_sync("log", f"📖 Mode selected: {mode}", run_id=state.get("run_id"))
         return state
 
+    async def acall(self, state):
+        return self(state)
+
 
 class SurpriseModeNode:
     """Handle surprise mode = instant random story."""
 
-    def __init__(self, llm):
+    def __init__(self, llm, pool=None):
         self.llm = llm
+        # Pre-generated surprise ideas (surprise_pool.SurprisePool), if enabled
+        self.pool = pool
 
     def __call__(self, state):
+        messages = self._prepare(state)
+        if messages is None:
+            return state
+        return self._apply(state, self.llm.invoke(messages))
+
+    async def acall(self, state):
+        messages = self._prepare(state)
+        if messages is None:
+            return state
+        return self._apply(state, await self.llm.ainvoke(messages))
+
+    def _prepare(self, state):
         from message_bus import message_bus
 
         # Use age and language from API request
@@ -64,7 +266,8 @@ class SurpriseModeNode:
         # Debug log
         language_name = get_language_display_name(language)
         message_bus.publish_sync(
-            "log", f"🌍 Language selected: {language_name} (Age: {age})"
+            "log", f"🌍 Language selected: {language_name} (Age: {age})",
+            run_id=state.get("run_id"),
         )
 
         # Determine age group for prompt
@@ -77,14 +280,21 @@ class SurpriseModeNode:
 
         state["age_group"] = age_group
 
+        if self._take_pooled(state):
+            return None
+
         # Generate story idea using LLM
         surprise_prompt = get_surprise_story_prompt()
         messages = [
             SystemMessage(content=surprise_prompt),
             HumanMessage(content=f"Age_group= {age_group}, language= {language}"),
         ]
-        message_bus.publish_sync("log", "✨ Generating story idea...")
-        response = self.llm.invoke(messages)
+        message_bus.publish_sync("log", "✨ Generating story idea...", run_id=state.get("run_id"))
+        return messages
+
+    def _apply(self, state, response):
+        from message_bus import message_bus
+
         prompt = response.content.strip()
 
         # Clean up reasoning (if model outputs meta content)
@@ -92,10 +302,30 @@ class SurpriseModeNode:
             r"<reasoning>.*?</reasoning>", "", prompt, flags=re.DOTALL
         ).strip()
         state["prompt"] = prompt
+        if self.pool is not None:
+            self.pool.remember(state.get("user_id"), prompt)
 
-        message_bus.publish_sync("log", f"💡 Story idea: {prompt}")
+        message_bus.publish_sync("log", f"💡 Story idea: {prompt}", run_id=state.get("run_id"))
         return state
 
+    def _take_pooled(self, state):
+        """Use a ready idea from the pool; it is already moderated and improved."""
+        from message_bus import message_bus
+        from langgraph_client import ModerationResult
+
+        if self.pool is None:
+            return False
+        entry = self.pool.take(state["age_group"], state["language"], state.get("user_id"))
+        if entry is None:
+            return False
+
+        state["pooled"] = entry
+        state["prompt"] = entry["prompt"]
+        state["result"] = ModerationResult(**entry["result"])
+        message_bus.publish_sync("log", f"💡 Story idea: {entry['idea']}", run_id=state.get("run_id"))
+        message_bus.publish_sync("log", "⚡ This idea is already checked and ready", run_id=state.get("run_id"))
+        return True
+
 
 class GuidedModeNode:
     """Handle guided flow mode = structured learning objectives."""
@@ -104,6 +334,14 @@ class GuidedModeNode:
         self.llm = llm
 
     def __call__(self, state):
+        messages = self._prepare(state)
+        return self._apply(state, self.llm.invoke(messages))
+
+    async def acall(self, state):
+        messages = self._prepare(state)
+        return self._apply(state, await self.llm.ainvoke(messages))
+
+    def _prepare(self, state):
         from message_bus import message_bus
 
         story_data = state.get("story_data", {})
@@ -126,6 +364,7 @@ class GuidedModeNode:
         message_bus.publish_sync(
             "log",
             f"🌍 Language selected: {language_name} (Age: {age}, Group: {age_group})",
+            run_id=state.get("run_id"),
         )
         # Add age to story_data for prompt
         story_data["age_group"] = age_group
@@ -136,8 +375,14 @@ class GuidedModeNode:
             SystemMessage(content=guided_prompt),
             HumanMessage(content=json.dumps(story_data)),
         ]
-        message_bus.publish_sync("log", "✨ Generating story idea...")
-        response = self.llm.invoke(messages)
+        message_bus.publish_sync("log", "✨ Generating story idea...", run_id=state.get("run_id"))
+        state["age"] = age
+        state["language"] = language
+        return messages
+
+    def _apply(self, state, response):
+        from message_bus import message_bus
+
         prompt = response.content.strip()
 
         # Clean up reasoning
@@ -145,10 +390,8 @@ class GuidedModeNode:
             r"<reasoning>.*?</reasoning>", "", prompt, flags=re.DOTALL
         ).strip()
         state["prompt"] = prompt
-        state["age"] = age
-        state["language"] = language
 
-        message_bus.publish_sync("log", f"💡 Story idea: {prompt}")
+        message_bus.publish_sync("log", f"💡 Story idea: {prompt}", run_id=state.get("run_id"))
         return state
 
 
@@ -158,7 +401,7 @@ class FreeformModeNode:
     def __call__(self, state):
         from message_bus import message_bus
 
-        message_bus.publish_sync("log", "🎨 Processing your creative story idea...")
+        message_bus.publish_sync("log", "🎨 Processing your creative story idea...", run_id=state.get("run_id"))
 
         prompt = state.get("prompt", "")
         age = state.get("age", 8)
@@ -182,11 +425,52 @@ class FreeformModeNode:
         message_bus.publish_sync(
             "log",
             f"🌍 Language selected: {language_name} (Age: {age}, Group: {age_group})",
+            run_id=state.get("run_id"),
         )
-        message_bus.publish_sync("log", f"💡 Your story idea: {prompt}")
+        message_bus.publish_sync("log", f"💡 Your story idea: {prompt}", run_id=state.get("run_id"))
+
+        return state
+
+    async def acall(self, state):
+        return self(state)
+
+
+class PreGuardNode:
+    """Settle obvious prompts locally before the LLM guard is called."""
+
+    def __init__(self):
+        # Reused to report a local rejection exactly like the LLM validator
+        self.validator = ValidatePromptNode(None)
+
+    def __call__(self, state):
+        from message_bus import message_bus
+        from pre_guard import pre_guard
+        from langgraph_client import ModerationResult, ValidatorResult
 
+        decision, reason = pre_guard.check(state["prompt"])
+        state["pre_guard"] = decision
+        if decision == "defer":
+            return state
+
+        verdict = ValidatorResult(
+            verdict="accept" if decision == "accept" else "reject",
+            reason=reason,
+            language=state.get("language") or "",
+            quality_score=100 if decision == "accept" else 0,
+            improved_prompt="",
+        )
+        self.validator._record(state, verdict)
+        if decision == "accept":
+            state["result"] = ModerationResult(decision="positive", reasoning=reason)
+            message_bus.publish_sync(
+                "log", "✅ Prompt validation passed! Proceeding to moderation...", run_id=state.get("run_id")
+            )
         return state
 
+    async def acall(self, state):
+        # CPU only and well under a millisecond
+        return self(state)
+
 
 class ValidatePromptNode:
     """Validate prompt using KidStoryPromptGuard with Pydantic."""
@@ -195,104 +479,106 @@ class ValidatePromptNode:
         self.llm = llm
 
     def __call__(self, state):
-        from message_bus import message_bus
-        from langchain_core.output_parsers import PydanticOutputParser
-        from pydantic import BaseModel, Field
-
-        message_bus.publish_sync("animation", {"type": "start", "node": "ValidatePromptNode"})
+        messages = self._prepare(state)
+        output = None
+        try:
+            output = cached_invoke("validate_prompt", self.llm, messages, ValidationResponse, prompt=state["prompt"])
+            self._apply(state, output)
+        except Exception as e:
+            self._fail(state, e, output and output["raw"])
+        return self._finish(state)
 
-        class ValidationResponse(BaseModel):
-            verdict: str = Field(description="accept, revise, or reject")
-            reason: str = Field(description="Justification for verdict")
-            language: str = Field(description="Detected language")
-            quality_score: int = Field(description="Quality score 0-100")
-            improved_prompt: str = Field(description="Improved version of prompt")
+    async def acall(self, state):
+        messages = self._prepare(state)
+        output = None
+        try:
+            output = await cached_ainvoke("validate_prompt", self.llm, messages, ValidationResponse, prompt=state["prompt"])
+            self._apply(state, output)
+        except Exception as e:
+            self._fail(state, e, output and output["raw"])
+        return self._finish(state)
 
-        parser = PydanticOutputParser(pydantic_object=ValidationResponse)
+    def _prepare(self, state):
+        from message_bus import message_bus
 
-        message_bus.publish_sync("log", "🔍 Validating your story idea...")
+        message_bus.publish_sync("animation", {"type": "start", "node": "ValidatePromptNode"}, run_id=state.get("run_id"))
+        message_bus.publish_sync("log", "🔍 Validating your story idea...", run_id=state.get("run_id"))
 
-        messages = [
-            SystemMessage(
-                content=KID_STORY_PROMPT_GUARD
-                + "\n\n"
-                + parser.get_format_instructions()
-            ),
+        return [
+            SystemMessage(content=KID_STORY_PROMPT_GUARD),
             HumanMessage(content=f"Validate this prompt: {state['prompt']}"),
         ]
 
-        try:
-            response = self.llm.invoke(messages)
+    def _apply(self, state, output):
+        if output["parsed"] is None:
+            raise output["parsing_error"] or ValueError("No structured output returned")
 
-            # Clean up reasoning text that OpenAI model might include
-            clean_content = re.sub(
-                r"<reasoning>.*?</reasoning>", "", response.content, flags=re.DOTALL
-            )
-            clean_content = clean_content.strip()
+        parsed_response = output["parsed"]
+        print(parsed_response)
+        self._record(state, parsed_response)
 
-            parsed_response = parser.parse(clean_content)
-            print(response)
-            print(parsed_response)
+    def _record(self, state, parsed_response):
+        """Store a parsed verdict and report a failed validation."""
+        from message_bus import message_bus
+
+        # Save validation result
+        from langgraph_client import ValidatorResult
 
-            # Save validation result
-            from langgraph_client import ValidatorResult
+        state["validator_result"] = ValidatorResult(
+            verdict=parsed_response.verdict,
+            reason=parsed_response.reason,
+            language=parsed_response.language,
+            quality_score=parsed_response.quality_score,
+            improved_prompt=parsed_response.improved_prompt,
+        )
 
-            state["validator_result"] = ValidatorResult(
-                verdict=parsed_response.verdict,
-                reason=parsed_response.reason,
-                language=parsed_response.language,
-                quality_score=parsed_response.quality_score,
-                improved_prompt=parsed_response.improved_prompt,
+        if parsed_response.verdict != "accept":
+            # Validation failed, log error
+            validation_details = (
+                f"❌ Validation failed\n\n"
+                f"📊 Verdict: {parsed_response.verdict}\n\n"
+                f"📝 Reason: {parsed_response.reason}\n\n"
+                f"🌍 Language: {parsed_response.language}\n\n"
+                f"⭐ Quality Score: {parsed_response.quality_score}/100\n\n"
             )
+            if parsed_response.improved_prompt:
+                validation_details += f"\n\n💡 Try this instead:\n\n✨ {parsed_response.improved_prompt} ✨"
 
-            if parsed_response.verdict != "accept":
-                # Validation failed, log error
-                validation_details = (
-                    f"❌ Validation failed\n\n"
-                    f"📊 Verdict: {parsed_response.verdict}\n\n"
-                    f"📝 Reason: {parsed_response.reason}\n\n"
-                    f"🌍 Language: {parsed_response.language}\n\n"
-                    f"⭐ Quality Score: {parsed_response.quality_score}/100\n\n"
-                )
-                if parsed_response.improved_prompt:
-                    validation_details += f"\n\n💡 Try this instead:\n\n✨ {parsed_response.improved_prompt} ✨"
-                    
-                message_bus.publish_sync("error", validation_details)
+            # The run channel buffers this until the stream has read it
+            message_bus.publish_sync("error", validation_details, run_id=state.get("run_id"))
 
-                # Small delay to ensure message is sent before workflow ends
-                import time
-                time.sleep(0.1)
+    def _fail(self, state, error, response=None):
+        from message_bus import message_bus
 
-        except Exception as e:
-            print(f"Validation exception: {e}")
-            print(
-                f"ValidatePromptNode - Raw LLM response: {response.content if 'response' in locals() else 'No response'}"
-            )
-            from langgraph_client import ValidatorResult
-
-            state["validator_result"] = ValidatorResult(
-                verdict="reject",
-                reason=f"Failed to parse validator response: {str(e)}",
-                language="unknown",
-                quality_score=0,
-                improved_prompt="",
-            )
+        print(f"Validation exception: {error}")
+        print(
+            f"ValidatePromptNode - Raw LLM response: {response.content if response is not None else 'No response'}"
+        )
+        from langgraph_client import ValidatorResult
+
+        state["validator_result"] = ValidatorResult(
+            verdict="reject",
+            reason=f"Failed to parse validator response: {str(error)}",
+            language="unknown",
+            quality_score=0,
+            improved_prompt="",
+        )
 
-            validation_details = (
-                "❌ Validation failed\n\n"
-                "📊 Verdict: reject\n\n"
-                "📝 Reason: The story idea couldn’t be processed properly. "
-                "Please try a simpler or clearer prompt.\n\n"
-                "🌍 Language: unknown\n\n"
-                "⭐ Quality Score: 0/100\n\n"
-            )
+        validation_details = (
+            "❌ Validation failed\n\n"
+            "📊 Verdict: reject\n\n"
+            "📝 Reason: The story idea couldn’t be processed properly. "
+            "Please try a simpler or clearer prompt.\n\n"
+            "🌍 Language: unknown\n\n"
+            "⭐ Quality Score: 0/100\n\n"
+        )
 
-            message_bus.publish_sync("error", validation_details)
-            
-            import time
-            time.sleep(0.1)
-            
-        message_bus.publish_sync("animation", {"type": "stop", "node": "ValidatePromptNode"})
+        message_bus.publish_sync("error", validation_details, run_id=state.get("run_id"))
+
+    def _finish(self, state):
+        from message_bus import message_bus
+
+        message_bus.publish_sync("animation", {"type": "stop", "node": "ValidatePromptNode"}, run_id=state.get("run_id"))
         return state
 
 
@@ -303,6 +589,38 @@ class DetectLanguageNode:
         self.llm = llm
 
     def __call__(self, state):
+        if self._detect_locally(state):
+            return state
+        messages = self._prepare(state)
+        return self._apply(state, cached_invoke("detect_language", self.llm, messages))
+
+    async def acall(self, state):
+        if self._detect_locally(state):
+            return state
+        messages = self._prepare(state)
+        return self._apply(state, await cached_ainvoke("detect_language", self.llm, messages))
+
+    def _detect_locally(self, state):
+        """Settle the language without an LLM call when the local detector can.
+
+        The requested language is kept unless the prompt clearly reads as
+        another one; prompts too short to tell keep it as well.
+        """
+        from config import LANGUAGE_DETECTION_MIN_CONFIDENCE
+        from language_detector import detect_language
+
+        requested = state.get("language") or ""
+        language, confidence = detect_language(state["prompt"], requested)
+        if not language:
+            if requested:
+                return True
+        elif language == requested or confidence >= LANGUAGE_DETECTION_MIN_CONFIDENCE:
+            state["language"] = language
+            return True
+        print(f"🌍 Local language detection unsure ({language or 'none'}, {confidence:.2f}), asking the LLM")
+        return False
+
+    def _prepare(self, state):
         template = ChatPromptTemplate.from_messages(
             [
                 ("system", get_language_detection_prompt()),
@@ -310,9 +628,9 @@ class DetectLanguageNode:
             ]
         )
 
-        chain = template | self.llm
-        language_response = chain.invoke({"prompt": state["prompt"]})
+        return template.format_messages(prompt=state["prompt"])
 
+    def _apply(self, state, language_response):
         # Clean up any reasoning text that OpenAI model might include
 
         clean_content = re.sub(
@@ -333,76 +651,142 @@ class ModeratePromptNode:
         self.llm = llm
 
     def __call__(self, state):
-        from message_bus import message_bus
-        from langchain_core.output_parsers import PydanticOutputParser
-        from pydantic import BaseModel, Field
-        
-        message_bus.publish_sync("animation", {"type": "start", "node": "ModeratePromptNode"})
+        messages = self._prepare(state)
+        self._apply(state, cached_invoke("moderate_prompt", self.llm, messages, ModerationResponse, prompt=state["prompt"]))
+        return self._finish(state)
 
-        class ModerationResponse(BaseModel):
-            decision: str = Field(description="Either 'positive' or 'negative'")
-            detected_language: str = Field(description="Detected language")
-            summary: str = Field(description="One-line summary")
-            reasoning: dict = Field(description="Reasoning breakdown")
-            safe_alternative: str = Field(description="Safe alternative if negative")
+    async def acall(self, state):
+        messages = self._prepare(state)
+        self._apply(state, await cached_ainvoke("moderate_prompt", self.llm, messages, ModerationResponse, prompt=state["prompt"]))
+        return self._finish(state)
 
-        parser = PydanticOutputParser(pydantic_object=ModerationResponse)
+    def _prepare(self, state):
+        from message_bus import message_bus
+
+        message_bus.publish_sync("animation", {"type": "start", "node": "ModeratePromptNode"}, run_id=state.get("run_id"))
 
-        moderation_prompt = (
-            get_moderation_prompt(state["language"])
-            + "\n\n"
-            + parser.get_format_instructions()
-        )
         messages = [
-            SystemMessage(content=moderation_prompt),
+            SystemMessage(content=get_moderation_prompt(state["language"])),
             HumanMessage(content=f"Analyze this prompt: {state['prompt']}"),
         ]
 
-        message_bus.publish_sync("log", "🛡️ Analyzing prompt for safety...")
+        message_bus.publish_sync("log", "🛡️ Analyzing prompt for safety...", run_id=state.get("run_id"))
+        return messages
 
-        try:
-                response = self.llm.invoke(messages)
+    def _apply(self, state, output):
+        if output["parsed"] is None:
+            # Fallback: hand the raw answer to ParseResponseNode instead of asking again
+            print(f"Moderation parsing failed: {output['parsing_error']}")
+            state["response"] = (output["raw"].content or "").strip()
+            return
+        self._record(state, output["parsed"])
+
+    def _record(self, state, parsed_response):
+        """Store a parsed moderation decision and log its reasoning."""
+        from message_bus import message_bus
+
+        # Convert to expected format
+        from langgraph_client import ModerationResult
+        reasoning = parsed_response.reasoning
+        reasoning_text = f"Theme: {reasoning.theme}. Values: {reasoning.values}. Age: {reasoning.age_appropriateness}."
+        state["result"] = ModerationResult(
+            decision=parsed_response.decision,
+            reasoning=reasoning_text,
+            suggestions=parsed_response.safe_alternative
+        )
 
-                # Clean and extract JSON from response
-                clean_content = response.content.strip()
+        # Parse reasoning into separate lines for display
+        reasoning_parts = reasoning_text.split(". ")
+        reasoning_formatted = "\n".join([f"- {part.strip()}" for part in reasoning_parts if part.strip()])
 
-                # Remove reasoning tags if present
-                clean_content = re.sub(r"<reasoning>.*?</reasoning>", "", clean_content, flags=re.DOTALL)
+        combined_message = f"✅ Decision: {parsed_response.decision}\n\nReasoning:\n{reasoning_formatted}"
+        message_bus.publish_sync("log", combined_message, run_id=state.get("run_id"))
 
-                # Extract JSON from markdown if present
-                json_match = re.search(r"```(?:json)?\s*({.*?})\s*```", clean_content, re.DOTALL)
-                if json_match:
-                    clean_content = json_match.group(1)
+        if parsed_response.safe_alternative:
+            message_bus.publish_sync("log", f"💡 Suggestions: {parsed_response.safe_alternative}", run_id=state.get("run_id"))
 
-                parsed_response = parser.parse(clean_content)
+    def _finish(self, state):
+        from message_bus import message_bus
 
-                # Convert to expected format
-                from langgraph_client import ModerationResult
-                state["result"] = ModerationResult(
-                    decision=parsed_response.decision,
-                    reasoning=f"Theme: {parsed_response.reasoning.get('theme', '')}. Values: {parsed_response.reasoning.get('values', '')}. Age: {parsed_response.reasoning.get('age_appropriateness', '')}.",
-                    suggestions=parsed_response.safe_alternative
-                )
+        message_bus.publish_sync("animation", {"type": "stop", "node": "ModeratePromptNode"}, run_id=state.get("run_id"))
+        return state
 
-                # Parse reasoning into separate lines for display
-                reasoning_parts = f"Theme: {parsed_response.reasoning.get('theme', '')}. Values: {parsed_response.reasoning.get('values', '')}. Age: {parsed_response.reasoning.get('age_appropriateness', '')}.".split(". ")
-                reasoning_formatted = "\n".join([f"- {part.strip()}" for part in reasoning_parts if part.strip()])
 
-                combined_message = f"✅ Decision: {parsed_response.decision}\n\nReasoning:\n{reasoning_formatted}"
-                message_bus.publish_sync("log", combined_message)
+class FusedGuardNode:
+    """Validate and moderate the prompt with a single structured LLM call."""
 
-                if parsed_response.safe_alternative:
-                    message_bus.publish_sync("log", f"💡 Suggestions: {parsed_response.safe_alternative}")
+    def __init__(self, llm):
+        self.llm = llm
+        # Reused to store results and report them exactly like the separate nodes
+        self.validator = ValidatePromptNode(llm)
+        self.moderator = ModeratePromptNode(llm)
 
+    def __call__(self, state):
+        messages = self._prepare(state)
+        output = None
+        try:
+            output = cached_invoke("fused_guard", self.llm, messages, GuardResponse, prompt=state["prompt"])
+            self._apply(state, output)
         except Exception as e:
-                # Fallback: set response for ParseResponseNode to handle
-                print(f"Moderation parsing failed: {e}")
-                response = self.llm.invoke(messages)
-                state["response"] = response.content.strip()
-        message_bus.publish_sync("animation", {"type": "stop", "node": "ModeratePromptNode"})
+            self.validator._fail(state, e, output and output["raw"])
+        return self._finish(state)
+
+    async def acall(self, state):
+        messages = self._prepare(state)
+        output = None
+        try:
+            output = await cached_ainvoke("fused_guard", self.llm, messages, GuardResponse, prompt=state["prompt"])
+            self._apply(state, output)
+        except Exception as e:
+            self.validator._fail(state, e, output and output["raw"])
+        return self._finish(state)
+
+    def _prepare(self, state):
+        from message_bus import message_bus
+
+        message_bus.publish_sync("animation", {"type": "start", "node": "FusedGuardNode"}, run_id=state.get("run_id"))
+        message_bus.publish_sync("log", "🛡️ Checking your story idea...", run_id=state.get("run_id"))
+
+        return [
+            SystemMessage(content=get_fused_guard_prompt(state["language"])),
+            HumanMessage(content=f"Check this prompt: {state['prompt']}"),
+        ]
+
+    def _apply(self, state, output):
+        if output["parsed"] is None:
+            raise output["parsing_error"] or ValueError("No structured output returned")
+
+        parsed_response = output["parsed"]
+        print(parsed_response)
+        self.validator._record(state, parsed_response)
+        self.moderator._record(state, parsed_response)
+
+    def _finish(self, state):
+        from message_bus import message_bus
+
+        message_bus.publish_sync("animation", {"type": "stop", "node": "FusedGuardNode"}, run_id=state.get("run_id"))
         return state
 
 
+class JoinChecksNode:
+    """Wait for the parallel guard and detect-language branches."""
+
+    def __call__(self, state):
+        from pre_guard import pre_guard
+
+        # Log the LLM guard's verdict so the local pre-guard can learn from it
+        validator_result, result = state.get("validator_result"), state.get("result")
+        if validator_result is not None and result is not None:
+            safe = validator_result.verdict == "accept" and result.decision == "positive"
+            pre_guard.record_verdict(state["prompt"], safe)
+
+        # The branches already wrote their results; routing applies the verdict
+        return {}
+
+    async def acall(self, state):
+        return self(state)
+
+
 class ParseResponseNode:
     """Parse the LLM response into structured format."""
 
@@ -468,13 +852,16 @@ class ParseResponseNode:
         combined_message = (
             f"✅ Decision: {decision}\n📖 Reasoning:\n{reasoning_formatted}"
         )
-        message_bus.publish_sync("log", combined_message)
+        message_bus.publish_sync("log", combined_message, run_id=state.get("run_id"))
 
         if suggestions:
-            message_bus.publish_sync("log", f"💡 Suggestions: {suggestions}")
+            message_bus.publish_sync("log", f"💡 Suggestions: {suggestions}", run_id=state.get("run_id"))
 
         return state
 
+    async def acall(self, state):
+        return self(state)
+
 
 class ImproveShortNode:
     """Improve context for prompts with less than 15 words."""
@@ -483,10 +870,18 @@ class ImproveShortNode:
         self.llm = llm
 
     def __call__(self, state):
+        messages = self._prepare(state)
+        return self._apply(state, cached_invoke("improve_short", self.llm, messages))
+
+    async def acall(self, state):
+        messages = self._prepare(state)
+        return self._apply(state, await cached_ainvoke("improve_short", self.llm, messages))
+
+    def _prepare(self, state):
         from message_bus import message_bus
-        message_bus.publish_sync("animation", {"type": "start", "node": "ImproveShortNode"})
-        message_bus.publish_sync("log", "🔄 Starting prompt improvement...")
-        message_bus.publish_sync("log", "✏️ Prompt is too short, improving context...")
+        message_bus.publish_sync("animation", {"type": "start", "node": "ImproveShortNode"}, run_id=state.get("run_id"))
+        message_bus.publish_sync("log", "🔄 Starting prompt improvement...", run_id=state.get("run_id"))
+        message_bus.publish_sync("log", "✏️ Prompt is too short, improving context...", run_id=state.get("run_id"))
         print(f"ImproveShortNode - Original prompt: {state['prompt']}")
 
         improve_prompt = get_improve_short_prompt(state["language"], state["age"])
@@ -496,8 +891,10 @@ class ImproveShortNode:
                 content=f"Expand this short prompt for age {state['age']}: {state['prompt']}"
             ),
         ]
+        return messages
 
-        response = self.llm.invoke(messages)
+    def _apply(self, state, response):
+        from message_bus import message_bus
 
         # Clean up reasoning text if model includes it
         improved_prompt = re.sub(
@@ -506,10 +903,10 @@ class ImproveShortNode:
         improved_prompt = improved_prompt.strip()
 
         print(f"Prompt is too short, improving context...")
-        message_bus.publish_sync("log", f"✨ Enhanced prompt: {improved_prompt}")
+        message_bus.publish_sync("log", f"✨ Enhanced prompt: {improved_prompt}", run_id=state.get("run_id"))
 
         state["prompt"] = improved_prompt
-        message_bus.publish_sync("animation", {"type": "stop", "node": "ImproveShortNode"})
+        message_bus.publish_sync("animation", {"type": "stop", "node": "ImproveShortNode"}, run_id=state.get("run_id"))
         return state
 
 
@@ -520,11 +917,18 @@ class ImproveLongNode:
         self.llm = llm
 
     def __call__(self, state):
-        
+        messages = self._prepare(state)
+        return self._apply(state, cached_invoke("improve_long", self.llm, messages))
+
+    async def acall(self, state):
+        messages = self._prepare(state)
+        return self._apply(state, await cached_ainvoke("improve_long", self.llm, messages))
+
+    def _prepare(self, state):
         from message_bus import message_bus
 
-        message_bus.publish_sync("animation", {"type": "start", "node": "ImproveLongNode"})
-        message_bus.publish_sync("log", "🔄 Enhancing your story idea...")
+        message_bus.publish_sync("animation", {"type": "start", "node": "ImproveLongNode"}, run_id=state.get("run_id"))
+        message_bus.publish_sync("log", "🔄 Enhancing your story idea...", run_id=state.get("run_id"))
         print(f"ImproveLongNode - Original prompt: {state['prompt']}")
 
         improve_prompt = get_improve_long_prompt(state["language"], state["age"])
@@ -534,8 +938,11 @@ class ImproveLongNode:
                 content=f"Enhance this prompt for age {state['age']}: {state['prompt']}"
             ),
         ]
+        return messages
+
+    def _apply(self, state, response):
+        from message_bus import message_bus
 
-        response = self.llm.invoke(messages)
         improved_prompt = response.content.strip()
 
         # Clean up reasoning text
@@ -547,21 +954,91 @@ class ImproveLongNode:
         print(f"ImproveLongNode - Enhanced prompt: {improved_prompt}")
 
         state["prompt"] = improved_prompt
-        message_bus.publish_sync("animation", {"type": "stop", "node": "ImproveLongNode"})
+        message_bus.publish_sync("animation", {"type": "stop", "node": "ImproveLongNode"}, run_id=state.get("run_id"))
         return state
 
 
 class KidStoryGeneratorNode:
     """Generate kid-friendly stories with age and language adaptation."""
 
+    FALLBACK_CHUNK_WORDS = 5
+
     def __init__(self, llm):
         self.llm = llm
 
     def __call__(self, state):
-        
-        from message_bus import message_bus
-        message_bus.publish_sync("animation", {"type": "start", "node": "KidStoryGeneratorNode"})
-        message_bus.publish_sync("log", "🔄 Starting story creation...")
+        if self._replay_pooled(state):
+            return state
+        title_messages, story_messages = self._prepare(state)
+
+        # The title is requested alongside the story, not before it
+        title_future = in_thread(self._title, state, title_messages)
+
+        from langgraph_client import BudgetExhausted
+        from message_bus import RunCancelled
+
+        stream = {"text": "", "received": False, "inside_reasoning": False}
+        try:
+            for chunk in self.llm.stream(story_messages):
+                self._on_chunk(state, stream, chunk.content)
+
+            # Fallback if no chunks received
+            if not stream["received"]:
+                stream["text"] = self.llm.invoke(story_messages).content
+                for chunk_text in self._fallback_chunks(state, stream["text"]):
+                    time.sleep(0.1)
+
+        except (BudgetExhausted, RunCancelled):
+            raise
+        except Exception:
+            # Fallback if streaming fails
+            stream["text"] = self.llm.invoke(story_messages).content
+            for chunk_text in self._fallback_chunks(state, stream["text"]):
+                time.sleep(0.1)
+
+        return self._finish(state, title_future.result(), stream["text"])
+
+    async def acall(self, state):
+        if self._replay_pooled(state):
+            return state
+        title_messages, story_messages = self._prepare(state)
+
+        # The title is requested alongside the story, not before it
+        title_task = asyncio.create_task(self._atitle(state, title_messages))
+
+        from langgraph_client import BudgetExhausted
+        from message_bus import RunCancelled
+
+        stream = {"text": "", "received": False, "inside_reasoning": False}
+        try:
+            try:
+                async for chunk in self.llm.astream(story_messages):
+                    self._on_chunk(state, stream, chunk.content)
+
+                # Fallback if no chunks received
+                if not stream["received"]:
+                    stream["text"] = (await self.llm.ainvoke(story_messages)).content
+                    for chunk_text in self._fallback_chunks(state, stream["text"]):
+                        await asyncio.sleep(0.1)
+
+            except (BudgetExhausted, RunCancelled):
+                # The run is stopping; a second story call would only be wasted
+                raise
+            except Exception:
+                # Fallback if streaming fails
+                stream["text"] = (await self.llm.ainvoke(story_messages)).content
+                for chunk_text in self._fallback_chunks(state, stream["text"]):
+                    await asyncio.sleep(0.1)
+            title = await title_task
+        finally:
+            # No-op once the title has arrived
+            title_task.cancel()
+
+        return self._finish(state, title, stream["text"])
+
+    def _prepare(self, state):
+        self._emit(state, "animation", {"type": "start", "node": "KidStoryGeneratorNode"})
+        self._emit(state, "log", "🔄 Starting story creation...")
         # Use age_group from state or determine from age
         age_group = state.get("age_group")
         if not age_group:
@@ -574,34 +1051,21 @@ class KidStoryGeneratorNode:
                 age_group = "10-12"
             state["age_group"] = age_group
 
-        import time
         timestamp = int(time.time())
 
         # Debug: Log language being used
-        from message_bus import message_bus
         language_name = get_language_display_name(state["language"])
-        message_bus.publish_sync("log", f"📚 Generating story in: {language_name} for age group {age_group}")
+        self._emit(state, "log", f"📚 Generating story in: {language_name} for age group {age_group}")
 
         from system_prompts import get_kid_story_generator_prompt
-        message_bus.publish_sync("log", "✨ Creating your magical story...")
+        self._emit(state, "log", "✨ Creating your magical story...")
 
-        # Step 1: Generate title first
-        # message_bus.publish_sync("log", "🪄 Creating story title...")
+        # Title and story are requested concurrently
         title_messages = [
             SystemMessage(content=f"Generate a short, catchy title (max 8 words) with emojis for a children's story in {state['language']} language."),
             HumanMessage(content=f"Story concept: {state['prompt']}\nAge group: {age_group}\nReturn only the title with no emojis, nothing else.")
         ]
 
-        try:
-            title_response = self.llm.invoke(title_messages).content.strip()
-            title = title_response.replace('"', '').replace("'", '').strip()
-            if len(title) > 100 or len(title.split()) > 10:
-                title = "Magical Adventure"
-        except Exception:
-            title = "Magical Adventure"
-
-        # Step 2: Generate story with the title
-        # message_bus.publish_sync("log", f"✍️ Writing story: {title}...")
         story_messages = [
             SystemMessage(content=get_kid_story_generator_prompt()),
             HumanMessage(
@@ -619,70 +1083,259 @@ class KidStoryGeneratorNode:
                 """
             )
         ]
+        return title_messages, story_messages
+
+    def _replay_pooled(self, state):
+        """Publish a story the surprise pool wrote ahead of time, if there is one."""
+        pooled = state.get("pooled") or {}
+        if not pooled.get("story"):
+            return False
+        for event_type, data in pooled["story_events"]:
+            self._emit(state, event_type, data)
+        state["story"] = pooled["story"]
+        return True
+
+    def _title(self, state, title_messages):
+        try:
+            title = self._clean_title(self.llm.invoke(title_messages).content)
+        except Exception:
+            title = "Magical Adventure"
+        return self._publish_title(state, title)
 
-        story_response = ""
-        chunks_received = False
-        inside_reasoning = False
-
+    async def _atitle(self, state, title_messages):
         try:
-            for chunk in self.llm.stream(story_messages):
-                if chunk.content.strip():
-                    chunks_received = True
-                    story_response += chunk.content
-
-                # Track reasoning tags
-                chunk_content = chunk.content
-                if "<reasoning>" in chunk_content:
-                    inside_reasoning = True
-                if "</reasoning>" in chunk_content:
-                    inside_reasoning = False
-                    continue
-
-                # Only send chunks outside of reasoning
-                if not inside_reasoning and chunk_content:
-                    if not chunk_content.isspace():
-                        message_bus.publish_sync("story_chunk", chunk_content)
+            title = self._clean_title((await self.llm.ainvoke(title_messages)).content)
+        except Exception:
+            title = "Magical Adventure"
+        return self._publish_title(state, title)
 
-            # Fallback if no chunks received
-            if not chunks_received:
-                story_response = self.llm.invoke(story_messages).content
-                words = story_response.split(" ")
-                chunk_size = 5
-                for i in range(0, len(words), chunk_size):
-                    chunk_text = " ".join(words[i : i + chunk_size]) + " "
-                    message_bus.publish_sync("story_chunk", chunk_text)
-                    time.sleep(0.1)
+    def _publish_title(self, state, title):
+        self._emit(state, "story_title", {"title": title})
+        return title
 
-        except Exception:
-            # Fallback if streaming fails
-            story_response = self.llm.invoke(story_messages).content
-            words = story_response.split(" ")
-            chunk_size = 5
-            for i in range(0, len(words), chunk_size):
-                chunk_text = " ".join(words[i : i + chunk_size]) + " "
-                message_bus.publish_sync("story_chunk", chunk_text)
-                time.sleep(0.1)
+    def _emit(self, state, event_type, data):
+        """Publish an event, or hand it to the speculation gate holding the story back."""
+        from message_bus import message_bus
+
+        gate = state.get("story_gate")
+        if gate is not None:
+            gate.publish(event_type, data)
+        else:
+            message_bus.publish_sync(event_type, data, run_id=state.get("run_id"))
 
-        import re
+    def _clean_title(self, title_response):
+        title = title_response.strip().replace('"', '').replace("'", '').strip()
+        if len(title) > 100 or len(title.split()) > 10:
+            title = "Magical Adventure"
+        return title
+
+    def _on_chunk(self, state, stream, chunk_content):
+        """Collect one streamed chunk and publish it unless it is model reasoning."""
+        if chunk_content.strip():
+            stream["received"] = True
+            stream["text"] += chunk_content
+
+        # Track reasoning tags
+        if "<reasoning>" in chunk_content:
+            stream["inside_reasoning"] = True
+        if "</reasoning>" in chunk_content:
+            stream["inside_reasoning"] = False
+            return
+
+        # Only send chunks outside of reasoning
+        if not stream["inside_reasoning"] and chunk_content:
+            if not chunk_content.isspace():
+                self._emit(state, "story_chunk", chunk_content)
+
+    def _fallback_chunks(self, state, story_response):
+        """Publish a non-streamed story in small word chunks, yielding after each."""
+        words = story_response.split(" ")
+        chunk_size = self.FALLBACK_CHUNK_WORDS
+        for i in range(0, len(words), chunk_size):
+            chunk_text = " ".join(words[i : i + chunk_size]) + " "
+            self._emit(state, "story_chunk", chunk_text)
+            yield chunk_text
+
+    def _finish(self, state, title, story_response):
         story_text = re.sub(r"<reasoning>.*?</reasoning>", "", story_response, flags=re.DOTALL).strip()
 
         state["story"] = {"title": title, "story_text": story_text}
-        message_bus.publish_sync("log", f"✅ Story created: {title}")
-        message_bus.publish_sync("story_complete", {"title": title, "story_text": story_text})
-        message_bus.publish_sync("animation", {"type": "stop", "node": "KidStoryGeneratorNode"})
+        self._emit(state, "log", f"✅ Story created: {title}")
+        self._emit(state, "story_complete", {"title": title, "story_text": story_text})
+        self._emit(state, "animation", {"type": "stop", "node": "KidStoryGeneratorNode"})
         return state
 
 
 
+class SpeculationGate:
+    """Holds back the events of a speculatively generated story.
+
+    Events are buffered until ``open()`` releases them and lets later ones
+    through; ``discard()`` drops them for good.
+    """
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.state = "closed"
+        self.buffer = []
+
+    def publish(self, event_type, data):
+        from message_bus import message_bus
+
+        if self.state == "open":
+            message_bus.publish_sync(event_type, data, run_id=self.run_id)
+        elif self.state == "closed":
+            self.buffer.append((event_type, data))
+
+    def open(self):
+        from message_bus import message_bus
+
+        self.state = "open"
+        for event_type, data in self.buffer:
+            message_bus.publish_sync(event_type, data, run_id=self.run_id)
+        self.buffer = []
+
+    def discard(self):
+        self.state = "discarded"
+        self.buffer = []
+
+
+class SpeculativeSurpriseNode:
+    """Write the story of a surprise prompt while it is still being moderated.
+
+    Surprise prompts come from our own LLM call and are nearly always
+    approved, so improvement and story generation start right away on a
+    copy of the state. The story's events are held back until moderation
+    is positive; on a negative decision the story is cancelled and thrown
+    away and the run retries as usual.
+    """
+
+    def __init__(self, moderator, parser, improvers, route, generator):
+        self.moderator = moderator
+        self.parser = parser
+        # improve_short / improve_long, picked by route(state) like the graph does
+        self.improvers = improvers
+        self.route = route
+        self.generator = generator
+
+    def __call__(self, state):
+        # Without a stream to hold back, only improvement overlaps moderation
+        mod_state, gen_state = dict(state), dict(state)
+        executor = ThreadPoolExecutor(max_workers=1)
+        moderation = executor.submit(contextvars.copy_context().run, self._moderate, mod_state)
+        executor.shutdown(wait=False)
+
+        self.improvers[self.route(gen_state)](gen_state)
+        approved = moderation.result()
+        if approved:
+            self.generator(gen_state)
+        return self._merge(state, mod_state, gen_state, approved)
+
+    async def acall(self, state):
+        from message_bus import message_bus
+
+        mod_state, gen_state = dict(state), dict(state)
+        gate = SpeculationGate(state.get("run_id"))
+        gen_state["story_gate"] = gate
+
+        generation = asyncio.create_task(self._agenerate(gen_state))
+        try:
+            approved = await self._amoderate(mod_state)
+        except BaseException:
+            generation.cancel()
+            raise
+
+        if approved:
+            gate.open()
+            await generation
+        else:
+            gate.discard()
+            generation.cancel()
+            await asyncio.wait([generation])
+            message_bus.publish_sync("log", "🗑️ Discarded the story written ahead of moderation", run_id=state.get("run_id"))
+        return self._merge(state, mod_state, gen_state, approved)
+
+    def _moderate(self, mod_state):
+        self.parser(self.moderator(mod_state))
+        return mod_state["result"].decision == "positive"
+
+    async def _amoderate(self, mod_state):
+        self.parser(await self.moderator.acall(mod_state))
+        return mod_state["result"].decision == "positive"
+
+    async def _agenerate(self, gen_state):
+        await self.improvers[self.route(gen_state)].acall(gen_state)
+        await self.generator.acall(gen_state)
+
+    def _merge(self, state, mod_state, gen_state, approved):
+        state["result"] = mod_state["result"]
+        state["response"] = mod_state.get("response", "")
+        if approved:
+            for key in ("prompt", "age_group", "story"):
+                if key in gen_state:
+                    state[key] = gen_state[key]
+        return state
+
+
+def _is_bible_or_frame(path):
+    """Whether a story JSON path is the bible or one frame, in either layout."""
+    return path == ("bible",) or (
+        bool(path) and isinstance(path[-1], int) and path[:-1] in (("frames",), ("frames", "frames"))
+    )
+
+
+def remove_expired_run_outputs(outputs_root):
+    """Delete per-run folders in story_outputs older than STORY_OUTPUTS_TTL_HOURS."""
+    import os
+    import shutil
+    from config import STORY_OUTPUTS_TTL_HOURS
+
+    if not os.path.isdir(outputs_root):
+        return
+    cutoff = time.time() - STORY_OUTPUTS_TTL_HOURS * 3600
+    for entry in os.scandir(outputs_root):
+        if entry.is_dir() and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
 class GenerateStoryImageNode:
     """Generate structured story from improved prompt."""
 
     def __init__(self, llm):
         self.llm = llm
 
+    async def acall(self, state):
+        # Image rendering runs on a blocking thread pool, so keep it off the event loop
+        return await asyncio.to_thread(self, state)
+
+    def _stream_story_json(self, messages, pool):
+        """Stream the story JSON and return its text.
+
+        Each frame goes to the image pool as soon as it is complete. Frame
+        prompts need the bible, so frames that arrive before it wait for it.
+        """
+        from json_stream import JSONStreamParser
+
+        parser = JSONStreamParser(_is_bible_or_frame)
+        bible = None
+        waiting = []
+        # JSON mode, streamed as raw text so frames can be parsed as they arrive
+        for chunk in self.llm.bind(response_format={"type": "json_object"}).stream(messages):
+            for path, value in parser.feed(chunk.content):
+                if path == ("bible",):
+                    bible = value
+                else:
+                    waiting.append((path[-1], value))
+                if bible is not None:
+                    for i, frame in waiting:
+                        print(f"🎨 Frame {i + 1} is complete, rendering its image")
+                        pool.submit(i, frame, bible)
+                    waiting = []
+        return parser.text
+
     def __call__(self, state):
         from message_bus import message_bus
-        message_bus.publish_sync("animation", {"type": "start", "node": "GenerateStoryImageNode"})
+        message_bus.publish_sync("animation", {"type": "start", "node": "GenerateStoryImageNode"}, run_id=state.get("run_id"))
         # Determine age band
         age_band = ""        
         if state["age"] <= 7:
@@ -715,8 +1368,34 @@ class GenerateStoryImageNode:
             SystemMessage(content=story_prompt),
             HumanMessage(content=f"Story seed: {state['prompt']}"),
         ]
+
+        # Each run writes its frame JSON and images to story_outputs/<run_id>,
+        # so concurrent runs never remove each other's files
+        import os
+
+        user_id = state.get("user_id") or state.get("username", "anonymous_user")
+        timestamp = int(time.time())
+        run_id = state.get("run_id")
+        run_folder = re.sub(r"[^\w-]", "", run_id or "") or f"{user_id}_{timestamp}"
+
+        outputs_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "story_outputs")
+        remove_expired_run_outputs(outputs_root)
+        output_dir = os.path.join(outputs_root, run_folder)
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Frame images render in a pool while the story JSON is still streaming
+        from image_generator import ImageGenerator
+
+        image_generator = ImageGenerator(
+            use_mock=False, user_id=user_id, timestamp=timestamp,  # Real image generation
+            cancel_check=lambda: message_bus.is_cancelled(run_id),
+            output_subdir=run_folder,
+        )
+        pool = None
+
         # Retry loop for story generation
         for attempt in range(max_retries):
+            message_bus.raise_if_cancelled(state.get("run_id"))
             try:
                 # Use simplified retry prompts after first attempt
                 if attempt > 0:
@@ -734,26 +1413,16 @@ class GenerateStoryImageNode:
                 from message_bus import message_bus
 
                 message_bus.publish_sync(
-                    "log", f"🔄 Generating story (attempt {attempt + 1})..."
+                    "log", f"🔄 Generating story (attempt {attempt + 1})...",
+                    run_id=state.get("run_id"),
                 )
 
-                response = self.llm.invoke(messages)
-                content = response.content.strip()
-
-                # Clean up reasoning tags
-
-                content = re.sub(
-                    r"<reasoning>.*?</reasoning>", "", content, flags=re.DOTALL
-                )
-                content = content.strip()
+                pool = image_generator.pool()
+                content = self._stream_story_json(messages, pool)
 
                 # Debug: print response info
                 print("\n=== GenerateStoryImageNode LLM Response Debug ===")
                 print(f"Content length: {len(content)}")
-                print(f"Response type: {type(content)}")
-                print(f"Raw response object: {response}")
-                print(f"Raw response content: {response.content}...")
-                print(f"Cleaned content: \n{content}")
                 print("=== End Debug ===\n")
 
                 # Save full response for inspection
@@ -769,51 +1438,15 @@ class GenerateStoryImageNode:
                 with open(debug_file, "w", encoding="utf-8") as f:
                     f.write(f"Attempt {attempt + 1}\n")
                     f.write(f"Content length: {len(content)}\n\n")
-                    f.write(f"Raw response:\n{response.content}\n\n")
-                    f.write(f"Cleaned content: \n{content}\n\n")
+                    f.write(f"Raw response:\n{content}\n\n")
                 print(f"✅ Full response saved to: {debug_file}")
-                print("=== End Debug ===\n")
-
-                # Clean content =  remove markdown if present
-                if '```' in content:
-                    json_match = re.search(
-                        r"```(?:json)?\s*(\{.*\})\s*```", content, re.DOTALL
-                    )
-                    if json_match:
-                        content = json_match.group(1)
 
-                # Try multiple JSON parsing strategies
-                story_json = None
-                # Strategy 1: Direct parsing
+                # JSON mode guarantees a JSON object unless the answer was cut off
                 try:
                     story_json = json.loads(content)
-                except json.JSONDecodeError as e1:
-                    print(f"⚠️ JSON parsing error: {e1}")
-
-                    # Strategy 2: Fix malformed scenes_by_frame structure
-                    try:
-                        fixed_content = content
-                        # Fix missing commas between objects in scenes_by_frame
-                        fixed_content = re.sub(r'}]},\"frame_index\":', '}]},{\"frame_index\":', fixed_content)
-                        # Remove trailing commas and fix quotes
-                        fixed_content = re.sub(r",\s*}", "}", fixed_content)
-                        fixed_content = re.sub(r",\s*]", "]", fixed_content)
-
-                        story_json = json.loads(fixed_content)
-                        print("✅ Fixed JSON parsing with structure repair")
-                    except json.JSONDecodeError as e2:
-                        print(f"⚠️ Structure repair failed: {e2}")
-
-                        # Strategy 3: Extract JSON snippet from text
-                        json_pattern = r"{[^{}]*(?:{[^{}]*}[^{}]*)*}"
-                        matches = re.findall(json_pattern, content, re.DOTALL)
-                        for match in matches:
-                            try:
-                                story_json = json.loads(match)
-                                if "frames" in story_json or "title" in story_json:
-                                    break
-                            except Exception:
-                                continue
+                except ValueError as e:
+                    print(f"⚠️ JSON parsing error: {e}")
+                    story_json = None
 
                 # Success if parsed
                 if story_json:
@@ -835,12 +1468,16 @@ class GenerateStoryImageNode:
                     raise ValueError("❌ Failed to parse JSON from response")
 
             except Exception as e:
+                # Images of a failed attempt's frames are not used
+                if pool is not None:
+                    pool.close()
+                    pool = None
                 if attempt < max_retries - 1:
-                    # Exponential backoff before retry
-                    import time
-
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
+                    # Exponential backoff before retrying API errors; a bad
+                    # answer is retried right away with the simpler prompt
+                    if not isinstance(e, ValueError):
+                        time.sleep(retry_delay)
+                        retry_delay *= 2
                 else:
                     # Fallback to minimal structure
                     state["story_json"] = {
@@ -869,31 +1506,15 @@ class GenerateStoryImageNode:
 
         from message_bus import message_bus
 
-        message_bus.publish_sync("log", "🎉 Story generated successfully!")
+        message_bus.publish_sync("log", "🎉 Story generated successfully!", run_id=state.get("run_id"))
         story_data = state["story_json"]
 
-        # Create output directory for JSON files and clear existing content
-        import os, shutil
-
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        output_dir = os.path.join(base_dir, "story_outputs")
-
-        # Clear existing JSON and image files but preserve audio files
-        if os.path.exists(output_dir):
-            for file in os.listdir(output_dir):
-                file_path = os.path.join(output_dir, file)
-                if not file.endswith((".json", ".png", ".jpg", ".jpeg")):
-                    continue
-                os.remove(file_path)
-        else:
-            os.makedirs(output_dir, exist_ok=True)
-
         # Save complete JSON response to file
         llm_response_path = os.path.join(output_dir, "llm_response.json")
         with open(llm_response_path, "w", encoding="utf-8") as f:
             json.dump(story_data, f, indent=2, ensure_ascii=False)
 
-        message_bus.publish_sync("log", f"💾 Saved story JSON to {llm_response_path}")
+        message_bus.publish_sync("log", f"💾 Saved story JSON to {llm_response_path}", run_id=state.get("run_id"))
 
         # Handle new comprehensive format
         if "frames" in story_data and "frames" in story_data["frames"]:
@@ -903,17 +1524,11 @@ class GenerateStoryImageNode:
             frames = story_data.get("frames", [])
         
         scenes_by_frame = story_data.get("scenes", {}).get("scenes_by_frame", []) 
-        # Generate images for frames
-        from image_generator import ImageGenerator, create_session_dictionary
-
-        message_bus.publish_sync("log", "🎨 Generating images for story frames...")
+        # Wait for the frame images, rendering any frame not started during streaming
+        message_bus.publish_sync("log", "🎨 Generating images for story frames...", run_id=run_id)
 
         bible = story_data.get("bible", {})
-        user_id = state.get("user_id") or state.get("username", "anonymous_user")
-        import time
-        timestamp = int(time.time())
-        image_generator = ImageGenerator(use_mock=False, user_id=user_id, timestamp=timestamp)  # Real image generation
-        image_paths = image_generator.generate_images_for_frames(frames, bible)
+        image_paths = (pool or image_generator.pool()).collect(frames, bible)
 
         # Create session dictionary with full frame data including scenes
         session_dict = {}
@@ -937,7 +1552,8 @@ class GenerateStoryImageNode:
         state["image_paths"] = image_paths
 
         message_bus.publish_sync(
-            "log", f"🖼️ Generated {len(image_paths)} images for story frames"
+            "log", f"🖼️ Generated {len(image_paths)} images for story frames",
+            run_id=state.get("run_id"),
         )
         # Generate individual frame files with bible, frame, scene data, and image path
         for i, frame in enumerate(frames):
@@ -974,7 +1590,8 @@ class GenerateStoryImageNode:
 
         message_bus.publish_sync(
             "log",
-            f"📁 Created {len(frames)} story frames with images and saved individual frame files in story_outputs folder",
+            f"📁 Created {len(frames)} story frames with images and saved individual frame files in story_outputs/{run_folder}",
+            run_id=state.get("run_id"),
         )
-        message_bus.publish_sync("animation", {"type": "stop", "node": "GenerateStoryImageNode"})
+        message_bus.publish_sync("animation", {"type": "stop", "node": "GenerateStoryImageNode"}, run_id=state.get("run_id"))
         return state